@@ -0,0 +1,297 @@
+#asyncio client for ITLA modules: one AsyncITLA per device, many devices on one event loop
+#usage (simulated rack): python ITLA_async.py --lasers 8 --duration 2 --baud 115200
+import argparse
+import asyncio
+import itertools
+import time
+
+import ITLA_reference as itla
+from ITLA_registers import operation,register
+from ITLA_sweep import SweepPoint
+
+class _PriorityLock:
+    #asyncio counterpart of ITLA_reference.TransactionScheduler: one holder, waiters served by aged priority, then arrival
+
+    def __init__(self):
+        self._busy=False
+        self._waiters=[]  #(priority, sequence, enqueued, future) in arrival order
+        self._seq=itertools.count()
+
+    async def acquire(self,priority=itla.PRIORITY_NORMAL):
+        if not self._busy and not self._waiters:
+            self._busy=True
+            return
+        loop=asyncio.get_running_loop()
+        waiter=loop.create_future()
+        self._waiters.append((priority,next(self._seq),loop.time(),waiter))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled(): self.release()  #ownership was handed over before the cancel
+            raise
+
+    def release(self):
+        self._waiters=[entry for entry in self._waiters if not entry[3].done()]
+        if not self._waiters:
+            self._busy=False
+            return
+        now=self._waiters[0][3].get_loop().time()
+        entry=min(self._waiters,key=lambda entry:(itla.ITLAEffectivePriority(entry[0],now-entry[2]),entry[1]))
+        self._waiters.remove(entry)
+        entry[3].set_result(None)  #ownership passes directly to the next waiter
+
+    def pending(self):
+        return sum(1 for entry in self._waiters if not entry[3].done())
+
+class AsyncITLA:
+    """asyncio client owning one module connection.
+
+    Frames are written whole and responses awaited without blocking the loop: ports with a file
+    descriptor (pyserial on POSIX) are switched to non-blocking reads and watched with
+    loop.add_reader; other ports, such as the simulator or Windows serial ports, read in the loop's
+    default executor. Transactions are serialized per device by priority, as with ITLA(), so
+    independent devices run concurrently under asyncio.gather. The connection must not be used
+    through the synchronous ITLA_reference functions at the same time.
+    """
+
+    def __init__(self,sercon,response_timeout=itla.RESPONSE_TIMEOUT,use_fd=None):
+        self.sercon=sercon
+        self.response_timeout=response_timeout
+        self.hooks=[]  #called with the ITLAResult of every operation, like ITLA_reference.ITLAAddHook
+        self._lock=_PriorityLock()
+        self._rx=bytearray()
+        self._resyncs=0     #resyncs and their duration during the current operation
+        self._recovery=0.0
+        self._readable=None
+        self._fd=None
+        fileno=getattr(sercon,'fileno',None)
+        if use_fd is None: use_fd=fileno is not None
+        if use_fd:
+            self._fd=fileno()
+            sercon.timeout=0  #non-blocking reads; readiness comes from the event loop
+            self._readable=asyncio.Event()
+            asyncio.get_running_loop().add_reader(self._fd,self._readable.set)
+        else:
+            sercon.timeout=response_timeout
+
+    @classmethod
+    async def open(cls,port,baudrate=9600,**kwargs):
+        #opens a serial port (see ITLA_reference.ITLAOpen) without blocking the loop
+        sercon=await asyncio.get_running_loop().run_in_executor(None,itla.ITLAOpen,port,baudrate)
+        return cls(sercon,**kwargs)
+
+    def close(self):
+        if self._fd is not None:
+            asyncio.get_running_loop().remove_reader(self._fd)
+            self._fd=None
+        self.sercon.close()
+
+    # frame I/O
+    async def _read_frame(self):
+        if self._fd is None:
+            return await asyncio.get_running_loop().run_in_executor(None,self.sercon.read,4)
+        loop=asyncio.get_running_loop()
+        deadline=loop.time()+self.response_timeout
+        while len(self._rx)<4:
+            self._readable.clear()
+            chunk=self.sercon.read(max(1,self.sercon.in_waiting))
+            if chunk:
+                self._rx+=chunk
+                continue
+            remaining=deadline-loop.time()
+            if remaining<=0: break
+            try:
+                await asyncio.wait_for(self._readable.wait(),remaining)
+            except asyncio.TimeoutError:
+                break
+        frame=bytes(self._rx[:4])
+        del self._rx[:4]
+        return frame
+
+    async def _exchange(self,frame,resend=True):
+        #one command frame -> (status, response frame); realigns the link on a bad checksum or register echo and sends
+        #the frame once more, unless resend is False (AEA continuation reads, see ITLA_reference._transaction)
+        attempts=itla.RESYNC_ATTEMPTS if resend else 1
+        for attempt in range(attempts):
+            self._rx.clear()
+            if self.sercon.in_waiting: self.sercon.reset_input_buffer()  #late bytes of an earlier timed-out response
+            self.sercon.write(frame)
+            response=await self._read_frame()
+            if len(response)<4: return itla.ITLA_NRERROR,None
+            if itla.checksum(*response)!=response[0]>>4: status=itla.ITLA_CSERROR
+            elif response[1]!=frame[1]: status=itla.ITLA_CSERROR  #answer to another frame
+            else: return response[0]&0x03,response
+            if resend and attempt+1==attempts: break
+            self._resyncs+=1
+            result=await asyncio.get_running_loop().run_in_executor(None,itla.ITLAResync,self.sercon)
+            self._recovery+=result.elapsed
+            if not resend or result.outcome!=itla.RESYNC_OK: break
+        return status,response
+
+    async def _execute(self,register_address,data,rw):
+        self._resyncs=0
+        self._recovery=0.0
+        start=time.perf_counter()
+        status,response=await self._exchange(itla.ITLAEncode(register_address,data,rw))
+        if response is None or status not in (itla.ITLA_NOERROR,itla.ITLA_AEERROR):
+            value=0xFFFF if response is None else response[2]*256+response[3]
+        elif status==itla.ITLA_AEERROR and rw==itla.READ:
+            status,payload=await self._aea(response[2]*256+response[3])
+            value=payload.decode('latin-1')
+        else:
+            value=response[2]*256+response[3]
+        result=itla.ITLAResult(register_address,rw,value,status,time.perf_counter()-start,self._resyncs,self._recovery)
+        for hook in self.hooks: hook(result)
+        return result
+
+    async def _aea(self,length):
+        #reads length bytes of AEA data; returns (ITLA_NOERROR, bytearray), or (error, empty bytearray) at the first
+        #failed continuation read, which is not repeated since the module may have advanced its AEA pointer
+        if length>itla.AEA_MAX_BYTES: return itla.ITLA_AEERROR,bytearray()
+        payload=bytearray(length)
+        for offset in range(0,length,2):
+            status,response=await self._exchange(itla.ITLAEncode(0x0B,0,itla.READ),False)
+            if status!=itla.ITLA_NOERROR: return status,bytearray()
+            payload[offset]=response[2]
+            if offset+1<length: payload[offset+1]=response[3]
+        return itla.ITLA_NOERROR,payload
+
+    # transactions
+    async def batch(self,operations,priority=itla.PRIORITY_NORMAL,timeout=itla.QUEUE_TIMEOUT):
+        #runs (register, data, rw) operations as one atomic unit; returns one ITLAResult per operation
+        try:
+            await asyncio.wait_for(self._lock.acquire(priority),timeout)
+        except asyncio.TimeoutError:
+            return [itla.ITLAResult(address,rw,65535,itla.ITLA_QTERROR) for address,data,rw in operations]
+        try:
+            return [await self._execute(address,data,rw) for address,data,rw in operations]
+        finally:
+            self._lock.release()
+
+    async def transact(self,register_address,data,rw,priority=itla.PRIORITY_NORMAL,timeout=itla.QUEUE_TIMEOUT):
+        return(await self.batch([(register_address,data,rw)],priority,timeout))[0]
+
+    # named registers in engineering units, as ITLA_registers.Laser
+    async def read(self,name,priority=itla.PRIORITY_NORMAL):
+        return(await self.read_many(name,priority=priority))[name]
+
+    async def read_many(self,*names,priority=itla.PRIORITY_NORMAL):
+        entries=[register(name) for name in names]
+        addresses=list(dict.fromkeys(entry.address for entry in entries))
+        results=dict(zip(addresses,await self.batch([(address,0,itla.READ) for address in addresses],priority)))
+        return{entry.name:entry.decode(results[entry.address].value) if results[entry.address].ok else None
+               for entry in entries}
+
+    async def write(self,name,value,priority=itla.PRIORITY_NORMAL):
+        return(await self.batch([operation(name,value)],priority))[0]
+
+    async def frequency(self,priority=itla.PRIORITY_NORMAL):
+        values=await self.read_many('lf1_THz','lf2_THz','lf3_THz',priority=priority)
+        if None in values.values(): return None
+        return sum(values.values())
+
+    # higher level operations
+    async def wait_until_settled(self,deadline=itla.SETTLE_TIMEOUT,require_mrdy=True,initial_poll=0.005,max_poll=0.1,
+                                 priority=itla.PRIORITY_NORMAL):
+        #NOP polling with back-off as ITLA_reference.ITLAWaitUntilSettled, without the frequency check
+        start=time.perf_counter()
+        poll=initial_poll
+        polls=0
+        nop=None
+        while True:
+            result=await self.transact(0x00,0,itla.READ,priority)
+            polls+=1
+            if result.ok:
+                nop=result.value
+                if not nop&itla.NOP_PENDING and (nop&itla.NOP_MRDY or not require_mrdy):
+                    return itla.SettleResult(True,time.perf_counter()-start,polls,nop,None)
+            elapsed=time.perf_counter()-start
+            if elapsed>=deadline: return itla.SettleResult(False,elapsed,polls,nop,None)
+            await asyncio.sleep(min(poll,deadline-elapsed))
+            poll=min(poll*2,max_poll)
+
+    async def sweep(self,plan,settle=True,dwell=0.0,snapshot=None,current=None,priority=itla.PRIORITY_NORMAL):
+        #async generator over a SweepPlan, as ITLA_sweep.execute_sweep; snapshot is an optional coroutine function
+        for index,operations in enumerate(plan.operations(current)):
+            status=itla.ITLA_NOERROR
+            if operations:
+                for result in await self.batch(operations,priority):
+                    if not result.ok:
+                        status=result.status
+                        break
+            settle_s=0.0
+            if settle:
+                settle_s=(await self.wait_until_settled(priority=priority)).elapsed
+            if dwell>0: await asyncio.sleep(dwell)
+            yield SweepPoint(index,float(plan.freq_thz[index]),len(operations),status,settle_s,
+                             await snapshot(self) if snapshot is not None else None)
+
+    async def lock(self,error_source,controller,rate_hz=50.0,duration=None,ftf_range=32767,
+                   priority=itla.PRIORITY_CONTROL):
+        #fixed-rate FTF lock loop as ITLA_lock.LockEngine; runs until cancelled or for duration seconds.
+        #Returns (ticks, FTF writes, write errors)
+        loop=asyncio.get_running_loop()
+        ftf_register=register('ftf_MHz')
+        controller.output_limits=(-ftf_range,ftf_range)
+        current=await self.transact(ftf_register.address,0,itla.READ,priority)
+        ftf=int(ftf_register.from_raw(current.value)) if current.ok else 0
+        controller.reset(ftf)
+        period=1.0/rate_hz
+        start=last=loop.time()
+        next_tick=start
+        ticks=writes=errors=0
+        while duration is None or loop.time()-start<duration:
+            delay=next_tick-loop.time()
+            if delay>0: await asyncio.sleep(delay)
+            now=loop.time()
+            dt=now-last if ticks else period
+            last=now
+            ticks+=1
+            error=error_source()
+            if error is not None:
+                target=int(round(controller.update(error,dt)))
+                if target!=ftf:
+                    result=await self.transact(ftf_register.address,target,itla.WRITE,priority)
+                    if result.ok:
+                        ftf=target
+                        writes+=1
+                    else:
+                        errors+=1
+            next_tick+=period*max(1,int((loop.time()-next_tick)/period)+1)
+        return ticks,writes,errors
+
+async def _rack(count,baudrate,duration):
+    #polls temperatures and frequency on every simulated laser while one of them runs a lock loop
+    from ITLA_lock import PID
+    from ITLA_simulator import SimulatedITLA,SimulatedDiscriminator
+    lasers=[AsyncITLA(SimulatedITLA(port='SIM%d' %index,baudrate=baudrate)) for index in range(count)]
+    polls=[0]*count
+
+    async def poll(index):
+        end=time.perf_counter()+duration
+        while time.perf_counter()<end:
+            await lasers[index].read_many('laser_temp_C','lf1_THz','lf2_THz','lf3_THz',priority=itla.PRIORITY_POLL)
+            polls[index]+=1
+
+    discriminator=SimulatedDiscriminator(lasers[0].sercon,drift_mhz_per_s=50.0,seed=1)
+    start=time.perf_counter()
+    cpu=time.process_time()
+    outcome=await asyncio.gather(lasers[0].lock(discriminator,PID(0.3,20.0),rate_hz=50.0,duration=duration),
+                                 *(poll(index) for index in range(count)))
+    wall=time.perf_counter()-start
+    cpu=time.process_time()-cpu
+    for laser in lasers: laser.close()
+    return outcome[0],polls,wall,cpu
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='Drive several simulated modules from one event loop')
+    parser.add_argument('--lasers',type=int,default=4)
+    parser.add_argument('--baud',type=int,default=115200)
+    parser.add_argument('--duration',type=float,default=2.0)
+    args=parser.parse_args(argv)
+    (ticks,writes,errors),polls,wall,cpu=asyncio.run(_rack(args.lasers,args.baud,args.duration))
+    print('%d lasers, %.1f s: %d polls (%.1f/s per laser), lock %d ticks (%.1f Hz), %d FTF writes, %d errors, CPU %.0f%%' %(
+        args.lasers,wall,sum(polls),sum(polls)/len(polls)/wall,ticks,ticks/wall,writes,errors,cpu/wall*100))
+
+if __name__=='__main__':
+    main()
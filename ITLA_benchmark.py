@@ -0,0 +1,264 @@
+#transaction throughput benchmark for ITLA_reference, run against the simulated module or any transport
+#usage: python ITLA_benchmark.py [--baud 9600] [--count 200] [--port /dev/ttyUSB0] [--json results.json] [--compare previous.json]
+import argparse
+import json
+import threading
+import time
+
+import ITLA_reference as itla
+from ITLA_stats import ProtocolStats
+from ITLA_simulator import SimulatedITLA,FAULT_KINDS
+from ITLA_transport import TRANSACTION_AEA,ReplayTransport
+
+def percentile(samples,fraction):
+    #nearest-rank percentile of an already sorted list
+    if not samples: return 0.0
+    index=min(len(samples)-1,max(0,int(round(fraction*len(samples)+0.5))-1))
+    return samples[index]
+
+def measure(name,transaction,count):
+    #runs transaction() count times and returns a result dict with throughput, latency and CPU figures
+    latencies=[]
+    cpu_start=time.process_time()
+    wall_start=time.perf_counter()
+    for _ in range(count):
+        start=time.perf_counter()
+        transaction()
+        latencies.append(time.perf_counter()-start)
+    wall=time.perf_counter()-wall_start
+    cpu=time.process_time()-cpu_start
+    latencies.sort()
+    return{
+        'scenario':name,
+        'count':count,
+        'tps':count/wall if wall>0 else 0.0,
+        'p50_ms':percentile(latencies,0.50)*1e3,
+        'p99_ms':percentile(latencies,0.99)*1e3,
+        'max_ms':latencies[-1]*1e3 if latencies else 0.0,
+        'cpu_ms_per_tx':cpu/count*1e3 if count else 0.0,
+        'cpu_fraction':cpu/wall if wall>0 else 0.0,
+    }
+
+def scenarios(sercon):
+    #name -> zero-argument transaction against the given connection; the write rewrites the current power setpoint
+    setpoint=itla.ITLA(sercon,0x31,0,itla.READ)
+    return{
+        'read':lambda: itla.ITLA(sercon,0x31,0,itla.READ),
+        'write':lambda: itla.ITLA(sercon,0x31,setpoint,itla.WRITE),
+        'aea':lambda: itla.ITLA(sercon,0x58,0,itla.READ),
+        'batch3':lambda: itla.ITLABatch(sercon,[(0x40,0,itla.READ),(0x41,0,itla.READ),(0x68,0,itla.READ)]),
+    }
+
+def run(baudrate=9600,count=200,byte_latency=0.0,response_latency=0.0005,selected=None,framed=False,stats=None,port=None):
+    #port: a transport name for ITLA_reference.ITLAOpen to benchmark instead of the simulator
+    if port is None: sercon=SimulatedITLA(baudrate=baudrate,byte_latency=byte_latency,response_latency=response_latency)
+    else: sercon=itla.ITLAOpen(port,baudrate)
+    if framed: itla.ITLASetFramed(sercon)
+    if stats is not None: itla.ITLAAddHook(sercon,stats)
+    results=[]
+    for name,transaction in scenarios(sercon).items():
+        if selected and name not in selected: continue
+        transaction()  #warm up
+        results.append(measure(name,transaction,count))
+    sercon.close()
+    return results
+
+def run_faults(baudrate=9600,count=200,rate=0.01,framed=False,seed=1):
+    #NOP/read traffic with one fault kind injected at the given probability; measures resync recovery
+    results=[]
+    for kind in FAULT_KINDS:
+        probability=rate if kind=='corrupt' else rate/4  #per frame vs. per byte, so each kind hits about rate of the frames
+        sercon=SimulatedITLA(baudrate=baudrate,faults={kind:probability},fault_seed=seed)
+        if framed: itla.ITLASetFramed(sercon)
+        stats=ProtocolStats()
+        itla.ITLAAddHook(sercon,stats)
+        entry=measure('fault-'+kind,lambda: itla.ITLA(sercon,0x31,0,itla.READ),count)
+        recovery=stats.recovery.summary()
+        entry.update({'faults':sercon.faults_injected[kind],'failed':sum(stats.errors.values()),
+                      'resyncs':stats.resyncs,'recovery_p50_ms':recovery['p50'],'recovery_max_ms':recovery['max']})
+        results.append(entry)
+        sercon.close()
+    return results
+
+def run_replay(path,speed=None,framed=False,stats=None):
+    #replays the transactions of a capture (see ITLA_transport) against the module responses recorded in it;
+    #speed None runs them back to back, otherwise with the recorded gaps and module delays divided by speed.
+    #status_changes counts transactions whose status differs from the capture, mismatches written bytes that do
+    replay=ReplayTransport(path,speed)
+    if framed: itla.ITLASetFramed(replay)
+    if stats is not None: itla.ITLAAddHook(replay,stats)
+    latencies=[]
+    changed=0
+    cpu_start=time.process_time()
+    wall_start=time.perf_counter()
+    for index,recorded in enumerate(replay.transactions):
+        if recorded.status==itla.ITLA_QTERROR: continue  #never reached the module
+        replay.seek(index)
+        if speed and replay.starts[index] is not None:
+            delay=wall_start+replay.starts[index]/speed-time.perf_counter()
+            if delay>0: time.sleep(delay)
+        start=time.perf_counter()
+        if recorded.kind==TRANSACTION_AEA:
+            itla.ITLAReadAEA(replay,recorded.register)
+            status=itla.ITLALastError()
+        else: status=itla.ITLATransact(replay,recorded.register,recorded.data,recorded.kind).status
+        latencies.append(time.perf_counter()-start)
+        if status!=recorded.status: changed+=1
+    wall=time.perf_counter()-wall_start
+    cpu=time.process_time()-cpu_start
+    replay.close()
+    count=len(latencies)
+    latencies.sort()
+    return{
+        'scenario':'replay',
+        'count':count,
+        'tps':count/wall if wall>0 else 0.0,
+        'p50_ms':percentile(latencies,0.50)*1e3,
+        'p99_ms':percentile(latencies,0.99)*1e3,
+        'max_ms':latencies[-1]*1e3 if latencies else 0.0,
+        'cpu_ms_per_tx':cpu/count*1e3 if count else 0.0,
+        'cpu_fraction':cpu/wall if wall>0 else 0.0,
+        'status_changes':changed,
+        'mismatches':replay.mismatches,
+    }
+
+def run_contention(baudrate=9600,duration=2.0,pollers=3,control_period=0.02,framed=False):
+    #pollers read 0x40 back to back at PRIORITY_POLL while one thread writes FTF at PRIORITY_CONTROL
+    sercon=SimulatedITLA(baudrate=baudrate)
+    if framed: itla.ITLASetFramed(sercon)
+    scheduler=itla.ITLAScheduler(sercon)
+    latencies={itla.PRIORITY_CONTROL:[],itla.PRIORITY_POLL:[]}
+    stop=threading.Event()
+
+    def poller():
+        while not stop.is_set():
+            start=time.perf_counter()
+            itla.ITLA(sercon,0x40,0,itla.READ,priority=itla.PRIORITY_POLL)
+            latencies[itla.PRIORITY_POLL].append(time.perf_counter()-start)
+
+    def controller():
+        while not stop.is_set():
+            start=time.perf_counter()
+            itla.ITLA(sercon,0x62,0,itla.WRITE,priority=itla.PRIORITY_CONTROL)
+            latencies[itla.PRIORITY_CONTROL].append(time.perf_counter()-start)
+            stop.wait(control_period)
+
+    threads=[threading.Thread(target=poller) for _ in range(pollers)]+[threading.Thread(target=controller)]
+    cpu_start=time.process_time()
+    for thread in threads: thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads: thread.join()
+    cpu=time.process_time()-cpu_start
+    results=[]
+    for priority,name in ((itla.PRIORITY_CONTROL,'control'),(itla.PRIORITY_POLL,'poll')):
+        samples=sorted(latencies[priority])
+        granted=len(samples) or 1
+        results.append({
+            'scenario':'contention-'+name,
+            'count':len(samples),
+            'tps':len(samples)/duration,
+            'p50_ms':percentile(samples,0.50)*1e3,
+            'p99_ms':percentile(samples,0.99)*1e3,
+            'max_ms':samples[-1]*1e3 if samples else 0.0,
+            'queue_mean_ms':scheduler.wait_total.get(priority,0.0)/granted*1e3,
+            'queue_max_ms':scheduler.wait_max.get(priority,0.0)*1e3,
+            'cpu_ms_per_tx':cpu/(sum(len(v) for v in latencies.values()) or 1)*1e3,
+            'cpu_fraction':cpu/duration,
+        })
+    sercon.close()
+    return results
+
+def run_idle(waiters=4,duration=1.0):
+    #CPU used by callers blocked behind a busy connection
+    sercon=SimulatedITLA()
+    scheduler=itla.ITLAScheduler(sercon)
+    scheduler.acquire()
+    threads=[threading.Thread(target=itla.ITLA,args=(sercon,0x00,0,itla.READ)) for _ in range(waiters)]
+    for thread in threads: thread.start()
+    cpu_start=time.process_time()
+    time.sleep(duration)
+    cpu=time.process_time()-cpu_start
+    scheduler.release()
+    for thread in threads: thread.join()
+    return{'scenario':'idle-wait','count':waiters,'tps':0.0,'p50_ms':0.0,'p99_ms':0.0,'max_ms':0.0,
+           'cpu_ms_per_tx':cpu/waiters*1e3,'cpu_fraction':cpu/duration}
+
+def report(results,previous=None):
+    baseline={entry['scenario']:entry for entry in previous or []}
+    print('%-18s %8s %10s %10s %10s %10s %8s' %('scenario','count','tx/s','p50 ms','p99 ms','cpu ms/tx','cpu %'))
+    for entry in results:
+        line='%-18s %8d %10.1f %10.3f %10.3f %10.3f %8.1f' %(entry['scenario'],entry['count'],entry['tps'],
+            entry['p50_ms'],entry['p99_ms'],entry['cpu_ms_per_tx'],entry['cpu_fraction']*100)
+        old=baseline.get(entry['scenario'])
+        if old and old['tps']>0:
+            line+='   (tx/s %+.1f%%, p50 %+.1f%%)' %((entry['tps']/old['tps']-1)*100,
+                (entry['p50_ms']/old['p50_ms']-1)*100 if old['p50_ms']>0 else 0.0)
+        print(line)
+        if 'queue_mean_ms' in entry:
+            print('%-18s queueing mean %.3f ms, max %.3f ms' %('',entry['queue_mean_ms'],entry['queue_max_ms']))
+        if 'faults' in entry:
+            print('%-18s %d faults, %d failed, %d resyncs, recovery p50 %.3f ms, max %.3f ms' %('',entry['faults'],
+                entry['failed'],entry['resyncs'],entry['recovery_p50_ms'],entry['recovery_max_ms']))
+        if 'status_changes' in entry:
+            print('%-18s %d status changes against the capture, %d mismatched bytes written' %('',entry['status_changes'],
+                entry['mismatches']))
+
+def report_protocol(stats):
+    #per-register latency and error counts collected by a ProtocolStats hook
+    summary=stats.report()
+    print('%d transactions: %d checksum, %d no response, %d execution errors, %d queue timeouts, %d resyncs' %(
+        summary['transactions'],summary['checksum_errors'],summary['no_response'],summary['execution_errors'],
+        summary['queue_timeouts'],summary['resyncs']))
+    if summary['resyncs']:
+        print('resync recovery p50 %.3f ms, p99 %.3f ms, max %.3f ms' %(summary['recovery_ms']['p50'],
+            summary['recovery_ms']['p99'],summary['recovery_ms']['max']))
+    print('%-8s %8s %10s %10s %10s %10s %6s' %('register','count','total ms','p50 ms','p99 ms','max ms','errors'))
+    for register,entry in summary['registers'].items():
+        print('%-8s %8d %10.1f %10.3f %10.3f %10.3f %6d' %(register,entry['count'],entry['total_ms'],entry['p50'],
+            entry['p99'],entry['max'],entry['errors']))
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='ITLA transaction throughput benchmark (simulated module)')
+    parser.add_argument('--baud',type=int,default=9600,help='link baud rate')
+    parser.add_argument('--count',type=int,default=200,help='transactions per scenario')
+    parser.add_argument('--byte-latency',type=float,default=0.0,help='extra device latency per response byte (s)')
+    parser.add_argument('--response-latency',type=float,default=0.0005,help='device turnaround time (s)')
+    parser.add_argument('--scenario',action='append',choices=['read','write','aea','batch3'],help='limit to these scenarios')
+    parser.add_argument('--framed',action='store_true',help='use framed I/O (ITLASetFramed)')
+    parser.add_argument('--contention',action='store_true',help='also run the multi-thread contention and idle-wait scenarios')
+    parser.add_argument('--faults',type=float,metavar='RATE',help='also run the fault-injection scenarios, faulting about RATE of the frames')
+    parser.add_argument('--duration',type=float,default=2.0,help='contention scenario duration (s)')
+    parser.add_argument('--protocol-stats',action='store_true',help='print per-register latency and error counts')
+    parser.add_argument('--replay',metavar='CAPTURE',help='also replay the transactions of a capture file (see ITLA_transport)')
+    parser.add_argument('--speed',type=float,help='replay with the recorded timing divided by SPEED instead of back to back')
+    parser.add_argument('--port',help='benchmark this transport (see ITLA_transport.open_transport) instead of the simulator')
+    parser.add_argument('--json',help='write results to this file')
+    parser.add_argument('--compare',help='print changes relative to a previous --json file')
+    args=parser.parse_args(argv)
+
+    stats=ProtocolStats() if args.protocol_stats else None
+    results=run(args.baud,args.count,args.byte_latency,args.response_latency,args.scenario,args.framed,stats,args.port)
+    if args.contention:
+        results+=run_contention(args.baud,args.duration,framed=args.framed)
+        results.append(run_idle())
+    if args.faults:
+        results+=run_faults(args.baud,args.count,args.faults,args.framed)
+    if args.replay:
+        results.append(run_replay(args.replay,args.speed,args.framed,stats))
+    previous=None
+    if args.compare:
+        with open(args.compare) as handle:
+            previous=json.load(handle)['results']
+    if args.port: print('%s, baud %d, %s I/O' %(args.port,args.baud,'framed' if args.framed else 'per-byte'))
+    else: print('baud %d, byte latency %.6f s, response latency %.6f s, %s I/O' %(args.baud,args.byte_latency,
+        args.response_latency,'framed' if args.framed else 'per-byte'))
+    report(results,previous)
+    if stats is not None: report_protocol(stats)
+    if args.json:
+        with open(args.json,'w') as handle:
+            json.dump({'port':args.port,'baud':args.baud,'framed':args.framed,'byte_latency':args.byte_latency,
+                       'response_latency':args.response_latency,'results':results},handle,indent=2)
+
+if __name__=='__main__':
+    main()
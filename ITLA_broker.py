@@ -0,0 +1,344 @@
+#broker process owning one module connection: clients send prioritized commands over a local socket and
+#read telemetry from a shared-memory ring without touching the serial port
+#usage: python ITLA_broker.py COM5 [--baud 9600] | python ITLA_broker.py --simulate | python ITLA_broker.py --watch
+import argparse
+import json
+import os
+import signal
+import struct
+import sys
+import threading
+import time
+from multiprocessing import AuthenticationError,shared_memory
+from multiprocessing.connection import Client,Listener
+
+import ITLA_reference as itla
+from ITLA_registers import Laser
+from ITLA_telemetry import DEFAULT_COLUMNS,Column,TelemetryRecorder,encode_header,record_struct
+
+DEFAULT_ADDRESS=('localhost',6540)
+KEY_PATH=os.environ.get('ITLA_BROKER_KEY_FILE',os.path.join(os.path.expanduser('~'),'.itla_broker_key'))
+SEQUENCE=struct.Struct('<Q')
+
+_created=set()  #rings created by this process
+
+def write_key(path=KEY_PATH,address=None,key=None):
+    #writes a connection key (random unless given) and the broker's address to a file only the current user can read
+    #(mode 0600) and returns the key. Clients must know the key: the connection unpickles what they send.
+    #Raises RuntimeError instead of replacing the key of another broker that still answers at its address
+    owner=_key_owner(path)
+    if owner is not None and owner!=address: raise RuntimeError('a broker at %r uses the key in %s' %(owner,path))
+    if key is None: key=os.urandom(32)
+    try:
+        os.unlink(path)  #a new file, so an existing one with wider permissions is never reused
+    except FileNotFoundError:
+        pass
+    handle=os.open(path,os.O_WRONLY|os.O_CREAT|os.O_EXCL,0o600)
+    with os.fdopen(handle,'w') as file:
+        file.write(key.hex()+'\n')
+        if address is not None: file.write(json.dumps(address)+'\n')
+    return key
+
+def read_key(path=KEY_PATH):
+    #the key of a running broker; raises OSError if there is no key file
+    with open(path) as handle:
+        return bytes.fromhex(handle.readline().strip())
+
+def _key_owner(path):
+    #address of the broker that accepts the key in path, or None if the file is missing or nothing answers there
+    try:
+        with open(path) as handle:
+            key=bytes.fromhex(handle.readline().strip())
+            address=json.loads(handle.readline() or 'null')
+    except (OSError,ValueError):
+        return None
+    if address is None: return None
+    if isinstance(address,list): address=tuple(address)
+    try:
+        Client(address,authkey=key).close()
+    except (OSError,EOFError,AuthenticationError):
+        return None
+    return address
+
+def _attach_shared_memory(name):
+    try:
+        return shared_memory.SharedMemory(name=name,track=False)  #Python 3.13+
+    except TypeError:
+        segment=shared_memory.SharedMemory(name=name)
+        if os.name=='posix' and segment.name not in _created:
+            #older versions track attached segments too and would unlink the broker's ring when a reader exits
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister('/'+segment.name,'shared_memory')  #tracked under the POSIX name
+        return segment
+
+class TelemetryRing:
+    """Single-writer ring of telemetry records in shared memory, read by any number of processes.
+
+    Layout: the telemetry file header (see ITLA_telemetry.encode_header) with a capacity entry, a uint64
+    count of published records, then capacity slots of [uint64 sequence, record]. A slot's sequence is
+    odd while the broker writes it and 2*(index+1) once record index is complete, so readers detect torn
+    or overwritten slots without locks (seqlock).
+    """
+
+    def __init__(self,segment,columns,capacity,owner):
+        self.segment=segment
+        self.columns=tuple(columns)
+        self.capacity=capacity
+        self.record=record_struct(self.columns)
+        self.slot_size=(SEQUENCE.size+self.record.size+7)//8*8
+        self._owner=owner
+        self._buf=segment.buf
+        self._count_offset=len(encode_header(self.columns,capacity))
+        self._slots=self._count_offset+SEQUENCE.size
+        self._published=SEQUENCE.unpack_from(self._buf,self._count_offset)[0]
+
+    @classmethod
+    def create(cls,columns=DEFAULT_COLUMNS,capacity=4096,name=None):
+        header=encode_header(columns,capacity)
+        record=record_struct(columns)
+        size=len(header)+SEQUENCE.size+capacity*((SEQUENCE.size+record.size+7)//8*8)
+        segment=shared_memory.SharedMemory(name=name,create=True,size=size)
+        _created.add(segment.name)
+        segment.buf[:size]=bytes(size)
+        segment.buf[:len(header)]=header
+        return cls(segment,columns,capacity,True)
+
+    @classmethod
+    def attach(cls,name):
+        segment=_attach_shared_memory(name)
+        length,=struct.unpack_from('<I',segment.buf,8)
+        description=json.loads(bytes(segment.buf[12:12+length]))
+        return cls(segment,(Column(*column) for column in description['columns']),description['capacity'],False)
+
+    @property
+    def name(self):
+        return self.segment.name
+
+    @property
+    def published(self):
+        #number of records written so far; the next record gets this index
+        return SEQUENCE.unpack_from(self._buf,self._count_offset)[0]
+
+    def publish(self,sample):
+        index=self._published
+        offset=self._slots+(index%self.capacity)*self.slot_size
+        SEQUENCE.pack_into(self._buf,offset,2*index+1)
+        self.record.pack_into(self._buf,offset+SEQUENCE.size,*sample)
+        SEQUENCE.pack_into(self._buf,offset,2*index+2)
+        self._published=index+1
+        SEQUENCE.pack_into(self._buf,self._count_offset,self._published)
+
+    def read(self,index):
+        #record tuple with the given index, or None if it is not written yet or was overwritten
+        offset=self._slots+(index%self.capacity)*self.slot_size
+        for _ in range(3):
+            sequence,=SEQUENCE.unpack_from(self._buf,offset)
+            if sequence!=2*index+2:
+                if sequence==2*index+1: continue  #being written right now
+                return None
+            sample=self.record.unpack_from(self._buf,offset+SEQUENCE.size)
+            if SEQUENCE.unpack_from(self._buf,offset)[0]==sequence: return sample
+        return None
+
+    def latest(self):
+        #most recent record as a dict, or None before the first one
+        index=self.published-1
+        sample=self.read(index) if index>=0 else None
+        if sample is None: return None
+        return dict(zip(['time']+[column.name for column in self.columns]+['status'],sample))
+
+    def since(self,index):
+        #(records with index >= index still in the ring, next index to ask for)
+        end=self.published
+        records=[]
+        for position in range(max(index,end-self.capacity),end):
+            sample=self.read(position)
+            if sample is not None: records.append(sample)
+        return records,end
+
+    def close(self):
+        self._buf=None
+        self.segment.close()
+        if self._owner: self.segment.unlink()
+
+class Broker:
+    """Owns a module connection and serves it to local clients.
+
+    Every client connection gets a thread that runs its commands through ITLABatch at the priority the
+    client asks for, so the connection's scheduler still orders control writes ahead of polling. A
+    TelemetryRecorder polls ``columns`` every ``interval`` seconds at PRIORITY_POLL and publishes each
+    record to a TelemetryRing; viewers read the ring directly and add no serial traffic.
+
+    Clients authenticate with ``authkey``. Without one, start() generates a random key and writes it to
+    ``key_path`` with its address (see write_key), and stop() removes the file if it still holds that key.
+    start() refuses to replace the key file of another broker that is still running.
+    """
+
+    def __init__(self,sercon,address=DEFAULT_ADDRESS,authkey=None,columns=DEFAULT_COLUMNS,capacity=4096,
+                 interval=0.1,shm_name=None,key_path=KEY_PATH):
+        self.sercon=sercon
+        self.address=address
+        self.authkey=authkey
+        self.key_path=key_path if authkey is None else None
+        self.ring=TelemetryRing.create(columns,capacity,shm_name)
+        self.recorder=TelemetryRecorder(sercon,columns,capacity=capacity,interval=interval,on_sample=self.ring.publish)
+        self.clients=0
+        self.commands=0
+        self._listener=None
+        self._thread=None
+
+    def start(self):
+        #raises RuntimeError if another broker that is still running uses key_path
+        if self.key_path is not None: self.authkey=os.urandom(32)
+        self._listener=Listener(self.address,authkey=self.authkey)
+        self.address=self._listener.address
+        if self.key_path is not None:
+            try:
+                write_key(self.key_path,self.address,self.authkey)
+            except (OSError,RuntimeError):
+                self._listener.close()
+                self._listener=None
+                raise
+        self.recorder.start()
+        self._thread=threading.Thread(target=self._accept,daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.recorder.stop()
+        if self._listener is not None:
+            self._listener.close()
+            self._listener=None
+        if self.key_path is not None:
+            try:
+                if read_key(self.key_path)==self.authkey: os.unlink(self.key_path)  #not a key another broker wrote since
+            except (OSError,ValueError):
+                pass
+        self.ring.close()
+
+    def info(self):
+        return{'telemetry':self.ring.name,'columns':[list(column) for column in self.ring.columns],
+               'connection':repr(self.sercon)}
+
+    def _accept(self):
+        while self._listener is not None:
+            try:
+                connection=self._listener.accept()
+            except (OSError,EOFError,AuthenticationError):
+                if self._listener is None: return
+                continue  #failed handshake
+            self.clients+=1
+            threading.Thread(target=self._serve,args=(connection,),daemon=True).start()
+
+    def _serve(self,connection):
+        with connection:
+            while True:
+                try:
+                    command,args=connection.recv()
+                except (EOFError,OSError):
+                    return
+                self.commands+=1
+                try:
+                    if command=='batch': reply=('ok',itla.ITLABatch(self.sercon,*args))
+                    elif command=='settle': reply=('ok',itla.ITLAWaitUntilSettled(self.sercon,**args))
+                    elif command=='info': reply=('ok',self.info())
+                    else: reply=('error','unknown command %r' %command)
+                except Exception as error:
+                    reply=('error','%s: %s' %(type(error).__name__,error))
+                connection.send(reply)
+
+class BrokerClient:
+    """Connection to a Broker; thread-safe.
+
+    batch() has the signature of RegisterCache.batch, so Laser(None, cache=client) gives named register
+    access through the broker (see laser()). telemetry() attaches to the broker's shared-memory ring.
+    authkey defaults to the key the broker wrote to key_path.
+    """
+
+    def __init__(self,address=DEFAULT_ADDRESS,authkey=None,key_path=KEY_PATH):
+        if authkey is None: authkey=read_key(key_path)
+        self._connection=Client(address,authkey=authkey)
+        self._lock=threading.Lock()
+        self.info=self._call('info')
+
+    def _call(self,command,args=()):
+        with self._lock:
+            self._connection.send((command,args))
+            status,value=self._connection.recv()
+        if status!='ok': raise RuntimeError(value)
+        return value
+
+    def batch(self,operations,priority=itla.PRIORITY_NORMAL,timeout=itla.QUEUE_TIMEOUT):
+        return self._call('batch',(list(operations),priority,timeout))
+
+    def transact(self,register,data,rw,priority=itla.PRIORITY_NORMAL,timeout=itla.QUEUE_TIMEOUT):
+        return self.batch([(register,data,rw)],priority,timeout)[0]
+
+    def wait_until_settled(self,**kwargs):
+        #ITLAWaitUntilSettled run by the broker; keyword arguments as for that function
+        return self._call('settle',kwargs)
+
+    def laser(self,priority=itla.PRIORITY_NORMAL):
+        return Laser(None,priority,cache=self)
+
+    def telemetry(self):
+        return TelemetryRing.attach(self.info['telemetry'])
+
+    def close(self):
+        self._connection.close()
+
+def _address(text):
+    host,_,port=text.rpartition(':')
+    return(host or 'localhost',int(port))
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='Serve one ITLA module to several local clients')
+    parser.add_argument('port',nargs='?',help='serial port of the module')
+    parser.add_argument('--baud',type=int,default=9600)
+    parser.add_argument('--framed',action='store_true',help='use framed I/O (ITLASetFramed)')
+    parser.add_argument('--simulate',action='store_true',help='serve a simulated module instead of a serial port')
+    parser.add_argument('--interval',type=float,default=0.1,help='telemetry period (s)')
+    parser.add_argument('--address',type=_address,default=DEFAULT_ADDRESS,help='host:port to listen on or connect to')
+    parser.add_argument('--watch',action='store_true',help='print telemetry from a running broker instead')
+    parser.add_argument('--key-file',default=KEY_PATH,help='connection key file, written by the broker (default %(default)s)')
+    args=parser.parse_args(argv)
+
+    if args.watch:
+        client=BrokerClient(args.address,key_path=args.key_file)
+        ring=client.telemetry()
+        try:
+            while True:
+                print(ring.latest())
+                time.sleep(1.0)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            ring.close()
+            client.close()
+        return
+    if args.simulate:
+        from ITLA_simulator import SimulatedITLA
+        sercon=SimulatedITLA(baudrate=args.baud)
+    else:
+        if not args.port: parser.error('give a serial port or --simulate')
+        sercon=itla.ITLAConnect(args.port,args.baud,framed=args.framed)
+        if isinstance(sercon,int): parser.exit(1,'could not connect to %s (error %d)\n' %(args.port,sercon))
+    if args.framed: itla.ITLASetFramed(sercon)
+    broker=Broker(sercon,args.address,interval=args.interval,key_path=args.key_file)
+    try:
+        broker.start()
+    except (OSError,RuntimeError) as error:
+        broker.stop()
+        sercon.close()
+        parser.exit(1,'%s\n' %error)
+    signal.signal(signal.SIGTERM,lambda signum,frame: sys.exit(0))  #clean up the shared memory on termination
+    print('serving %r on %s:%d, telemetry in shared memory %s' %(sercon,broker.address[0],broker.address[1],broker.ring.name))
+    try:
+        while True: time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        broker.stop()
+        sercon.close()
+
+if __name__=='__main__':
+    main()
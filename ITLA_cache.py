@@ -0,0 +1,129 @@
+#optional register cache in front of ITLA_reference, with per-register policies
+import collections
+import threading
+import time
+
+import ITLA_reference as itla
+from ITLA_registers import RESENA_MR,RESENA_SR,address
+
+class CachePolicy(collections.namedtuple('CachePolicy','kind ttl')):
+    #kind is 'static', 'write-through', 'ttl' or 'never'; ttl is the lifetime in seconds for 'ttl'
+    __slots__=()
+
+STATIC=CachePolicy('static',None)               #read once per session
+WRITE_THROUGH=CachePolicy('write-through',None) #changes only when we write it
+NEVER=CachePolicy('never',None)                 #live readouts, always go to the module
+
+def ttl(seconds):
+    #cached value expires after the given number of seconds
+    return CachePolicy('ttl',seconds)
+
+DEFAULT_POLICIES={
+    0x01:STATIC,         #device type
+    0x02:STATIC,         #manufacturer
+    0x03:STATIC,         #model
+    0x04:STATIC,         #serial number
+    0x4F:STATIC,         #FTF range
+    0x52:STATIC,0x53:STATIC,0x54:STATIC,0x55:STATIC,  #frequency limits
+    0x31:WRITE_THROUGH,  #power setpoint
+    0x35:WRITE_THROUGH,0x36:WRITE_THROUGH,0x67:WRITE_THROUGH,  #first channel frequency
+    0x62:WRITE_THROUGH,  #FTF
+    0x90:WRITE_THROUGH,  #whisper mode
+    0x00:NEVER,          #NOP / status flags
+    0x40:NEVER,0x41:NEVER,0x68:NEVER,  #laser frequency
+    0x42:NEVER,0x43:NEVER,0x57:NEVER,0x58:NEVER,
+}
+
+RESET_REGISTER=address('reset_enable')
+RESET_BITS=RESENA_MR|RESENA_SR  #SENA alone keeps the registers
+
+class RegisterCache:
+    """Caching front end for ITLA transactions on one connection.
+
+    Reads are served from the cache according to each register's CachePolicy; writes always go to
+    the module and update the cached value on success. Writing a reset bit to ResEna (0x32) clears
+    the cache, as does invalidate() or reconnect().
+    """
+
+    def __init__(self,sercon,policies=None,default=NEVER):
+        self.sercon=sercon
+        self.policies=dict(DEFAULT_POLICIES)
+        if policies: self.policies.update(policies)
+        self.default=default
+        self.hits=0
+        self.misses=0
+        self.register_hits=collections.Counter()
+        self.register_misses=collections.Counter()
+        self._values={}  #register -> (value, time stored)
+        self._lock=threading.Lock()
+
+    def policy(self,register):
+        return self.policies.get(register,self.default)
+
+    def read(self,register,priority=itla.PRIORITY_NORMAL,timeout=itla.QUEUE_TIMEOUT):
+        return self.transact(register,0,itla.READ,priority,timeout).value
+
+    def write(self,register,data,priority=itla.PRIORITY_NORMAL,timeout=itla.QUEUE_TIMEOUT):
+        return self.transact(register,data,itla.WRITE,priority,timeout).value
+
+    def transact(self,register,data,rw,priority=itla.PRIORITY_NORMAL,timeout=itla.QUEUE_TIMEOUT):
+        #single operation; returns an ITLAResult
+        return self.batch([(register,data,rw)],priority,timeout)[0]
+
+    def batch(self,operations,priority=itla.PRIORITY_NORMAL,timeout=itla.QUEUE_TIMEOUT):
+        #like ITLA_reference.ITLABatch; cached reads are answered locally and the rest go out as one batch
+        results=[None]*len(operations)
+        pending=[]
+        with self._lock:
+            now=time.perf_counter()
+            for index,(register,data,rw) in enumerate(operations):
+                if rw==itla.READ:
+                    cached=self._lookup(register,now)
+                    if cached is not None:
+                        self.hits+=1
+                        self.register_hits[register]+=1
+                        results[index]=itla.ITLAResult(register,rw,cached,itla.ITLA_NOERROR)
+                        continue
+                    self.misses+=1
+                    self.register_misses[register]+=1
+                pending.append(index)
+        if pending:
+            replies=itla.ITLABatch(self.sercon,[operations[index] for index in pending],priority,timeout)
+            with self._lock:
+                now=time.perf_counter()
+                for index,result in zip(pending,replies):
+                    results[index]=result
+                    self._store(result,operations[index][1],now)
+        return results
+
+    def invalidate(self,register=None):
+        #drops one register, or the whole cache when register is None
+        with self._lock:
+            if register is None: self._values.clear()
+            else: self._values.pop(register,None)
+
+    def reconnect(self,sercon):
+        #moves the cache to a new connection to the same module; cached values are discarded
+        self.sercon=sercon
+        self.invalidate()
+
+    def _lookup(self,register,now):
+        entry=self._values.get(register)
+        if entry is None: return None
+        policy=self.policy(register)
+        if policy.kind=='never': return None
+        if policy.kind=='ttl' and now-entry[1]>policy.ttl:
+            del self._values[register]
+            return None
+        return entry[0]
+
+    def _store(self,result,data,now):
+        register=result.register
+        if result.rw==itla.WRITE and register==RESET_REGISTER and data&RESET_BITS:
+            self._values.clear()
+            return
+        if result.status!=itla.ITLA_NOERROR:
+            self._values.pop(register,None)
+            return
+        if self.policy(register).kind!='never':
+            self._values[register]=(result.value,now)
@@ -0,0 +1,307 @@
+#headless job runner: executes a register script or a YAML/JSON job over one connection and prints a timing summary
+#usage: python ITLA_cli.py --port COM5 job.itla | python ITLA_cli.py job.yaml | python ITLA_cli.py --port sim -c 'read laser_temp_C'
+#script lines, '#' starts a comment:
+#  connect <port> [baud]                 read <name>...                  write <name> <value> [<name> <value>...]
+#  frequency <THz>                       enable | disable                settle [deadline_s] [tolerance_MHz]
+#  log <name>... [count=N] [interval=S] [file=PATH]                      sleep <s>
+#jobs hold the same steps: {"port": "COM5", "baud": 9600, "framed": true, "steps": [{"frequency": 193.43},
+#  {"enable": true}, {"settle": {"deadline": 30}}, {"read": ["laser_temp_C"]}, {"log": {"registers": [...], "count": 10}}]}
+#adjacent read/write/frequency/enable steps run as one ITLABatch. Only the standard library is imported up front: the ITLA
+#modules load once the arguments are valid, PyYAML only for .yaml jobs
+import argparse
+import json
+import os
+import sys
+import time
+
+_START=time.perf_counter()
+
+REGISTER_STEPS=('read','write','frequency','enable')
+STEPS=REGISTER_STEPS+('connect','settle','log','sleep')
+
+class JobError(Exception):
+    """A script or job that cannot be run; raised before anything is sent to the module."""
+
+def _number(text,line):
+    try:
+        return float(text)
+    except ValueError:
+        raise JobError('line %d: %r is not a number' %(line,text)) from None
+
+def parse_script(text):
+    #list of (command, argument) steps from register script text
+    steps=[]
+    for line,raw in enumerate(text.splitlines(),1):
+        words=raw.split('#',1)[0].split()
+        if not words: continue
+        command,args=words[0].lower(),words[1:]
+        if command=='connect':
+            if not 1<=len(args)<=2: raise JobError('line %d: connect <port> [baud]' %line)
+            steps.append((command,{'port':args[0],'baud':int(_number(args[1],line)) if len(args)>1 else None}))
+        elif command=='read':
+            if not args: raise JobError('line %d: read needs register names' %line)
+            steps.append((command,args))
+        elif command=='write':
+            if not args or len(args)%2: raise JobError('line %d: write <name> <value> [<name> <value>...]' %line)
+            steps.append((command,{name:_number(value,line) for name,value in zip(args[::2],args[1::2])}))
+        elif command in ('frequency','sleep'):
+            if len(args)!=1: raise JobError('line %d: %s takes one number' %(line,command))
+            steps.append((command,_number(args[0],line)))
+        elif command in ('enable','disable'):
+            if args: raise JobError('line %d: %s takes no arguments' %(line,command))
+            steps.append(('enable',command=='enable'))
+        elif command=='settle':
+            if len(args)>2: raise JobError('line %d: settle [deadline_s] [tolerance_MHz]' %line)
+            numbers=[_number(arg,line) for arg in args]
+            steps.append((command,{'deadline':numbers[0] if numbers else None,'tolerance_mhz':numbers[1] if len(numbers)>1 else None}))
+        elif command=='log':
+            options={'registers':[],'count':1,'interval':1.0,'file':None}
+            for arg in args:
+                key,equals,value=arg.partition('=')
+                if not equals: options['registers'].append(arg)
+                elif key=='count': options['count']=int(_number(value,line))
+                elif key=='interval': options['interval']=_number(value,line)
+                elif key=='file': options['file']=value
+                else: raise JobError('line %d: unknown log option %r' %(line,key))
+            if not options['registers']: raise JobError('line %d: log needs register names' %line)
+            steps.append((command,options))
+        else:
+            raise JobError('line %d: unknown command %r' %(line,command))
+    return steps
+
+def _is_number(value):
+    return isinstance(value,(int,float)) and not isinstance(value,bool)
+
+def _names(value):
+    return isinstance(value,list) and value and all(isinstance(name,str) for name in value)
+
+def _options(args,keys,numbers,index,command):
+    #checks a mapping of step options: known keys only, numbers where numbers are expected
+    if not isinstance(args,dict): raise JobError('step %d: %s takes a mapping' %(index,command))
+    unknown=set(args)-set(keys)
+    if unknown: raise JobError('step %d: unknown %s option %r' %(index,command,sorted(unknown)[0]))
+    for key in numbers:
+        if args.get(key) is not None and not _is_number(args[key]): raise JobError('step %d: %s %s must be a number' %(index,command,key))
+    return args
+
+def parse_job(job):
+    #(connection options, steps) from a decoded YAML/JSON job
+    if not isinstance(job,dict): raise JobError('a job is a mapping with "steps"')
+    options={key:job[key] for key in ('port','baud','framed','upgrade_baud') if key in job}
+    if not isinstance(job.get('steps') or [],list): raise JobError('"steps" is a list')
+    steps=[]
+    for index,step in enumerate(job.get('steps') or [],1):
+        if not isinstance(step,dict) or len(step)!=1: raise JobError('step %d: give exactly one command' %index)
+        (command,args),=step.items()
+        if command=='disable': command,args='enable',False
+        if command not in STEPS: raise JobError('step %d: unknown command %r' %(index,command))
+        if command=='read':
+            if isinstance(args,str): args=[args]
+            if not _names(args): raise JobError('step %d: read takes register names' %index)
+        elif command=='write':
+            if not isinstance(args,dict) or not args or not all(isinstance(name,str) and _is_number(value) for name,value in args.items()):
+                raise JobError('step %d: write takes a mapping of register names to numbers' %index)
+        elif command in ('frequency','sleep'):
+            if not _is_number(args): raise JobError('step %d: %s takes a number' %(index,command))
+        elif command=='enable':
+            if not isinstance(args,bool): raise JobError('step %d: enable takes true or false' %index)
+        elif command=='settle':
+            args={'deadline':None,'tolerance_mhz':None,**_options(args or {},('deadline','tolerance_mhz'),('deadline','tolerance_mhz'),index,command)}
+        elif command=='log':
+            if isinstance(args,list): args={'registers':args}
+            args={'count':1,'interval':1.0,'file':None,**_options(args,('registers','count','interval','file'),('count','interval'),index,command)}
+            if not _names(args['registers']): raise JobError('step %d: log needs register names' %index)
+            if args['file'] is not None and not isinstance(args['file'],str): raise JobError('step %d: log file must be a path' %index)
+            args['count']=int(args['count'])
+        elif command=='connect':
+            if isinstance(args,str): args={'port':args}
+            args=_options(args,('port','baud'),('baud',),index,command)
+            if not isinstance(args.get('port'),str): raise JobError('step %d: connect needs a port' %index)
+        steps.append((command,args))
+    return options,steps
+
+def load_job(path):
+    #(connection options, steps) from a .json/.yaml job or a register script file
+    with open(path) as handle:
+        text=handle.read()
+    if path.endswith('.json'): return parse_job(json.loads(text))
+    if path.endswith(('.yaml','.yml')):
+        try:
+            import yaml
+        except ImportError:
+            raise JobError('PyYAML is needed for YAML jobs (pip install pyyaml)') from None
+        return parse_job(yaml.safe_load(text))
+    return {},parse_script(text)
+
+def step_operations(command,args):
+    #ITLABatch operations of a register step; raises KeyError or ValueError for unknown names and values out of range
+    import ITLA_reference as itla
+    from ITLA_registers import RESENA_SENA,address,channel_frequency,operation,register
+    if command=='read': return [(entry,0,itla.READ) for entry in dict.fromkeys(register(name).address for name in args)]
+    if command=='write': return [operation(name,value) for name,value in args.items()]
+    if command=='frequency':
+        try:
+            values=channel_frequency(float(args))
+        except ValueError as error:
+            raise JobError('frequency: %s' %error) from None
+        return [(address(name),value,itla.WRITE) for name,value in zip(('fcf1_THz','fcf2_THz','fcf3_THz'),values)]
+    return [operation('reset_enable',RESENA_SENA if args else 0)]
+
+class JobRunner:
+    """Runs parsed steps over one connection.
+
+    Register steps are converted and checked first (names, ranges), then adjacent ones are sent as a
+    single ITLABatch. Each batch, settle, log and sleep is timed for the summary; ``values`` collects
+    what was read, ``failures`` the steps that did not complete.
+    """
+
+    def __init__(self,sercon,out=sys.stdout):
+        import ITLA_reference as itla
+        from ITLA_registers import Laser
+        self.itla=itla
+        self.sercon=sercon
+        self.laser=Laser(sercon)
+        self.out=out
+        self.values={}
+        self.timings=[]   #(label, seconds, transactions)
+        self.failures=[]
+
+    def prepare(self,command,args):
+        #(operations, handler) for a register step; handler receives the step's ITLAResults
+        from ITLA_registers import register
+        operations=step_operations(command,args)
+        if command=='read':
+            entries=[register(name) for name in args]
+            def handler(results):
+                results={result.register:result for result in results}
+                for entry in entries:
+                    result=results[entry.address]
+                    value=entry.decode(result.value) if result.ok else None
+                    self.values[entry.name]=value
+                    if value is None: self.failures.append('read %s: status %d' %(entry.name,result.status))
+                    else: self.out.write('%s = %s %s\n' %(entry.name,'%.6g' %value if isinstance(value,float) else value,entry.unit))
+            return operations,handler
+        label='%s %s' %(command,args)
+        def handler(results):
+            for result in results:
+                if not result.ok: self.failures.append('%s: register 0x%02X status %d' %(label,result.register,result.status))
+        return operations,handler
+
+    def run(self,steps,keep_going=False):
+        #returns True if every step succeeded
+        pending=[]
+        for command,args in steps+[(None,None)]:
+            if command in REGISTER_STEPS:
+                pending.append((command,)+self.prepare(command,args))
+                continue
+            if pending:
+                self._batch(pending)
+                pending=[]
+            if self.failures and not keep_going: return False
+            if command=='settle': self._settle(**args)
+            elif command=='log': self._log(**args)
+            elif command=='sleep':
+                start=time.perf_counter()
+                time.sleep(args)
+                self.timings.append(('sleep',time.perf_counter()-start,0))
+            elif command=='connect': raise JobError('connect must be the first step')
+        return not self.failures
+
+    def _batch(self,pending):
+        operations=[operation for _,step_operations,_ in pending for operation in step_operations]
+        start=time.perf_counter()
+        results=self.itla.ITLABatch(self.sercon,operations)
+        self.timings.append(('batch (%s)' %', '.join(command for command,_,_ in pending),time.perf_counter()-start,len(operations)))
+        offset=0
+        for _,step_operations,handler in pending:
+            handler(results[offset:offset+len(step_operations)])
+            offset+=len(step_operations)
+
+    def _settle(self,deadline=None,tolerance_mhz=None):
+        settle=self.itla.ITLAWaitUntilSettled(self.sercon,deadline if deadline is not None else self.itla.SETTLE_TIMEOUT,tolerance_mhz)
+        polls=settle.polls*(1 if tolerance_mhz is None else 4)
+        self.timings.append(('settle',settle.elapsed,polls))
+        if settle.settled: self.out.write('settled after %.3f s\n' %settle.elapsed)
+        else: self.failures.append('settle: not settled after %.3f s' %settle.elapsed)
+
+    def _log(self,registers,count=1,interval=1.0,file=None):
+        handle=open(file,'w') if file else self.out
+        start=time.perf_counter()
+        transactions=0
+        try:
+            handle.write(','.join(['time_s']+list(registers))+'\n')
+            for index in range(count):
+                due=start+index*interval
+                if due>time.perf_counter(): time.sleep(due-time.perf_counter())
+                values=self.laser.read_many(*registers)
+                transactions+=len(step_operations('read',registers))
+                handle.write(','.join(['%.3f' %(time.perf_counter()-start)]+['' if value is None else '%s' %value for value in values.values()])+'\n')
+                if None in values.values(): self.failures.append('log: read failed at sample %d' %index)
+        finally:
+            if file: handle.close()
+        self.timings.append(('log',time.perf_counter()-start,transactions))
+
+def summary(timings,startup,connect,total):
+    lines=['%-34s %10s %6s' %('timing','ms','tx'),'%-34s %10.1f' %('startup (imports)',startup*1e3)]
+    if connect is not None: lines.append('%-34s %10.1f' %('connect',connect*1e3))
+    for label,seconds,transactions in timings:
+        lines.append('%-34s %10.1f %6d' %(label[:34],seconds*1e3,transactions))
+    lines.append('%-34s %10.1f %6d' %('total',total*1e3,sum(transactions for _,_,transactions in timings)))
+    return '\n'.join(lines)+'\n'
+
+def main(argv=None):
+    parser=argparse.ArgumentParser(description='Run a register script or YAML/JSON job on an ITLA module')
+    parser.add_argument('job',nargs='?',help='job file: .json, .yaml/.yml or a register script')
+    parser.add_argument('-c','--command',action='append',default=[],help='script line to run after the job (repeatable)')
+    parser.add_argument('--port',help="port name (see ITLA_transport.open_transport); overrides the job's")
+    parser.add_argument('--baud',type=int,help='initial baud rate (default 9600)')
+    parser.add_argument('--framed',action='store_true',help='use framed I/O (ITLASetFramed)')
+    parser.add_argument('--upgrade-baud',action='store_true',help='move to the fastest working baud rate after connecting')
+    parser.add_argument('--capture',help='record the session to this capture file (see ITLA_transport)')
+    parser.add_argument('--keep-going',action='store_true',help='run the remaining steps after a failure')
+    parser.add_argument('--json',action='store_true',help='print values and timings as JSON; the summary goes to stderr')
+    args=parser.parse_args(argv)
+    if not args.job and not args.command: parser.error('give a job file or --command')
+
+    try:
+        options,steps=load_job(args.job) if args.job else ({},[])
+        steps+=parse_script('\n'.join(args.command))
+        if steps and steps[0][0]=='connect':
+            options.update((key,value) for key,value in steps.pop(0)[1].items() if value is not None)
+        port=args.port or options.get('port')
+        if not port: raise JobError('no port: use --port or a connect step')
+        if args.capture and os.path.exists(args.capture): raise JobError('%s exists; captures are never overwritten' %args.capture)
+        import ITLA_reference as itla
+        startup=time.perf_counter()-_START
+        for command,step_args in steps:  #checks names and ranges before connecting
+            if command in REGISTER_STEPS: step_operations(command,step_args)
+            elif command=='log': step_operations('read',step_args['registers'])
+    except (JobError,OSError,ValueError,KeyError) as error:
+        parser.exit(2,'%s: error: %s\n' %(parser.prog,error.args[0] if isinstance(error,KeyError) else error))
+
+    start=time.perf_counter()
+    sercon=itla.ITLAConnect(port,args.baud or options.get('baud',9600),framed=args.framed or options.get('framed',False),
+                            upgrade_baud=args.upgrade_baud or options.get('upgrade_baud',False),capture=args.capture)
+    connect=time.perf_counter()-start
+    if isinstance(sercon,int): parser.exit(1,'could not connect to %s (error %d)\n' %(port,sercon))
+    try:
+        runner=JobRunner(sercon,sys.stderr if args.json else sys.stdout)
+        ok=runner.run(steps,args.keep_going)
+    except JobError as error:
+        parser.exit(2,'%s: error: %s\n' %(parser.prog,error))
+    finally:
+        sercon.close()
+    total=time.perf_counter()-_START
+    for failure in runner.failures: sys.stderr.write('failed: %s\n' %failure)
+    report=summary(runner.timings,startup,connect,total)
+    if args.json:
+        json.dump({'ok':ok,'port':port,'baudrate':sercon.baudrate,'values':runner.values,'failures':runner.failures,
+                   'timings':[{'step':label,'ms':seconds*1e3,'transactions':count} for label,seconds,count in runner.timings],
+                   'startup_ms':startup*1e3,'connect_ms':connect*1e3,'total_ms':total*1e3},sys.stdout,indent=2)
+        sys.stdout.write('\n')
+        sys.stderr.write(report)
+    else: sys.stdout.write(report)
+    return 0 if ok else 1
+
+if __name__=='__main__':
+    sys.exit(main())
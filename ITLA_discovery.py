@@ -0,0 +1,100 @@
+#parallel discovery of ITLA modules over many serial ports, with a persisted connection profile
+import collections
+import concurrent.futures
+import json
+import os
+import time
+
+import ITLA_reference as itla
+
+BAUD_RATES=(9600,115200,57600,38400,19200,4800)  #probe order when the profile has no better guess
+PROFILE_PATH=os.path.join(os.path.expanduser('~'),'.itla_profile.json')
+PROBE_TIMEOUT=0.05  #seconds to wait for the NOP response at each baud rate
+
+ITLADevice=collections.namedtuple('ITLADevice','port baudrate serial sercon')
+
+def load_profile(path=PROFILE_PATH):
+    #returns {'devices': {serial: {'port', 'baudrate', 'seen'}}, 'ports': {port: baudrate}}; empty if missing or unreadable
+    try:
+        with open(path) as handle:
+            profile=json.load(handle)
+    except (OSError,ValueError):
+        profile={}
+    profile.setdefault('devices',{})
+    profile.setdefault('ports',{})
+    return profile
+
+def save_profile(profile,path=PROFILE_PATH):
+    #writes the profile atomically so a crash never leaves a truncated file
+    temp=path+'.tmp'
+    with open(temp,'w') as handle:
+        json.dump(profile,handle,indent=2,sort_keys=True)
+    os.replace(temp,path)
+
+def baud_candidates(port,profile,rates=BAUD_RATES):
+    #orders baud rates for a port: last rate seen on the port, rates of devices last seen there, then the defaults
+    ordered=[]
+    if str(port) in profile['ports']: ordered.append(profile['ports'][str(port)])
+    for device in profile['devices'].values():
+        if device.get('port')==str(port): ordered.append(device['baudrate'])
+    ordered.extend(rates)
+    return [rate for index,rate in enumerate(ordered) if rate in rates and rate not in ordered[:index]]
+
+def probe(port,rates,opener=itla.ITLAOpen,probe_timeout=PROBE_TIMEOUT,framed=True,upgrade_baud=False):
+    #tries each baud rate on one port; returns an ITLADevice with an open connection, or None.
+    #probe_timeout only applies with framed I/O: per-byte reads always wait ITLA_reference.RESPONSE_TIMEOUT
+    try:
+        conn=opener(port,rates[0])
+    except Exception:  #missing, busy or unsupported ports are simply not ITLA modules
+        return None
+    try:
+        itla.ITLASetFramed(conn,framed)
+        for rate in rates:
+            if conn.baudrate!=rate: conn.baudrate=rate
+            #allow for the wire time of the NOP round trip at slow rates
+            conn.timeout=max(probe_timeout,8*10.0/rate+0.02)
+            conn.reset_input_buffer()
+            result=itla.ITLABatch(conn,[(0x00,0,itla.READ)])[0]
+            if result.ok:
+                conn.timeout=itla.RESPONSE_TIMEOUT if framed else 1
+                if upgrade_baud:
+                    rate=itla.ITLAUpgradeBaud(conn)
+                    if rate==itla.ITLA_ERROR_SERBAUD: break
+                serial=itla.ITLA(conn,0x04,0,itla.READ)
+                if not isinstance(serial,str): serial=''
+                return ITLADevice(port,rate,serial.rstrip('\x00 '),conn)
+    except Exception:  #e.g. a USB adapter unplugged mid-probe; must not stop the other ports
+        pass
+    try:
+        conn.close()
+    except Exception:
+        pass
+    return None
+
+def ITLADiscover(ports,rates=BAUD_RATES,profile_path=PROFILE_PATH,max_workers=None,
+                 opener=itla.ITLAOpen,probe_timeout=PROBE_TIMEOUT,framed=True,upgrade_baud=False):
+    """
+    Probes all ports at the same time and returns an ITLADevice for every responding module, in port order.
+    Baud rates are tried in the order suggested by the profile at profile_path (None disables the profile),
+    which is updated with the port and baud rate of every module found. With upgrade_baud, each module is
+    moved to its fastest working baud rate (ITLA_reference.ITLAUpgradeBaud) and that rate is reported.
+    probe_timeout is the NOP response timeout per baud rate with framed I/O; per-byte probing (framed=False)
+    waits ITLA_reference.RESPONSE_TIMEOUT per rate instead.
+    """
+    if not isinstance(ports,(list,tuple)): ports=[ports]
+    profile=load_profile(profile_path) if profile_path else {'devices':{},'ports':{}}
+    workers=max_workers or max(1,len(ports))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        futures=[pool.submit(probe,port,baud_candidates(port,profile,rates),opener,probe_timeout,framed,upgrade_baud) for port in ports]
+        devices=[future.result() for future in futures]
+    devices=[device for device in devices if device is not None]
+    if profile_path and devices:
+        for device in devices:
+            profile['ports'][str(device.port)]=device.baudrate
+            if device.serial:
+                profile['devices'][device.serial]={'port':str(device.port),'baudrate':device.baudrate,'seen':time.time()}
+        try:
+            save_profile(profile,profile_path)
+        except OSError:
+            pass  #the profile only speeds up the next discovery
+    return devices
@@ -0,0 +1,187 @@
+#closed-loop laser locking: drives the FTF register (0x62) from an error signal with a PI(D) controller
+#usage (simulated module): python ITLA_lock.py --rate 100 --duration 5 --baud 115200
+import argparse
+import threading
+import time
+
+import ITLA_reference as itla
+from ITLA_registers import address
+from ITLA_stats import Histogram
+
+FTF_REGISTER=address('ftf_MHz')             #fine tune frequency, signed MHz
+FTF_RANGE_REGISTER=address('ftf_range_MHz') #FTF range, MHz
+
+class PID:
+    """PID controller with output clamping and conditional-integration anti-windup.
+
+    The integral term only accumulates while the output is not saturated in the direction the
+    error is pushing, so it never winds up beyond the output limits.
+    """
+
+    def __init__(self,kp,ki=0.0,kd=0.0,output_limits=(None,None)):
+        self.kp=kp
+        self.ki=ki
+        self.kd=kd
+        self.output_limits=output_limits
+        self.integral=0.0
+        self._last_error=None
+
+    def reset(self,output=0.0):
+        #bumpless start from the given output
+        self.integral=output
+        self._last_error=None
+
+    def update(self,error,dt):
+        derivative=0.0
+        if self._last_error is not None and dt>0: derivative=(error-self._last_error)/dt
+        self._last_error=error
+        integral=self.integral+self.ki*error*dt
+        output=self._clamp(self.kp*error+integral+self.kd*derivative)
+        low,high=self.output_limits
+        saturated=(high is not None and output>=high and error>0) or (low is not None and output<=low and error<0)
+        if not saturated: self.integral=self._clamp(integral)
+        return output
+
+    def _clamp(self,value):
+        low,high=self.output_limits
+        if high is not None and value>high: return high
+        if low is not None and value<low: return low
+        return value
+
+class LockEngine:
+    """Fixed-rate lock loop writing FTF corrections to one module.
+
+    error_source is a callable returning the frequency error in MHz (target minus actual), or None
+    when no measurement is available, in which case the FTF is held. Writes go out at
+    PRIORITY_CONTROL and are skipped when the rounded FTF value does not change.
+    """
+
+    def __init__(self,sercon,error_source,controller,rate_hz=50.0,ftf_range=None,priority=itla.PRIORITY_CONTROL):
+        self.sercon=sercon
+        self.error_source=error_source
+        self.controller=controller
+        self.period=1.0/rate_hz
+        self.ftf_range=ftf_range
+        self.priority=priority
+        self.ftf=0
+        self.seed_status=None  #status of the FTF read that seeds the controller
+        self.ticks=0
+        self.writes=0
+        self.write_errors=0
+        self.overruns=0   #ticks that started more than one period late
+        self.interval=Histogram()   #time between consecutive ticks
+        self.jitter=Histogram()     #tick start relative to its schedule
+        self.actuation=Histogram()  #duration of the FTF write transaction
+        self._thread=None
+        self._stop=threading.Event()
+        self._started=None
+        self._stopped=None
+
+    def start(self):
+        #returns False without starting if the current FTF cannot be read (status in seed_status)
+        if self._thread is not None: return True
+        if self.ftf_range is None:
+            span=itla.ITLATransact(self.sercon,FTF_RANGE_REGISTER,0,itla.READ,priority=self.priority)
+            #fall back to the limits of the signed 16 bit register if the module does not report a range
+            self.ftf_range=span.value if span.ok and 0<span.value<32768 else 32767
+        self.controller.output_limits=(-self.ftf_range,self.ftf_range)
+        current=itla.ITLATransact(self.sercon,FTF_REGISTER,0,itla.READ,priority=self.priority)
+        self.seed_status=current.status
+        if not current.ok: return False  #never seed the controller from an error sentinel
+        self.ftf=current.value-65536 if current.value>32767 else current.value
+        self.controller.reset(self.ftf)
+        self._stop.clear()
+        self._thread=threading.Thread(target=self._run,daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        if self._thread is None: return
+        self._stop.set()
+        self._thread.join()
+        self._thread=None
+
+    def run(self,duration):
+        #runs the loop for the given number of seconds and returns report(), or None if it could not start
+        if not self.start(): return None
+        time.sleep(duration)
+        self.stop()
+        return self.report()
+
+    def _run(self):
+        self._started=time.perf_counter()
+        next_tick=self._started
+        last=None
+        while not self._stop.is_set():
+            now=time.perf_counter()
+            if now<next_tick:
+                self._stop.wait(next_tick-now)
+                continue
+            late=now-next_tick
+            self.jitter.record(late)
+            if late>self.period: self.overruns+=1
+            if last is not None: self.interval.record(now-last)
+            dt=now-last if last is not None else self.period
+            last=now
+            self.ticks+=1
+            error=self.error_source()
+            if error is not None:
+                ftf=int(round(self.controller.update(error,dt)))
+                if ftf!=self.ftf: self._actuate(ftf)
+            #skip missed ticks instead of bursting to catch up
+            next_tick+=self.period*max(1,int(late/self.period)+1)
+        self._stopped=time.perf_counter()
+
+    def _actuate(self,ftf):
+        start=time.perf_counter()
+        result=itla.ITLABatch(self.sercon,[(FTF_REGISTER,ftf,itla.WRITE)],priority=self.priority)[0]
+        self.actuation.record(time.perf_counter()-start)
+        if result.ok:
+            self.ftf=ftf
+            self.writes+=1
+        else:
+            self.write_errors+=1
+
+    def report(self):
+        #achieved loop rate, jitter and actuation latency (ms)
+        elapsed=((self._stopped or time.perf_counter())-self._started) if self._started else 0.0
+        return{
+            'target_rate_hz':1.0/self.period,
+            'achieved_rate_hz':self.ticks/elapsed if elapsed>0 else 0.0,
+            'ticks':self.ticks,
+            'writes':self.writes,
+            'write_errors':self.write_errors,
+            'overruns':self.overruns,
+            'ftf_mhz':self.ftf,
+            'interval_ms':self.interval.summary(),
+            'jitter_ms':self.jitter.summary(),
+            'actuation_ms':self.actuation.summary(),
+        }
+
+def main(argv=None):
+    from ITLA_simulator import SimulatedITLA,SimulatedDiscriminator
+    parser=argparse.ArgumentParser(description='Lock loop timing against the simulated module')
+    parser.add_argument('--rate',type=float,default=50.0,help='loop rate (Hz)')
+    parser.add_argument('--duration',type=float,default=5.0,help='run time (s)')
+    parser.add_argument('--baud',type=int,default=9600)
+    parser.add_argument('--kp',type=float,default=0.3)
+    parser.add_argument('--ki',type=float,default=20.0)
+    parser.add_argument('--drift',type=float,default=50.0,help='laser drift (MHz/s)')
+    parser.add_argument('--noise',type=float,default=1.0,help='discriminator noise (MHz rms)')
+    args=parser.parse_args(argv)
+
+    device=SimulatedITLA(baudrate=args.baud)
+    itla.ITLASetFramed(device)
+    engine=LockEngine(device,SimulatedDiscriminator(device,drift_mhz_per_s=args.drift,noise_mhz=args.noise,seed=1),
+                      PID(args.kp,args.ki),rate_hz=args.rate)
+    stats=engine.run(args.duration)
+    if stats is None: parser.exit(1,'could not read the current FTF (error %d)\n' %engine.seed_status)
+    print('rate %.1f Hz (target %.1f), %d ticks, %d FTF writes, %d errors, %d overruns, FTF %d MHz' %(
+        stats['achieved_rate_hz'],stats['target_rate_hz'],stats['ticks'],stats['writes'],stats['write_errors'],
+        stats['overruns'],stats['ftf_mhz']))
+    for name in ('interval_ms','jitter_ms','actuation_ms'):
+        summary=stats[name]
+        print('%-13s mean %.3f  p50 %.3f  p99 %.3f  max %.3f ms' %(name[:-3],summary['mean'],summary['p50'],summary['p99'],summary['max']))
+
+if __name__=='__main__':
+    main()
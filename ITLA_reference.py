@@ -3,6 +3,11 @@ import serial
 import time
 import struct
 import threading
+import itertools
+import weakref
+import collections
+
+import ITLA_transport
 
 ITLA_NOERROR=0x00
 ITLA_EXERROR=0x01
@@ -10,22 +15,57 @@ ITLA_AEERROR=0x02
 ITLA_CPERROR=0x03
 ITLA_NRERROR=0x04
 ITLA_CSERROR=0x05
+ITLA_QTERROR=0x06   #connection stayed busy beyond the queue timeout
 
 ITLA_ERROR_SERPORT=0x01
 ITLA_ERROR_SERBAUD=0x02
 
+BAUD_REGISTER=0x65  #module baud rate, in units of 100 baud
+UPGRADE_BAUD_RATES=(115200,57600,38400,19200) #tried in this order by ITLAUpgradeBaud
+BAUD_SWITCH_DELAY=0.01 #seconds between the baud rate write and the first frame at the new rate
+
 READ=0
 WRITE=1
 
+#transaction priorities, lower values are served first
+PRIORITY_CONTROL=0  #control-loop writes
+PRIORITY_NORMAL=1
+PRIORITY_POLL=2     #UI and telemetry polling
+
+QUEUE_TIMEOUT=5     #seconds a transaction may wait for the connection
+PRIORITY_AGING=0.5  #seconds of waiting that move a queued transaction up one priority level
+RESPONSE_TIMEOUT=0.25 #seconds to wait for a response frame
+AEA_MAX_BYTES=100   #longer AEA lengths are treated as errors
+
+NOP_MRDY=0x0010     #NOP register: module ready
+NOP_PENDING=0xFF00  #NOP register: pending operation flags
+RESYNC_DEADLINE=0.15 #seconds a resync may take in total
+RESYNC_BYTE_WAIT=0.02 #longest wait for an answer after each padding byte
+RESYNC_MIN_WAIT=0.005 #shortest wait, used on fast links with a measured round trip
+RESYNC_MAX_BYTES=4  #a frame is 4 bytes, so this many padding bytes always complete the module's partial frame
+RESYNC_ATTEMPTS=2   #times a command is sent before giving up on a link that keeps losing alignment
+
+#resync outcomes
+RESYNC_OK=0         #module realigned and answered a NOP frame
+RESYNC_SILENT=1     #no answer to any padding byte: module absent, powered down or at another baud rate
+RESYNC_UNVERIFIED=2 #module answered the padding but no clean NOP frame came back before the deadline
+
+SETTLE_TIMEOUT=30   #default deadline (s) for ITLAWaitUntilSettled
+
 latestregister=0
 tempport=0
 raybin=0
-queue=[]
-maxrowticket=0
 AEA_reference=[]
 
-_error=ITLA_NOERROR
-seriallock=0
+class _ThreadState(threading.local):
+    #per-thread protocol state, so concurrent callers never see each other's errors
+    error=ITLA_NOERROR
+    retries=0   #resyncs during the current register operation
+    recovery=0.0 #seconds spent resyncing during the current register operation
+
+_tls=_ThreadState()
+_connections=weakref.WeakKeyDictionary()
+_connections_lock=threading.Lock()
 
 def byteconv(number):
     #Converts a number to a byte for serial communications
@@ -34,24 +74,129 @@ def byteconv(number):
     return(struct.pack('b',number))
 
 def ITLALastError():
-    #returns the error status from the last communication
-    return(_error)
+    #returns the error status from the last communication of the calling thread
+    return(_tls.error)
+
+class ITLAResult(collections.namedtuple('ITLAResult','register rw value status latency retries recovery',
+                                        defaults=(0.0,0,0.0))):
+    #outcome of one register operation; status is one of the ITLA_*ERROR codes, latency the time on the link
+    #in seconds (queueing excluded), retries the number of resyncs it took and recovery the time they cost
+    __slots__=()
+
+    @property
+    def ok(self):
+        return self.status==ITLA_NOERROR
+
+ResyncResult=collections.namedtuple('ResyncResult','outcome elapsed bytes_sent')
+
+SettleResult=collections.namedtuple('SettleResult','settled elapsed polls nop frequency_thz')
+
+def ITLAEffectivePriority(priority,waited):
+    #priority of a transaction that has been queued for waited seconds: one level higher per PRIORITY_AGING,
+    #so polling never starves behind a steady stream of control writes
+    return priority-int(waited/PRIORITY_AGING)
+
+class TransactionScheduler:
+    """Per-connection transaction scheduler.
+
+    Callers are served one at a time, by priority and then in arrival order. A waiting caller gains
+    one priority level per PRIORITY_AGING seconds, so low priorities are delayed but not starved.
+    Waiting callers block on their own event rather than polling, and give up once their timeout expires.
+    """
+
+    def __init__(self):
+        self._lock=threading.Lock()
+        self._waiters=[]  #[priority, sequence, event, state, enqueued] in arrival order
+        self._sequence=itertools.count()
+        self._busy=False
+        self.granted=0
+        self.timeouts=0
+        self.wait_total={}  #priority -> accumulated queueing time (s)
+        self.wait_max={}    #priority -> longest queueing time (s)
+
+    def acquire(self,priority=PRIORITY_NORMAL,timeout=QUEUE_TIMEOUT):
+        #blocks until the connection is granted to the caller; returns False on timeout
+        start=time.perf_counter()
+        with self._lock:
+            if not self._busy and not self._waiters:
+                self._busy=True
+                self._record(priority,0.0)
+                return True
+            waiter=[priority,next(self._sequence),threading.Event(),'waiting',start]
+            self._waiters.append(waiter)
+        waiter[2].wait(timeout)
+        with self._lock:
+            if waiter[3]=='granted':
+                self._record(priority,time.perf_counter()-start)
+                return True
+            waiter[3]='cancelled'  #left in the queue, dropped on release
+            self.timeouts+=1
+            return False
+
+    def release(self):
+        #hands the connection to the waiter with the best aged priority, if any
+        with self._lock:
+            self._waiters=[waiter for waiter in self._waiters if waiter[3]=='waiting']
+            if not self._waiters:
+                self._busy=False
+                return
+            now=time.perf_counter()
+            waiter=min(self._waiters,key=lambda waiter:(ITLAEffectivePriority(waiter[0],now-waiter[4]),waiter[1]))
+            self._waiters.remove(waiter)
+            waiter[3]='granted'
+            waiter[2].set()
 
-def SerialLock():
-    #returns status of serial communications
-    global seriallock
-    return seriallock
+    def pending(self):
+        #number of callers waiting for the connection
+        with self._lock:
+            return sum(1 for waiter in self._waiters if waiter[3]=='waiting')
 
-def SerialLockSet():
-    #locks serial communications until a response is received (for multi-thread applications)
-    global seriallock
-    seriallock=1
+    def _record(self,priority,wait):
+        self.granted+=1
+        self.wait_total[priority]=self.wait_total.get(priority,0.0)+wait
+        if wait>self.wait_max.get(priority,0.0): self.wait_max[priority]=wait
 
-def SerialLockUnSet():
-    #releases serial communications until a response is received (for multi-thread applications)
-    global seriallock,queue
-    seriallock=0
-    queue.pop(0)
+class ConnectionState:
+    #per-connection protocol state, created on first use of a serial connection
+    def __init__(self):
+        self.scheduler=TransactionScheduler()
+        self.framed=False  #whole-frame writes and blocking 4-byte reads instead of per-byte I/O
+        self.hooks=()      #instrumentation callables, each called with the ITLAResult of every operation
+        self.round_trip=None #smoothed duration of clean single-frame transactions, sizes the resync waits
+
+def _connection_state(sercon):
+    with _connections_lock:
+        state=_connections.get(sercon)
+        if state is None:
+            state=ConnectionState()
+            _connections[sercon]=state
+        return state
+
+def ITLAScheduler(sercon):
+    #returns the transaction scheduler of a serial connection, creating it on first use
+    return _connection_state(sercon).scheduler
+
+def ITLAAddHook(sercon,hook):
+    #installs an instrumentation hook on a connection: hook(result) is called with the ITLAResult of every
+    #register operation, while the connection is still held, so it must be quick (see ITLA_stats.ProtocolStats)
+    state=_connection_state(sercon)
+    with _connections_lock:
+        if hook not in state.hooks: state.hooks=state.hooks+(hook,)
+
+def ITLARemoveHook(sercon,hook):
+    state=_connection_state(sercon)
+    with _connections_lock:
+        state.hooks=tuple(installed for installed in state.hooks if installed is not hook)
+
+def _notify(sercon,result):
+    for hook in _connection_state(sercon).hooks: hook(result)
+    return result
+
+def ITLASetFramed(sercon,enabled=True):
+    #switches a connection to framed I/O: one write per command frame and one blocking 4-byte read per response,
+    #using the serial port timeout instead of polling inWaiting(). Sets the port timeout to RESPONSE_TIMEOUT.
+    _connection_state(sercon).framed=enabled
+    if enabled: sercon.timeout=RESPONSE_TIMEOUT
 
 def checksum(byte0,byte1,byte2,byte3):
     #calculates checksum
@@ -59,33 +204,122 @@ def checksum(byte0,byte1,byte2,byte3):
     bip4=((bip8&0xf0)>>4)^(bip8&0x0f)
     return bip4
 
+#command frames of all plain reads (data 0), computed once; index by register
+_READ_FRAMES=tuple(bytes((checksum(READ,register,0,0)*16+READ,register,0,0)) for register in range(256))
+
+def ITLAEncode(register,data,rw):
+    #returns the 4-byte command frame for a register operation; negative data is sent as two's complement
+    if rw==READ and not data: return _READ_FRAMES[register]
+    data&=0xFFFF
+    byte2=data>>8
+    byte3=data&0xFF
+    return bytes((checksum(rw,register,byte2,byte3)*16+rw,register,byte2,byte3))
+
 def Send_command(sercon,byte0,byte1,byte2,byte3):
-    #sends command on serial interface
+    #sends command on serial interface; returns False if the module was out of sync and could not be realigned
+    return _send_frame(sercon,bytes((byte0&0xFF,byte1&0xFF,byte2&0xFF,byte3&0xFF)))
+
+def _send_frame(sercon,frame,attempts=RESYNC_ATTEMPTS):
     global CoBrite
-    sercon.write(byteconv(byte0))
-    sercon.write(byteconv(byte1))
-    sercon.write(byteconv(byte2))
-    #double check that the module has not sent any response after 3 bytes. If it did we are out of sync and we need to fix
-    if sercon.inWaiting()>0:
+    if _connection_state(sercon).framed:
+        if sercon.inWaiting()>0: sercon.flushInput() #discard late bytes of an earlier timed-out response
+        sercon.write(frame)
+        return True
+    for attempt in range(attempts):
+        sercon.write(frame[:3])
+        #double check that the module has not sent any response after 3 bytes. If it did we are out of sync and we need to fix
+        if sercon.inWaiting()==0:
+            sercon.write(frame[3:])
+            return True
+        if _recover(sercon).outcome!=RESYNC_OK: return False
+    return False
+
+_NOP_FRAME=bytes(4) #NOP read: checksum, register and data are all zero
+
+def _wait_bytes(sercon,count,deadline):
+    #waits until count bytes are buffered or the deadline passes; returns the number buffered
+    while True:
+        waiting=sercon.inWaiting()
+        if waiting>=count or time.perf_counter()>=deadline: return waiting
+        time.sleep(0.0005)
+
+def _resync(sercon,deadline=RESYNC_DEADLINE,byte_wait=None):
+    """
+    Realigns the module's frame boundary and returns a ResyncResult(outcome, elapsed, bytes_sent).
+    FLUSH discards pending input. PAD sends single NOP bytes, at most RESYNC_MAX_BYTES, until the module
+    completes its partial frame and starts to answer, waiting up to byte_wait after each. DRAIN discards the
+    answer and VERIFY sends one NOP frame, which must come back clean: valid checksum, OK status and the
+    register echoed.
+    A failed verification starts over from FLUSH. No wait extends past deadline seconds from the start, so
+    that is the worst-case cost. byte_wait defaults to twice the measured round trip, within
+    RESYNC_MIN_WAIT..RESYNC_BYTE_WAIT.
+    """
+    if byte_wait is None:
+        round_trip=_connection_state(sercon).round_trip
+        byte_wait=RESYNC_BYTE_WAIT if round_trip is None else min(RESYNC_BYTE_WAIT,max(RESYNC_MIN_WAIT,2*round_trip))
+    start=time.perf_counter()
+    end=start+deadline
+    sent=0
+    outcome=RESYNC_SILENT
+    while time.perf_counter()<end:
         sercon.flushInput()
-        counter=0
-        while sercon.inWaiting()<4 and counter<8:
-            sercon.write(byteconv(0)) #send 0 command (NOP)
-            time.sleep(0.02)
-            counter=counter+1
-        if counter<8:     #if counter is 8 we have not recovered
-            sercon.flushInput()
-            Send_command(sercon,byte0,byte1,byte2,byte3)
-        return
-    sercon.write(byteconv(byte3))
+        answered=False
+        for _ in range(RESYNC_MAX_BYTES):
+            sercon.write(_NOP_FRAME[:1])
+            sent+=1
+            if _wait_bytes(sercon,1,min(end,time.perf_counter()+byte_wait)):
+                answered=True
+                break
+        if not answered: break  #SILENT, or still UNVERIFIED if an earlier round was answered
+        _wait_bytes(sercon,4,min(end,time.perf_counter()+byte_wait))
+        sercon.flushInput()
+        sercon.write(_NOP_FRAME)
+        sent+=4
+        outcome=RESYNC_UNVERIFIED
+        if _wait_bytes(sercon,4,min(end,time.perf_counter()+byte_wait))>=4:
+            frame=sercon.read(4)
+            if len(frame)==4 and frame[0]&0x03==ITLA_NOERROR and frame[1]==0x00 and checksum(*frame)==frame[0]>>4:
+                outcome=RESYNC_OK
+                break
+    sercon.flushInput()
+    return ResyncResult(outcome,time.perf_counter()-start,sent)
+
+def _recover(sercon):
+    #resyncs and charges the attempt and its duration to the current register operation
+    result=_resync(sercon)
+    _tls.retries+=1
+    _tls.recovery+=result.elapsed
+    return result
+
+def ITLAResync(sercon,priority=PRIORITY_NORMAL,timeout=QUEUE_TIMEOUT):
+    #realigns the frame boundary of a connection on demand, e.g. after repeated checksum errors; returns a ResyncResult
+    scheduler=ITLAScheduler(sercon)
+    if not scheduler.acquire(priority,timeout):
+        _tls.error=ITLA_QTERROR
+        return ResyncResult(RESYNC_SILENT,0.0,0)
+    try:
+        return _resync(sercon)
+    finally:
+        scheduler.release()
 
 def Receive_response(sercon):
     #receive response on serial interface
-    global _error,queue,CoBrite,CoBrite_AEA,commlog
+    global CoBrite,CoBrite_AEA,commlog
+    if _connection_state(sercon).framed:
+        frame=sercon.read(4) #blocks until the frame is complete or the port timeout expires
+        if len(frame)<4:
+            _tls.error=ITLA_NRERROR
+            return(0xFF,0xFF,0xFF,0xFF)
+        byte0,byte1,byte2,byte3=frame
+        if checksum(byte0,byte1,byte2,byte3)==byte0>>4:
+            _tls.error=byte0&0x03
+        else:
+            _tls.error=ITLA_CSERROR
+        return(byte0,byte1,byte2,byte3)
     reftime=time.perf_counter()
     while sercon.inWaiting()<4:
-        if time.perf_counter()>reftime+0.25: #timeout
-            _error=ITLA_NRERROR
+        if time.perf_counter()>reftime+RESPONSE_TIMEOUT: #timeout
+            _tls.error=ITLA_NRERROR
             return(0xFF,0xFF,0xFF,0xFF) #default response; indicates error
         time.sleep(0.001)
     try:
@@ -99,29 +333,108 @@ def Receive_response(sercon):
         byte2=0xFF
         byte3=0xFF
     if checksum(byte0,byte1,byte2,byte3)==byte0>>4: #verify checksum
-        _error=byte0&0x03
+        _tls.error=byte0&0x03
         return(byte0,byte1,byte2,byte3)
     else:
-        _error=ITLA_CSERROR
+        _tls.error=ITLA_CSERROR
         return(byte0,byte1,byte2,byte3)
 
-def ITLAConnect(ports, baudrate=9600):
+def _transaction(sercon,frame,resend=True):
+    #sends one command frame and returns the response frame; a misaligned link is resynced and the frame sent once more.
+    #With resend False the link is resynced but the frame is not repeated and the error stands: for frames the module
+    #acts on each time, such as AEA continuation reads (0x0B), which advance the AEA pointer
+    register=frame[1]
+    attempts=RESYNC_ATTEMPTS if resend else 1
+    for attempt in range(attempts):
+        if not _send_frame(sercon,frame,attempts):
+            _tls.error=ITLA_NRERROR
+            return(0xFF,0xFF,0xFF,0xFF)
+        test=Receive_response(sercon)
+        #a misaligned module answers frames early or late; detect it by a bad checksum or a wrong register echo
+        if _tls.error==ITLA_NRERROR or (_tls.error!=ITLA_CSERROR and test[1]==register): break
+        if test[1]!=register: _tls.error=ITLA_CSERROR #answer to another frame
+        if not resend:
+            _recover(sercon)
+            break
+        if attempt+1==attempts or _recover(sercon).outcome!=RESYNC_OK: break
+    return test
+
+def ITLAOpen(port,baudrate=9600,timeout=1,capture=None):
+    #opens the transport of a module: a serial port by its Windows or Linux name, a VISA ASRL resource, 'sim' or
+    #'replay:<capture>' (see ITLA_transport.open_transport); raises serial.SerialException if it cannot be opened
+    #capture: an ITLA_transport.CaptureWriter recording every byte and transaction on the connection
+    sercon=ITLA_transport.open_transport(port,baudrate,timeout,capture)
+    if capture is not None: ITLAAddHook(sercon,capture.transaction)
+    return sercon
+
+def ITLAUpgradeBaud(sercon,rates=UPGRADE_BAUD_RATES,priority=PRIORITY_NORMAL,timeout=QUEUE_TIMEOUT):
+    """
+    Moves the module and the host port to the fastest baud rate in rates that passes a NOP check.
+    rates are tried from fastest to slowest, in any order given; rates not above the current one are
+    skipped. If a rate fails verification, the link falls back to
+    the previous rate. Returns the baud rate in use afterwards, or ITLA_ERROR_SERBAUD if the link
+    could not be recovered.
+    """
+    scheduler=ITLAScheduler(sercon)
+    if not scheduler.acquire(priority,timeout):
+        _tls.error=ITLA_QTERROR
+        return sercon.baudrate
+    try:
+        current=sercon.baudrate
+        for rate in sorted(rates,reverse=True):
+            if rate<=current: break
+            _execute(sercon,BAUD_REGISTER,rate//100,WRITE)
+            if _tls.error!=ITLA_NOERROR: continue #rate not supported by the module
+            if _switch_baud(sercon,rate): return rate
+            if _switch_baud(sercon,current): continue #module kept the old rate
+            #module switched but the link does not work at the new rate: order it back from there
+            sercon.baudrate=rate
+            _execute(sercon,BAUD_REGISTER,current//100,WRITE)
+            if not _switch_baud(sercon,current): return ITLA_ERROR_SERBAUD
+        return current
+    finally:
+        scheduler.release()
+
+def _switch_baud(sercon,rate):
+    #sets the host port to rate and verifies the link with two NOP round trips
+    time.sleep(BAUD_SWITCH_DELAY)
+    sercon.baudrate=rate
+    sercon.flushInput()
+    for _ in range(2):
+        _execute(sercon,0x00,0,READ)
+        if _tls.error!=ITLA_NOERROR: return False
+    return True
+
+def ITLAConnect(ports, baudrate=9600, framed=False, upgrade_baud=False, capture=None):
     """
     Attempts to connect to the unit over one of the provided ports.
     ports: a list of port names (e.g., ['COM3', 'COM4', 'COM5'])
     baudrate: initial baud rate to try
+    framed: use framed I/O (see ITLASetFramed) on the connection
+    upgrade_baud: once connected, move to the fastest working baud rate (see ITLAUpgradeBaud); the rate
+    in use is available as conn.baudrate
+    capture: path of a new capture file recording the session, including the connection attempts (see
+    ITLA_transport); an existing file is never overwritten. Replay it with ports='replay:<path>'
     Returns the serial connection if successful, or an error code if not.
     """
     # If a single port is provided, wrap it in a list
     if not isinstance(ports, list):
         ports = [ports]
+    if capture is not None: capture=ITLA_transport.CaptureWriter(capture,ports=[str(port) for port in ports],baudrate=baudrate,framed=framed)
+    conn=_connect(ports,baudrate,framed,upgrade_baud,capture)
+    if capture is not None:
+        if isinstance(conn,int): capture.close()
+        else: conn.owns_capture=True
+    return conn
 
+def _connect(ports,baudrate,framed,upgrade_baud,capture):
     for port in ports:
         try:
             # Try initial connection on the current port
-            conn = serial.Serial('\\\\.\\' + str(port), baudrate, timeout=1)
+            conn = ITLAOpen(port, baudrate, capture=capture)
         except serial.SerialException:
             continue  # Try the next port if this one fails
+        if framed: ITLASetFramed(conn)
 
         # Try out different baud rates on this port
         baudrate2 = 4800
@@ -145,9 +458,10 @@ def ITLAConnect(ports, baudrate=9600):
                 # Reopen the port with the new baud rate
                 conn.close()
                 try:
-                    conn = serial.Serial('\\\\.\\' + str(port), baudrate2, timeout=1)
+                    conn = ITLAOpen(port, baudrate2, capture=capture)
                 except serial.SerialException:
                     break
+                if framed: ITLASetFramed(conn)
                 teller3 = 0
                 while teller3 < 5 and conn.inWaiting() < 4:
                     conn.write(chr(0).encode())
@@ -155,36 +469,53 @@ def ITLAConnect(ports, baudrate=9600):
                     teller3 += 1
                 conn.read(conn.inWaiting())
             else:
+                if upgrade_baud and ITLAUpgradeBaud(conn) == ITLA_ERROR_SERBAUD:
+                    conn.close()
+                    return ITLA_ERROR_SERBAUD
                 return conn  # Successful connection on this port and baud rate
 
     # If we reach here, none of the ports worked
     return ITLA_ERROR_SERPORT
 
 
-def ITLA(sercon,register,data,rw):
+def ITLA(sercon,register,data,rw,priority=PRIORITY_NORMAL,timeout=QUEUE_TIMEOUT):
     #main routine to communicate with the unit
-    global latestregister,commlog,AEA_reference,queue,maxrowticket
-    lock=threading.Lock()
-    lock.acquire() #execution halted while other thread is being queue'ed (allows for timeout)
-    rowticket=maxrowticket+1
-    starttime=time.perf_counter()
-    maxrowticket=rowticket
-    queue.append(rowticket)
-    lock.release() #queue updated, now release for next thread
-    while queue[0]!=rowticket: #only start communication if previous communication has finished
-        if time.perf_counter()-starttime>5: #timeout
-            teller=0
-            while teller<len(queue):
-                if queue[teller]==rowticket: queue.pop(teller) #cleanup
-                else: teller=teller+1
-            return 65535
-    if data<0: data=data+65536 #convert signed number to non-signed integer
+    #transactions on a connection are serialized by its scheduler; returns 65535 if the connection stays busy for timeout seconds
+    return ITLATransact(sercon,register,data,rw,priority,timeout).value
+
+def ITLATransact(sercon,register,data,rw,priority=PRIORITY_NORMAL,timeout=QUEUE_TIMEOUT):
+    #like ITLA(), but returns the ITLAResult (value, status, latency, retries) instead of the bare value
+    scheduler=ITLAScheduler(sercon)
+    if not scheduler.acquire(priority,timeout):
+        _tls.error=ITLA_QTERROR
+        return _notify(sercon,ITLAResult(register,rw,65535,ITLA_QTERROR))
+    try:
+        return _execute(sercon,register,data,rw)
+    finally:
+        scheduler.release()
+
+def ITLABatch(sercon,operations,priority=PRIORITY_NORMAL,timeout=QUEUE_TIMEOUT):
+    #runs a list of (register, data, rw) operations as one atomic unit on the connection
+    #no other transaction can interleave; returns one ITLAResult per operation
+    scheduler=ITLAScheduler(sercon)
+    if not scheduler.acquire(priority,timeout):
+        _tls.error=ITLA_QTERROR
+        return [_notify(sercon,ITLAResult(register,rw,65535,ITLA_QTERROR)) for register,data,rw in operations]
+    try:
+        return [_execute(sercon,register,data,rw) for register,data,rw in operations]
+    finally:
+        scheduler.release()
+
+def _execute(sercon,register,data,rw):
+    #performs one register operation and returns its ITLAResult; the caller must hold the connection's scheduler
+    global latestregister,commlog,AEA_reference
+    _tls.retries=0
+    _tls.recovery=0.0
+    start=time.perf_counter()
+    frame=ITLAEncode(register,data,rw)
     if rw==READ:
-        byte2=int(data/256)
-        byte3=int(data-byte2*256)
         latestregister=register
-        Send_command(sercon,int(checksum(0,register,byte2,byte3))*16+READ,register,byte2,byte3)
-        test=Receive_response(sercon)
+        test=_transaction(sercon,frame)
         if (test[0]&0x03)==ITLA_AEERROR: #if AEA response
             AEA_reference.append(test[0])
             AEA_reference.append(test[1])
@@ -193,35 +524,148 @@ def ITLA(sercon,register,data,rw):
             response=AEA(sercon,test[2]*256+test[3])
         else: response= test[2]*256+test[3]
     else:
-        byte2=int(data/256)
-        byte3=int(data-byte2*256)
-        Send_command(sercon,int(checksum(1,register,byte2,byte3))*16+WRITE,register,byte2,byte3)
-        test=Receive_response(sercon)
+        test=_transaction(sercon,frame)
         response= test[2]*256+test[3]
-    lock.acquire()
-    queue.pop(0)
-    lock.release()
-    return(response)
+    latency=time.perf_counter()-start
+    if _tls.error==ITLA_NOERROR and not _tls.retries and not isinstance(response,str):
+        state=_connection_state(sercon)
+        state.round_trip=latency if state.round_trip is None else 0.9*state.round_trip+0.1*latency
+    return _notify(sercon,ITLAResult(register,rw,response,_tls.error,latency,_tls.retries,_tls.recovery))
 
-def AEA(sercon,bytes):
-    #read AEA string
-    global AEA_reference
-    outp=''
-    if (bytes>100): #mostly to capture errors, e.g. where the response is 65535
+def ITLAReadAEA(sercon,register,priority=PRIORITY_NORMAL,timeout=QUEUE_TIMEOUT):
+    #reads a register and returns its data as a bytearray: the full AEA payload for extended-address registers,
+    #or the two data bytes otherwise. Returns an empty bytearray on error (see ITLALastError)
+    scheduler=ITLAScheduler(sercon)
+    if not scheduler.acquire(priority,timeout):
+        _tls.error=ITLA_QTERROR
+        _notify(sercon,ITLAResult(register,READ,bytearray(),ITLA_QTERROR))
+        return bytearray()
+    try:
+        _tls.retries=0
+        _tls.recovery=0.0
+        start=time.perf_counter()
+        test=_transaction(sercon,_READ_FRAMES[register])
+        if _tls.error==ITLA_AEERROR: data=_aea_read(sercon,test[2]*256+test[3])
+        elif _tls.error!=ITLA_NOERROR: data=bytearray()
+        else: data=bytearray(test[2:4])
+        _notify(sercon,ITLAResult(register,READ,data,_tls.error,time.perf_counter()-start,_tls.retries,_tls.recovery))
+        return data
+    finally:
+        scheduler.release()
+
+def ITLAStreamAEA(sercon,register,chunk=16,priority=PRIORITY_NORMAL,timeout=QUEUE_TIMEOUT):
+    #generator variant of ITLAReadAEA for long payloads: yields memoryview slices of at most chunk bytes as they arrive.
+    #The connection is held until the generator is exhausted or closed; hooks then see one result with the bytes delivered
+    scheduler=ITLAScheduler(sercon)
+    if not scheduler.acquire(priority,timeout):
+        _tls.error=ITLA_QTERROR
+        _notify(sercon,ITLAResult(register,READ,bytearray(),ITLA_QTERROR))
+        return
+    payload=bytearray()
+    delivered=0
+    try:
+        _tls.retries=0
+        _tls.recovery=0.0
+        start=time.perf_counter()
+        test=_transaction(sercon,_READ_FRAMES[register])
+        if _tls.error==ITLA_NOERROR:
+            payload=bytearray(test[2:4])
+            delivered=2
+            yield memoryview(bytes(payload))
+            return
+        if _tls.error!=ITLA_AEERROR: return
+        length=test[2]*256+test[3]
+        if length>AEA_MAX_BYTES:
+            print('Excessive AEA number encountered')
+            return
+        payload=bytearray(length)
+        view=memoryview(payload)
+        chunk=max(2,chunk-chunk%2)
+        for offset in range(0,length,chunk):
+            _aea_into(sercon,view[offset:offset+chunk])
+            if _tls.error!=ITLA_NOERROR:  #the rest of the payload would be misplaced
+                delivered=0
+                return
+            delivered=min(offset+chunk,length)
+            yield view[offset:delivered]
+    finally:
+        try:
+            _notify(sercon,ITLAResult(register,READ,payload[:delivered],_tls.error,time.perf_counter()-start,_tls.retries,_tls.recovery))
+        finally:
+            scheduler.release()
+
+def ITLAReadWords(sercon,register,signed=False,priority=PRIORITY_NORMAL,timeout=QUEUE_TIMEOUT):
+    #reads a register holding a sequence of 16 bit words (e.g. 0x57 currents, 0x58 temperatures) in one AEA fetch
+    return ITLADecodeWords(ITLAReadAEA(sercon,register,priority,timeout),signed)
+
+def ITLADecodeWords(data,signed=False,numpy=False):
+    #decodes big-endian 16 bit words from AEA data in one pass; returns a tuple, or a NumPy array if numpy is True
+    count=len(data)//2
+    if numpy:
+        import numpy as np
+        return np.frombuffer(data,dtype='>i2' if signed else '>u2',count=count)
+    return struct.unpack_from('>%d%s' %(count,'h' if signed else 'H'),data)
+
+def _aea_into(sercon,view):
+    #fills a writable buffer with AEA data, two bytes per 0x0B read; stops at the first failed read with its error
+    #in _tls.error. A failed 0x0B read is never repeated: the module may have advanced its AEA pointer already
+    length=len(view)
+    for offset in range(0,length,2):
+        test=_transaction(sercon,_READ_FRAMES[0x0B],False)
+        if _tls.error!=ITLA_NOERROR: return
+        view[offset]=test[2]
+        if offset+1<length: view[offset+1]=test[3] #to catch case of odd number of bytes
+
+def _aea_read(sercon,length):
+    #returns length bytes of AEA data in a preallocated bytearray
+    if length>AEA_MAX_BYTES: #mostly to capture errors, e.g. where the response is 65535
         print('Excessive AEA number encountered')
-        return(outp)
-    while bytes>0:
-        Send_command(sercon,int(checksum(0,0x0B,0,0))*16,0x0B,0,0)
-        test=Receive_response(sercon)
-        outp=outp+chr(test[2])
-        if bytes>1:outp=outp+chr(test[3]) #to catch case of odd number of bytes
-        bytes=bytes-2
+        return bytearray()
+    outp=bytearray(length)
+    _aea_into(sercon,memoryview(outp))
+    if _tls.error!=ITLA_NOERROR: return bytearray() #never hand out a partial or shifted payload
     return outp
 
+def AEA(sercon,bytes):
+    #read AEA string
+    return _aea_read(sercon,bytes).decode('latin-1')
+
 def ITLASplitDual(input,rank):
     #For currenst and temps registers sequences of 16 bit integers are output as AEA; allows to extract the desired element
+    #input may be the string returned by ITLA() or the bytearray returned by ITLAReadAEA()
     teller=rank*2
-    try:
-        return(ord(input[teller])*256+ord(input[teller+1]))
-    except:
-        return(0)
\ No newline at end of file
+    if teller<0 or len(input)<teller+2: return(0)
+    if isinstance(input,str): return(ord(input[teller])*256+ord(input[teller+1]))
+    return(input[teller]*256+input[teller+1])
+
+def ITLAWaitUntilSettled(sercon,deadline=SETTLE_TIMEOUT,freq_tolerance_mhz=None,require_mrdy=True,
+                         initial_poll=0.005,max_poll=0.1,priority=PRIORITY_NORMAL):
+    """
+    Polls the NOP register (0x00) until no operation is pending (and MRDY is set, if require_mrdy),
+    backing off from initial_poll to max_poll seconds between polls. With freq_tolerance_mhz, the laser
+    frequency (0x40/0x41/0x68) must also agree within that tolerance on two consecutive polls.
+    Returns a SettleResult(settled, elapsed, polls, nop, frequency_thz) as soon as the module is ready,
+    or with settled=False once deadline seconds have passed.
+    """
+    operations=[(0x00,0,READ)]
+    if freq_tolerance_mhz is not None: operations+=[(0x40,0,READ),(0x41,0,READ),(0x68,0,READ)]
+    start=time.perf_counter()
+    poll=initial_poll
+    polls=0
+    nop=None
+    frequency=None
+    while True:
+        results=ITLABatch(sercon,operations,priority)
+        polls+=1
+        if all(result.ok for result in results):
+            nop=results[0].value
+            ready=not nop&NOP_PENDING and (nop&NOP_MRDY or not require_mrdy)
+            if freq_tolerance_mhz is not None:
+                previous=frequency
+                frequency=results[1].value+results[2].value*1e-4+results[3].value*1e-6
+                ready=ready and previous is not None and abs(frequency-previous)*1e6<=freq_tolerance_mhz
+            if ready: return SettleResult(True,time.perf_counter()-start,polls,nop,frequency)
+        elapsed=time.perf_counter()-start
+        if elapsed>=deadline: return SettleResult(False,elapsed,polls,nop,frequency)
+        time.sleep(min(poll,deadline-elapsed))
+        poll=min(poll*2,max_poll)
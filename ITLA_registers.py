@@ -0,0 +1,150 @@
+#typed register table of the PPCL300: names, addresses, access, signedness and scaling to engineering units
+#usage: laser=Laser(sercon); laser.read('laser_temp_C'); laser.write('power_setpoint_dBm',13.5)
+import collections
+
+import ITLA_reference as itla
+
+#access modes
+RO='R'
+RW='RW'
+
+#ResEna (0x32) bits: MR and SR reset the module (and its register values), SENA turns the laser output on
+RESENA_MR=0x01    #module reset
+RESENA_SR=0x02    #soft reset
+RESENA_SENA=0x08  #software enable of the laser output; write 0 to turn it off
+
+DEFAULT_LIMITS_THZ=(191.5,196.25)  #tuning range used when the module's limits are not read
+
+class Register(collections.namedtuple('Register','name address access signed scale unit aea word')):
+    """One register, or one 16 bit word of an AEA register.
+
+    scale converts raw counts to ``unit`` (value = raw * scale); it is None for AEA text registers.
+    aea marks registers answered with AEA data, and word selects the word of a multi-word AEA register.
+    The frequency registers are all scaled to THz so their parts add up.
+    """
+    __slots__=()
+
+    @property
+    def writable(self):
+        return self.access==RW
+
+    def from_raw(self,raw):
+        #engineering value of a raw 16 bit count
+        if self.signed and raw>32767: raw-=65536
+        return raw*self.scale
+
+    def to_raw(self,value):
+        #16 bit count for a value in engineering units; raises ValueError if it does not fit the register
+        if not self.writable: raise ValueError('%s is read-only' %self.name)
+        raw=int(round(value/self.scale))
+        low,high=(-32768,32767) if self.signed else (0,65535)
+        if not low<=raw<=high:
+            raise ValueError('%s: %r %s is outside %r..%r' %(self.name,value,self.unit,low*self.scale,high*self.scale))
+        return raw&0xFFFF
+
+    def decode(self,value):
+        #engineering value from what ITLA()/ITLABatch returned for this register's address
+        if self.scale is None: return value.rstrip('\x00') if isinstance(value,str) else value
+        if self.aea:
+            if not isinstance(value,str) or len(value)<2*self.word+2: return None
+            value=itla.ITLASplitDual(value,self.word)
+        return self.from_raw(value)
+
+REGISTERS=(
+    Register('nop',0x00,RW,False,1,'',False,None),                      #NOP: pending flags, MRDY, errors
+    Register('device_type',0x01,RO,False,None,'',True,None),
+    Register('manufacturer',0x02,RO,False,None,'',True,None),
+    Register('model',0x03,RO,False,None,'',True,None),
+    Register('serial_number',0x04,RO,False,None,'',True,None),
+    Register('power_setpoint_dBm',0x31,RW,True,0.01,'dBm',False,None),
+    Register('reset_enable',0x32,RW,False,1,'',False,None),             #ResEna: bit flags RESENA_MR/SR/SENA, not a level
+    Register('fcf1_THz',0x35,RW,False,1,'THz',False,None),              #first channel frequency, THz part
+    Register('fcf2_THz',0x36,RW,False,1e-4,'THz',False,None),           #first channel frequency, 0.1 GHz part
+    Register('lf1_THz',0x40,RO,False,1,'THz',False,None),               #laser frequency, THz part
+    Register('lf2_THz',0x41,RO,False,1e-4,'THz',False,None),            #laser frequency, 0.1 GHz part
+    Register('output_power_dBm',0x42,RO,True,0.01,'dBm',False,None),
+    Register('case_temp_C',0x43,RO,True,0.01,'C',False,None),
+    Register('ftf_range_MHz',0x4F,RO,False,1,'MHz',False,None),
+    Register('low_freq1_THz',0x52,RO,False,1,'THz',False,None),
+    Register('low_freq2_THz',0x53,RO,False,1e-4,'THz',False,None),
+    Register('high_freq1_THz',0x54,RO,False,1,'THz',False,None),
+    Register('high_freq2_THz',0x55,RO,False,1e-4,'THz',False,None),
+    Register('tec_current_mA',0x57,RO,True,0.1,'mA',True,0),
+    Register('diode_current_mA',0x57,RO,True,0.1,'mA',True,1),
+    Register('laser_temp_C',0x58,RO,True,0.01,'C',True,0),
+    Register('ambient_temp_C',0x58,RO,True,0.01,'C',True,1),
+    Register('ftf_MHz',0x62,RW,True,1,'MHz',False,None),                #fine tune frequency
+    Register('baud_rate',0x65,RW,False,100,'baud',False,None),
+    Register('fcf3_THz',0x67,RW,False,1e-6,'THz',False,None),           #first channel frequency, MHz part
+    Register('lf3_THz',0x68,RO,False,1e-6,'THz',False,None),            #laser frequency, MHz part
+    Register('whisper_mode',0x90,RW,False,1,'',False,None),             #0 dither, 2 whisper
+)
+
+BY_NAME={register.name:register for register in REGISTERS}
+
+def register(name):
+    try:
+        return BY_NAME[name]
+    except KeyError:
+        raise KeyError('unknown register %r' %name) from None
+
+def address(name):
+    return register(name).address
+
+def channel_frequency(freq_thz,limits_thz=DEFAULT_LIMITS_THZ):
+    #(THz, 0.1 GHz, MHz) values of fcf1/fcf2/fcf3 for one frequency, rounded to 1 MHz; raises ValueError outside limits_thz
+    low,high=limits_thz
+    if not low<=freq_thz<=high: raise ValueError('%r THz is outside %.4f-%.4f THz' %(freq_thz,low,high))
+    total_mhz=int(round(freq_thz*1e6))
+    return(total_mhz//1000000,(total_mhz%1000000)//100,total_mhz%100)
+
+def operation(name,value=None):
+    #(address, data, rw) for ITLABatch: a read when value is None, otherwise a write of value in engineering units
+    entry=register(name)
+    if value is None: return(entry.address,0,itla.READ)
+    return(entry.address,entry.to_raw(value),itla.WRITE)
+
+class Laser:
+    """Register access by name, in engineering units.
+
+    Reads return the decoded value, or None if the transaction failed; writes take engineering units
+    and return the ITLAResult. Several names can be read in one atomic ITLABatch with read_many, and
+    words of the same AEA register are fetched once. Pass a RegisterCache as ``cache`` to route the
+    transactions through it.
+    """
+
+    def __init__(self,sercon,priority=itla.PRIORITY_NORMAL,cache=None):
+        self.sercon=sercon
+        self.priority=priority
+        self.cache=cache
+
+    def _batch(self,operations):
+        if self.cache is not None: return self.cache.batch(operations,self.priority)
+        return itla.ITLABatch(self.sercon,operations,self.priority)
+
+    def read(self,name):
+        return self.read_many(name)[name]
+
+    def read_many(self,*names):
+        #dict name -> value (None where the read failed), from one batch
+        entries=[register(name) for name in names]
+        addresses=list(dict.fromkeys(entry.address for entry in entries))
+        results=dict(zip(addresses,self._batch([(address,0,itla.READ) for address in addresses])))
+        values={}
+        for entry in entries:
+            result=results[entry.address]
+            values[entry.name]=entry.decode(result.value) if result.ok else None
+        return values
+
+    def write(self,name,value):
+        return self._batch([operation(name,value)])[0]
+
+    def write_many(self,values):
+        #writes {name: value} in order as one batch; all values are converted before anything is sent
+        return self._batch([operation(name,value) for name,value in values.items()])
+
+    def frequency(self):
+        #laser frequency in THz from the three readback registers, or None
+        values=self.read_many('lf1_THz','lf2_THz','lf3_THz')
+        if None in values.values(): return None
+        return sum(values.values())
@@ -0,0 +1,314 @@
+#software stand-in for a PPCL300 ITLA module, usable wherever ITLA_reference expects a serial.Serial
+import random
+import struct
+import threading
+import time
+
+import ITLA_reference as itla
+
+#module status codes as they appear in the low two bits of a response frame
+STATUS_OK=0x00
+STATUS_XE=0x01
+STATUS_AEA=0x02
+STATUS_CP=0x03
+
+#default register contents of the simulated module (16 bit values)
+DEFAULT_REGISTERS={
+    0x00:0x0010,  #NOP: MRDY set, no pending operations
+    0x31:1000,    #power setpoint, 0.01 dBm
+    0x32:0,       #ResEna
+    0x35:193,     #first channel frequency, THz
+    0x36:4000,    #first channel frequency, 0.1 GHz
+    0x42:1000,    #optical output power, 0.01 dBm
+    0x43:3500,    #case temperature, 0.01 C
+    0x4F:12000,   #FTF range, MHz
+    0x52:191,     #lowest frequency, THz
+    0x53:5000,    #lowest frequency, 0.1 GHz
+    0x54:196,     #highest frequency, THz
+    0x55:2500,    #highest frequency, 0.1 GHz
+    0x62:0,       #FTF, MHz (signed)
+    0x65:96,      #baud rate / 100, kept in sync with device_baudrate
+    0x67:0,       #first channel frequency, MHz
+    0x90:0,       #whisper mode
+}
+
+SUPPORTED_BAUDRATES=(4800,9600,19200,38400,57600,115200)
+TUNING_REGISTERS=(0x32,0x35,0x36,0x67,0x90)  #writes that leave an operation pending for tuning_time
+
+#injectable link faults: a host byte lost, a noise byte inserted before a host byte, a response frame with a bit flipped
+FAULT_KINDS=('drop','extra','corrupt')
+
+#registers answered with an AEA (multi-frame) response; values are word lists or byte strings
+DEFAULT_AEA_REGISTERS={
+    0x01:b'CW ITLA',
+    0x02:b'Pure Photonics',
+    0x03:b'PPCL300',
+    0x04:b'SIM0001',
+    0x57:[15000,9000],   #currents: TEC, diode (0.1 mA)
+    0x58:[3500,2750],    #temperatures: laser, ambient (0.01 C)
+}
+
+class SimulatedITLA:
+    """Simulated ITLA module exposing the subset of the serial.Serial API used by ITLA_reference.
+
+    Frames written by the host are decoded with the 4-byte checksummed protocol and answered
+    after the wire time at ``device_baudrate`` plus ``response_latency`` and ``byte_latency``
+    per response byte. If the host ``baudrate`` differs from the device rate, written bytes are
+    lost just as they would be on a real link.
+
+    ``faults`` maps fault kinds (see FAULT_KINDS) to probabilities: per written byte for 'drop' and
+    'extra', per response frame for 'corrupt'. ``inject`` forces faults deterministically, optionally
+    only on the response to a given register, and ``faults_injected`` counts the faults applied so far.
+    """
+
+    def __init__(self,port='SIM',baudrate=9600,timeout=1,device_baudrate=None,
+                 byte_latency=0.0,response_latency=0.0005,registers=None,aea_registers=None,tuning_time=0.0,
+                 faults=None,fault_seed=None):
+        self.port=port
+        self._baudrate=baudrate
+        self.timeout=timeout
+        self.device_baudrate=device_baudrate if device_baudrate is not None else baudrate
+        self.byte_latency=byte_latency
+        self.response_latency=response_latency
+        self.registers=dict(DEFAULT_REGISTERS)
+        if registers: self.registers.update(registers)
+        self.aea_registers=dict(DEFAULT_AEA_REGISTERS)
+        if aea_registers: self.aea_registers.update(aea_registers)
+        self.is_open=True
+        self.frames_received=0
+        self._lock=threading.Lock()
+        self._frame=bytearray()
+        self._out=bytearray()
+        self._out_ready=[]     #time at which each byte of _out is available to the host
+        self._line_free=0.0    #time at which the host->device line is idle again
+        self._aea=b''
+        self._next_baudrate=None  #set by a 0x65 write, applied once the response has been sent
+        self.tuning_time=tuning_time  #seconds a frequency or enable change stays pending
+        self._busy_until=0.0
+        self._settled_frequency=None  #frequency reported while a change is pending
+        self.faults=dict(faults or {})
+        self.faults_injected=dict.fromkeys(FAULT_KINDS,0)
+        self._forced_faults=dict.fromkeys(FAULT_KINDS,0)
+        self._targeted_faults=[]  #[register, responses to let through first] for corrupt faults aimed at one register
+        self._rng=random.Random(fault_seed)
+
+    def __repr__(self):
+        return('SimulatedITLA(port=%r, baudrate=%d, device_baudrate=%d)' %(self.port,self._baudrate,self.device_baudrate))
+
+    # serial.Serial compatible interface
+    @property
+    def baudrate(self):
+        return self._baudrate
+
+    @baudrate.setter
+    def baudrate(self,value):
+        self._baudrate=value
+
+    @property
+    def in_waiting(self):
+        with self._lock:
+            return self._ready(time.perf_counter())
+
+    def inWaiting(self):
+        return self.in_waiting
+
+    def write(self,data):
+        data=bytes(data)
+        now=time.perf_counter()
+        with self._lock:
+            start=max(now,self._line_free)
+            self._line_free=start+len(data)*self.byte_time(self._baudrate)
+            if self._baudrate!=self.device_baudrate:
+                return len(data)  #framing errors: the module never sees these bytes
+            for offset,value in enumerate(data):
+                arrival=start+(offset+1)*self.byte_time(self._baudrate)
+                if self._fault('drop'): continue
+                if self._fault('extra'): self._receive(self._rng.randrange(256),arrival)
+                self._receive(value,arrival)
+        return len(data)
+
+    def inject(self,kind,count=1,register=None,skip=0):
+        #forces the next count opportunities for a fault of the given kind, for reproducible tests.
+        #With register, corrupts the responses to that register instead, after letting skip of them through
+        if kind not in FAULT_KINDS: raise ValueError('unknown fault kind %r' %kind)
+        if register is not None and kind!='corrupt': raise ValueError('only corrupt faults target a register')
+        with self._lock:
+            if register is None: self._forced_faults[kind]+=count
+            else: self._targeted_faults.extend([register,skip+index] for index in range(count))
+
+    def read(self,size=1):
+        deadline=None if self.timeout is None else time.perf_counter()+self.timeout
+        while True:
+            now=time.perf_counter()
+            with self._lock:
+                ready=self._ready(now)
+                if ready>=size or (deadline is not None and now>=deadline):
+                    count=min(ready,size)
+                    data=bytes(self._out[:count])
+                    del self._out[:count]
+                    del self._out_ready[:count]
+                    return data
+                wake=self._out_ready[size-1] if len(self._out_ready)>=size else None
+            if deadline is not None and (wake is None or wake>deadline): wake=deadline
+            if wake is None: wake=now+0.001
+            time.sleep(max(wake-now,0))
+
+    def reset_input_buffer(self):
+        with self._lock:
+            self._out.clear()
+            self._out_ready.clear()
+
+    def reset_output_buffer(self):
+        pass
+
+    flushInput=reset_input_buffer
+    flushOutput=reset_output_buffer
+
+    def flush(self):
+        pass
+
+    def open(self):
+        self.is_open=True
+
+    def close(self):
+        self.is_open=False
+
+    # device model
+    @staticmethod
+    def byte_time(baudrate):
+        #wire time of one byte, 8N1 framing
+        return 10.0/baudrate
+
+    def _ready(self,now):
+        count=0
+        for ready in self._out_ready:
+            if ready>now: break
+            count+=1
+        return count
+
+    def _fault(self,kind):
+        if self._forced_faults[kind]:
+            self._forced_faults[kind]-=1
+        else:
+            probability=self.faults.get(kind,0.0)
+            if not probability or self._rng.random()>=probability: return False
+        self.faults_injected[kind]+=1
+        return True
+
+    def _receive(self,value,arrival):
+        #one byte reaching the module's frame decoder
+        self._frame.append(value)
+        if len(self._frame)<4: return
+        self._respond(self._handle_frame(bytes(self._frame)),arrival)
+        self._frame.clear()
+        if self._next_baudrate:
+            self.device_baudrate=self._next_baudrate
+            self._next_baudrate=None
+
+    def _targeted(self,register):
+        #True if a corrupt fault aimed at this register is due now
+        due=False
+        for target in self._targeted_faults:
+            if target[0]!=register: continue
+            if target[1]==0:
+                if not due: due=target
+            else: target[1]-=1
+        if not due: return False
+        self._targeted_faults.remove(due)
+        self.faults_injected['corrupt']+=1
+        return True
+
+    def _respond(self,frame,arrival):
+        if self._targeted(frame[1]) or self._fault('corrupt'): frame=bytes((frame[0],frame[1],frame[2]^0x01,frame[3]))
+        start=max(arrival+self.response_latency,self._out_ready[-1] if self._out_ready else 0.0)
+        step=self.byte_time(self.device_baudrate)+self.byte_latency
+        for offset,value in enumerate(frame):
+            self._out.append(value)
+            self._out_ready.append(start+(offset+1)*step)
+
+    def _handle_frame(self,frame):
+        self.frames_received+=1
+        byte0,register,byte2,byte3=frame
+        if itla.checksum(byte0,register,byte2,byte3)!=byte0>>4:
+            return self._frame_bytes(STATUS_XE,register,0)
+        data=byte2*256+byte3
+        if byte0&0x01==itla.WRITE:
+            status,value=self.write_register(register,data)
+        else:
+            status,value=self.read_register(register)
+        return self._frame_bytes(status,register,value)
+
+    def _frame_bytes(self,status,register,value):
+        byte2=(value>>8)&0xFF
+        byte3=value&0xFF
+        return bytes((itla.checksum(status,register,byte2,byte3)*16+status,register,byte2,byte3))
+
+    def read_register(self,register):
+        #returns (status, 16 bit value) for a read of the given register
+        if register==0x0B:
+            if not self._aea: return(STATUS_XE,0)
+            chunk=self._aea[:2].ljust(2,b'\x00')
+            self._aea=self._aea[2:]
+            return(STATUS_OK,chunk[0]*256+chunk[1])
+        if register in self.aea_registers:
+            payload=self.aea_registers[register]
+            if not isinstance(payload,(bytes,bytearray)):
+                payload=struct.pack('>%dH' %len(payload),*(word&0xFFFF for word in payload))
+            self._aea=bytes(payload)
+            return(STATUS_AEA,len(self._aea))
+        if register==0x00:
+            if time.perf_counter()<self._busy_until: return(STATUS_OK,(self.registers[0x00]|0x0100)&~0x0010)
+            return(STATUS_OK,self.registers[0x00])
+        if register in (0x40,0x41,0x68):
+            return(STATUS_OK,self.frequency_registers()[register])
+        if register==0x65:
+            return(STATUS_OK,self.device_baudrate//100)
+        if register in self.registers:
+            return(STATUS_OK,self.registers[register]&0xFFFF)
+        return(STATUS_XE,0)
+
+    def write_register(self,register,data):
+        #returns (status, 16 bit value) for a write of the given register
+        if register not in self.registers or register==0x00:
+            return(STATUS_XE,0)
+        if register==0x65:
+            if data*100 not in SUPPORTED_BAUDRATES: return(STATUS_XE,0)
+            self._next_baudrate=data*100
+        if register in TUNING_REGISTERS and self.tuning_time>0:
+            now=time.perf_counter()
+            if now>=self._busy_until: self._settled_frequency=self.frequency_mhz()
+            self._busy_until=now+self.tuning_time
+        self.registers[register]=data
+        return(STATUS_OK,data)
+
+    def frequency_mhz(self):
+        #current output frequency in MHz: first channel frequency plus signed FTF offset
+        ftf=self.registers[0x62]
+        if ftf>32767: ftf-=65536
+        return(self.registers[0x35]*1000000+self.registers[0x36]*100+self.registers[0x67]+ftf)
+
+    def frequency_registers(self):
+        total=self.frequency_mhz()
+        if time.perf_counter()<self._busy_until: total=self._settled_frequency
+        return{0x40:total//1000000,0x41:(total%1000000)//100,0x68:total%100}
+
+class SimulatedDiscriminator:
+    """Frequency discriminator watching a SimulatedITLA, for exercising lock loops without hardware.
+
+    Calling the object returns the error signal in MHz: target minus the module's output frequency
+    (first channel frequency plus FTF), with a linear drift and optional Gaussian noise added to the
+    laser frequency.
+    """
+
+    def __init__(self,device,target_mhz=None,drift_mhz_per_s=0.0,noise_mhz=0.0,seed=None):
+        self.device=device
+        self.target_mhz=device.frequency_mhz() if target_mhz is None else target_mhz
+        self.drift_mhz_per_s=drift_mhz_per_s
+        self.noise_mhz=noise_mhz
+        self._random=random.Random(seed)
+        self._start=time.perf_counter()
+
+    def __call__(self):
+        drift=self.drift_mhz_per_s*(time.perf_counter()-self._start)
+        noise=self._random.gauss(0.0,self.noise_mhz) if self.noise_mhz else 0.0
+        return self.target_mhz-(self.device.frequency_mhz()+drift+noise)
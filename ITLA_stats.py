@@ -0,0 +1,124 @@
+#lightweight timing statistics shared by the lock engine, telemetry and protocol instrumentation
+import math
+import threading
+
+import ITLA_reference as itla
+
+class Histogram:
+    """Log-spaced histogram of durations in seconds.
+
+    Bins cover 1 us to about 1000 s with 8 bins per octave (about 9% resolution), so recording is a
+    constant-time update and percentiles are read from the bins without keeping samples.
+    """
+
+    BINS_PER_OCTAVE=8
+    MIN_VALUE=1e-6
+    NBINS=8*30
+
+    def __init__(self):
+        self.counts=[0]*self.NBINS
+        self.count=0
+        self.total=0.0
+        self.min=None
+        self.max=None
+
+    def record(self,value):
+        if value<=self.MIN_VALUE: index=0
+        else: index=min(self.NBINS-1,int(math.log2(value/self.MIN_VALUE)*self.BINS_PER_OCTAVE))
+        self.counts[index]+=1
+        self.count+=1
+        self.total+=value
+        if self.min is None or value<self.min: self.min=value
+        if self.max is None or value>self.max: self.max=value
+
+    def mean(self):
+        return self.total/self.count if self.count else 0.0
+
+    def percentile(self,fraction):
+        #upper edge of the bin holding the given fraction of samples, limited to the largest sample seen
+        if not self.count: return 0.0
+        target=max(1,int(math.ceil(fraction*self.count)))
+        seen=0
+        for index,count in enumerate(self.counts):
+            seen+=count
+            if seen>=target:
+                return min(self.max,self.MIN_VALUE*2**((index+1)/self.BINS_PER_OCTAVE))
+        return self.max
+
+    def merge(self,other):
+        for index,count in enumerate(other.counts): self.counts[index]+=count
+        self.count+=other.count
+        self.total+=other.total
+        for value in (other.min,other.max):
+            if value is None: continue
+            if self.min is None or value<self.min: self.min=value
+            if self.max is None or value>self.max: self.max=value
+
+    def summary(self,scale=1e3):
+        #count, mean, p50, p99 and max, in milliseconds by default
+        return{'count':self.count,'mean':self.mean()*scale,'p50':self.percentile(0.5)*scale,
+               'p99':self.percentile(0.99)*scale,'max':(self.max or 0.0)*scale}
+
+class ProtocolStats:
+    """Instrumentation hook collecting per-register latency and protocol error counts.
+
+    Install on a connection with ITLA_reference.ITLAAddHook(sercon, stats). Each call records the
+    result's link latency in the register's Histogram and bumps the counter for its status, so the
+    cost per transaction is a dict lookup and a histogram update.
+    """
+
+    def __init__(self):
+        self._lock=threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        self.latency={}        #register -> Histogram of link latency
+        self.errors={}         #register -> operations that did not return ITLA_NOERROR
+        self.transactions=0
+        self.checksum_errors=0
+        self.no_response=0
+        self.execution_errors=0
+        self.queue_timeouts=0
+        self.resyncs=0
+        self.recovery=Histogram()  #time spent resyncing, per operation that needed it
+
+    def __call__(self,result):
+        status=result.status
+        with self._lock:
+            self.transactions+=1
+            if result.retries:
+                self.resyncs+=result.retries
+                self.recovery.record(result.recovery)
+            if status==itla.ITLA_QTERROR:
+                self.queue_timeouts+=1
+            else:
+                histogram=self.latency.get(result.register)
+                if histogram is None: histogram=self.latency[result.register]=Histogram()
+                histogram.record(result.latency)
+            if status==itla.ITLA_NOERROR: return
+            self.errors[result.register]=self.errors.get(result.register,0)+1
+            if status==itla.ITLA_CSERROR: self.checksum_errors+=1
+            elif status==itla.ITLA_NRERROR: self.no_response+=1
+            elif status==itla.ITLA_EXERROR: self.execution_errors+=1
+
+    def reset(self):
+        with self._lock:
+            self._clear()
+
+    def report(self):
+        #event counters and, per register ('0x40', ...), the latency summary in ms and error count;
+        #registers are ordered by total time spent on the link
+        with self._lock:
+            registers=sorted(self.latency.items(),key=lambda item:-item[1].total)
+            return{
+                'transactions':self.transactions,
+                'checksum_errors':self.checksum_errors,
+                'no_response':self.no_response,
+                'execution_errors':self.execution_errors,
+                'queue_timeouts':self.queue_timeouts,
+                'resyncs':self.resyncs,
+                'recovery_ms':self.recovery.summary(),
+                'registers':{'0x%02X' %register:dict(histogram.summary(),total_ms=histogram.total*1e3,
+                                                      errors=self.errors.get(register,0))
+                             for register,histogram in registers},
+            }
@@ -0,0 +1,121 @@
+#vectorized wavelength/frequency sweep planning and execution over the first channel frequency registers
+import collections
+import time
+
+import numpy as np
+
+import ITLA_reference as itla
+from ITLA_registers import DEFAULT_LIMITS_THZ,address
+
+C=299792458  #m/s
+
+#first channel frequency registers and their resolution
+FCF_REGISTERS=tuple(address(name) for name in ('fcf1_THz','fcf2_THz','fcf3_THz'))  #THz, 0.1 GHz, MHz
+LIMIT_REGISTERS=tuple(address(name) for name in ('low_freq1_THz','low_freq2_THz','high_freq1_THz','high_freq2_THz'))
+LF_REGISTERS=tuple(address(name) for name in ('lf1_THz','lf2_THz','lf3_THz'))  #laser frequency readback
+
+SweepPoint=collections.namedtuple('SweepPoint','index freq_thz writes status settle_s snapshot')
+
+def frequency_registers(freqs_thz):
+    #splits frequencies (THz) into (N,3) integer register values for 0x35/0x36/0x67, rounded to 1 MHz (see ITLA_registers.channel_frequency)
+    total_mhz=np.rint(np.asarray(freqs_thz,dtype=np.float64)*1e6).astype(np.int64)
+    return np.stack((total_mhz//1000000,(total_mhz%1000000)//100,total_mhz%100),axis=-1)
+
+def registers_to_thz(registers):
+    registers=np.asarray(registers,dtype=np.int64)
+    return(registers[...,0]*1000000+registers[...,1]*100+registers[...,2])/1e6
+
+def device_limits(sercon):
+    #tunable range (low, high) in THz from the module's frequency limit registers, or None if unreadable
+    results=itla.ITLABatch(sercon,[(register,0,itla.READ) for register in LIMIT_REGISTERS])
+    if not all(result.ok for result in results): return None
+    low_thz,low_frac,high_thz,high_frac=(result.value for result in results)
+    return(low_thz+low_frac*1e-4,high_thz+high_frac*1e-4)
+
+class SweepPlan:
+    """Register values for every point of a sweep, computed and validated up front.
+
+    freq_thz holds the requested frequencies, registers the (N,3) values for 0x35/0x36/0x67 and
+    error_mhz the difference between requested and programmed frequency.
+    """
+
+    def __init__(self,freq_thz,limits_thz=DEFAULT_LIMITS_THZ,max_error_mhz=0.5):
+        self.freq_thz=np.atleast_1d(np.asarray(freq_thz,dtype=np.float64))
+        if self.freq_thz.ndim!=1 or not len(self.freq_thz): raise ValueError('sweep needs a non-empty 1-D grid')
+        if not np.all(np.isfinite(self.freq_thz)): raise ValueError('sweep grid contains non-finite values')
+        low,high=limits_thz
+        outside=np.flatnonzero((self.freq_thz<low)|(self.freq_thz>high))
+        if len(outside):
+            raise ValueError('%d point(s) outside %.4f-%.4f THz, first at index %d (%.6f THz)'
+                             %(len(outside),low,high,outside[0],self.freq_thz[outside[0]]))
+        self.registers=frequency_registers(self.freq_thz)
+        self.programmed_thz=registers_to_thz(self.registers)
+        self.error_mhz=(self.freq_thz-self.programmed_thz)*1e6
+        worst=int(np.argmax(np.abs(self.error_mhz)))
+        if abs(self.error_mhz[worst])>max_error_mhz:
+            raise ValueError('rounding error %.3f MHz at index %d exceeds %.3f MHz' %(self.error_mhz[worst],worst,max_error_mhz))
+
+    def __len__(self):
+        return len(self.freq_thz)
+
+    def changes(self,current=None):
+        #(N,3) boolean mask of registers to write at each point; current is the (3,) register state before the sweep
+        previous=np.empty_like(self.registers)
+        previous[1:]=self.registers[:-1]
+        if current is None: previous[0]=-1
+        else: previous[0]=current
+        return self.registers!=previous
+
+    def operations(self,current=None):
+        #per-point lists of (register, data, WRITE), containing only registers that change
+        mask=self.changes(current)
+        return [[(register,int(value),itla.WRITE) for register,value,changed in zip(FCF_REGISTERS,row,flags) if changed]
+                for row,flags in zip(self.registers.tolist(),mask.tolist())]
+
+    def transactions(self,current=None):
+        #number of register writes the sweep needs
+        return int(self.changes(current).sum())
+
+def plan_sweep(wavelengths_nm=None,freqs_thz=None,limits_thz=DEFAULT_LIMITS_THZ,max_error_mhz=0.5):
+    #builds a SweepPlan from a wavelength grid (nm, vacuum) or a frequency grid (THz)
+    if (wavelengths_nm is None)==(freqs_thz is None): raise ValueError('give exactly one of wavelengths_nm or freqs_thz')
+    if freqs_thz is None:
+        freqs_thz=C/(np.asarray(wavelengths_nm,dtype=np.float64)*1e-9)/1e12
+    return SweepPlan(freqs_thz,limits_thz,max_error_mhz)
+
+def read_frequency(sercon,priority=itla.PRIORITY_NORMAL):
+    #current laser frequency in THz from 0x40 (THz), 0x41 (0.1 GHz) and 0x68 (MHz), read as one batch
+    results=itla.ITLABatch(sercon,[(register,0,itla.READ) for register in LF_REGISTERS],priority)
+    if not all(result.ok for result in results): return None
+    thz,ghz10,mhz=(result.value for result in results)
+    return thz+ghz10*1e-4+mhz*1e-6
+
+def read_current(sercon):
+    #the module's first channel frequency registers, for skipping unchanged writes at the first point
+    results=itla.ITLABatch(sercon,[(register,0,itla.READ) for register in FCF_REGISTERS])
+    if not all(result.ok for result in results): return None
+    return [result.value for result in results]
+
+def execute_sweep(sercon,plan,settle=None,snapshot=None,dwell=0.0,current=None,priority=itla.PRIORITY_NORMAL):
+    """
+    Steps through a SweepPlan and yields a SweepPoint per point.
+    Only registers that change are written, as one batch per point. settle(sercon) is called after the
+    writes (e.g. ITLA_reference.ITLAWaitUntilSettled) and timed; snapshot(sercon) is called after settling
+    and dwell, and its return value is stored in the point. current is the register state before the
+    sweep (see read_current).
+    """
+    for index,operations in enumerate(plan.operations(current)):
+        status=itla.ITLA_NOERROR
+        if operations:
+            for result in itla.ITLABatch(sercon,operations,priority):
+                if not result.ok:
+                    status=result.status
+                    break
+        settle_s=0.0
+        if settle is not None:
+            start=time.perf_counter()
+            settle(sercon)
+            settle_s=time.perf_counter()-start
+        if dwell>0: time.sleep(dwell)
+        yield SweepPoint(index,float(plan.freq_thz[index]),len(operations),status,settle_s,
+                         snapshot(sercon) if snapshot is not None else None)
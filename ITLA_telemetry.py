@@ -0,0 +1,256 @@
+#background telemetry acquisition into a fixed-size ring buffer, spilled to an append-only binary log
+import collections
+import json
+import struct
+import threading
+import time
+
+import ITLA_reference as itla
+
+#one logged value: name, register and, for AEA registers holding several 16 bit words, the word index
+Column=collections.namedtuple('Column','name register word')
+
+DEFAULT_COLUMNS=(
+    Column('freq_thz',0x40,None),      #laser frequency, THz
+    Column('freq_100mhz',0x41,None),   #laser frequency, 0.1 GHz
+    Column('freq_mhz',0x68,None),      #laser frequency, MHz
+    Column('laser_temp',0x58,0),       #0.01 C
+    Column('ambient_temp',0x58,1),     #0.01 C
+    Column('power',0x31,None),         #power setpoint, 0.01 dBm
+    Column('nop',0x00,None),           #NOP / status flags
+)
+
+MAGIC=b'ITLATLM1'
+HEADER_ALIGN=64
+
+def record_struct(columns):
+    #little-endian record: float64 unix time, one uint16 per column, uint16 bitmask of failed columns
+    return struct.Struct('<d%dHH' %len(columns))
+
+def numpy_dtype(columns):
+    import numpy as np
+    return np.dtype([('time','<f8')]+[(column.name,'<u2') for column in columns]+[('status','<u2')])
+
+def encode_header(columns,capacity=None):
+    #magic, uint32 header length, JSON description padded so records start on a 64 byte boundary;
+    #capacity is recorded for ring buffers of fixed size (see ITLA_broker.TelemetryRing)
+    fields={'columns':[list(column) for column in columns],'record_format':record_struct(columns).format}
+    if capacity is not None: fields['capacity']=capacity
+    description=json.dumps(fields).encode()
+    size=len(MAGIC)+4+len(description)
+    padding=(-size)%HEADER_ALIGN
+    return MAGIC+struct.pack('<I',len(description)+padding)+description+b' '*padding
+
+def read_header(path):
+    #returns (columns, offset of the first record)
+    with open(path,'rb') as handle:
+        if handle.read(len(MAGIC))!=MAGIC: raise ValueError('%s is not an ITLA telemetry file' %path)
+        length,=struct.unpack('<I',handle.read(4))
+        description=json.loads(handle.read(length))
+    columns=tuple(Column(*column) for column in description['columns'])
+    return columns,len(MAGIC)+4+length
+
+def load_telemetry(path):
+    #memory-maps a telemetry file as a NumPy structured array (fields: time, one per column, status)
+    import numpy as np
+    columns,offset=read_header(path)
+    dtype=numpy_dtype(columns)
+    with open(path,'rb') as handle:
+        handle.seek(0,2)
+        count=(handle.tell()-offset)//dtype.itemsize
+    if count==0: return np.zeros(0,dtype=dtype)
+    return np.memmap(path,dtype=dtype,mode='r',offset=offset,shape=(count,))
+
+class TelemetryRecorder:
+    """Polls a set of registers on a background thread and keeps the samples in a ring buffer.
+
+    Each cycle reads all columns in one ITLABatch at PRIORITY_POLL, so a sample is never torn by other
+    threads, and packs it as a fixed-size binary record. The ring holds the last ``capacity`` records;
+    if ``path`` is given, records are also appended to that file every ``flush_every`` samples.
+    ``interval`` is the minimum time between cycle starts (0 polls as fast as the link allows).
+    ``on_sample``, if given, is called with every record tuple after it is stored.
+
+    A cycle that raises (e.g. a SerialException when the adapter is unplugged) is counted in
+    ``poll_failures`` and polling goes on; after ``max_failures`` consecutive ones the thread stops and
+    ``failure`` holds the last exception.
+    """
+
+    def __init__(self,sercon,columns=DEFAULT_COLUMNS,capacity=65536,path=None,interval=0.0,flush_every=256,
+                 priority=itla.PRIORITY_POLL,on_sample=None,max_failures=10):
+        self.sercon=sercon
+        self.columns=tuple(columns)
+        self.record=record_struct(self.columns)
+        self.capacity=max(capacity,2*flush_every)
+        self.interval=interval
+        self.flush_every=flush_every
+        self.priority=priority
+        self.path=path
+        self.on_sample=on_sample
+        self.max_failures=max_failures
+        self.samples=0  #total records acquired
+        self.errors=0   #records with at least one failed column
+        self.poll_failures=0  #cycles that raised instead of producing a record
+        self.failure=None     #exception that stopped the polling thread
+        self._ring=bytearray(self.capacity*self.record.size)
+        self._view=memoryview(self._ring)
+        self._lock=threading.Lock()
+        self._flushed=0  #samples already written to the file
+        self._file=None
+        self._thread=None
+        self._stop=threading.Event()
+        #registers to read once per cycle, and where each column takes its value from
+        registers=[]
+        for column in self.columns:
+            if column.register not in registers: registers.append(column.register)
+        self._operations=[(register,0,itla.READ) for register in registers]
+        self._sources=[(registers.index(column.register),column.word) for column in self.columns]
+
+    def start(self):
+        #raises ValueError if path is an existing telemetry file with other columns
+        if self.running: return
+        if self.path and self._file is None:
+            self._file=open(self.path,'ab')
+            if self._file.tell()==0: self._file.write(encode_header(self.columns))
+            else:
+                try:
+                    columns,_=read_header(self.path)
+                    if columns!=self.columns: raise ValueError('%s holds columns %s, not %s' %(
+                        self.path,[column.name for column in columns],[column.name for column in self.columns]))
+                except (ValueError,KeyError,TypeError,struct.error) as error:
+                    self._file.close()
+                    self._file=None
+                    raise ValueError(str(error)) from None
+        self.failure=None
+        self._stop.clear()
+        self._thread=threading.Thread(target=self._run,daemon=True)
+        self._thread.start()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread=None
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file=None
+
+    def poll(self):
+        #acquires and stores one record; returns its values as a tuple (time, column values..., status)
+        results=itla.ITLABatch(self.sercon,self._operations,self.priority)
+        values=[]
+        status=0
+        for bit,(index,word) in enumerate(self._sources):
+            result=results[index]
+            value=result.value
+            if word is not None:
+                value=itla.ITLASplitDual(value,word) if isinstance(value,str) and len(value)>=2*word+2 else None
+            if not result.ok or value is None:
+                status|=1<<bit
+                value=0
+            values.append(value&0xFFFF)
+        sample=(time.time(),*values,status)
+        with self._lock:
+            self.record.pack_into(self._ring,(self.samples%self.capacity)*self.record.size,*sample)
+            self.samples+=1
+            if status: self.errors+=1
+        if self._file is not None and self.samples-self._flushed>=self.flush_every: self.flush()
+        if self.on_sample is not None: self.on_sample(sample)
+        return sample
+
+    def latest(self):
+        #most recent record as a dict, or None before the first sample
+        with self._lock:
+            if not self.samples: return None
+            sample=self.record.unpack_from(self._ring,((self.samples-1)%self.capacity)*self.record.size)
+        return dict(zip(['time']+[column.name for column in self.columns]+['status'],sample))
+
+    def history(self,count=None):
+        #the last count records (all buffered ones by default), oldest first, as a list of tuples
+        with self._lock:
+            available=min(self.samples,self.capacity)
+            count=available if count is None else min(count,available)
+            first=self.samples-count
+            return [self.record.unpack_from(self._ring,(index%self.capacity)*self.record.size)
+                    for index in range(first,self.samples)]
+
+    def history_array(self):
+        #buffered records, oldest first, as a NumPy structured array (one copy of the ring)
+        import numpy as np
+        with self._lock:
+            available=min(self.samples,self.capacity)
+            start=self.samples%self.capacity if self.samples>self.capacity else 0
+            data=bytes(self._view[start*self.record.size:available*self.record.size])+bytes(self._view[:start*self.record.size])
+        return np.frombuffer(data,dtype=numpy_dtype(self.columns))
+
+    def flush(self):
+        #appends records acquired since the last flush to the log file
+        if self._file is None: return
+        with self._lock:
+            first=max(self._flushed,self.samples-self.capacity)  #older records were overwritten before reaching the file
+            chunks=[]
+            index=first
+            while index<self.samples:
+                start=index%self.capacity
+                stop=min(self.capacity,start+self.samples-index)
+                chunks.append(bytes(self._view[start*self.record.size:stop*self.record.size]))
+                index+=stop-start
+            self._flushed=self.samples
+        for chunk in chunks: self._file.write(chunk)
+        self._file.flush()
+
+    def _run(self):
+        next_cycle=time.perf_counter()
+        failures=0
+        while not self._stop.is_set():
+            try:
+                self.poll()
+                failures=0
+            except Exception as error:
+                self.poll_failures+=1
+                failures+=1
+                if failures>=self.max_failures:
+                    self.failure=error
+                    return
+            if self.interval>0:
+                next_cycle+=self.interval
+                delay=next_cycle-time.perf_counter()
+                if delay>0: self._stop.wait(delay)
+                else: next_cycle=time.perf_counter()
+
+class DecimatingHistory:
+    """Min/max decimated history of one signal with a bounded number of buckets.
+
+    Each bucket covers ``step`` consecutive samples. When more than 2*size buckets exist, neighbouring
+    buckets are merged and step doubles, so hours of samples always render from at most 2*size points.
+    """
+
+    def __init__(self,size=500):
+        self.size=size
+        self.step=1
+        self.buckets=[]  #[time of first sample, min, max, samples]
+
+    def add(self,t,value):
+        if self.buckets and self.buckets[-1][3]<self.step:
+            bucket=self.buckets[-1]
+            if value<bucket[1]: bucket[1]=value
+            if value>bucket[2]: bucket[2]=value
+            bucket[3]+=1
+            return
+        self.buckets.append([t,value,value,1])
+        if len(self.buckets)>2*self.size:
+            merged=[]
+            for index in range(0,len(self.buckets)-1,2):
+                first,second=self.buckets[index],self.buckets[index+1]
+                merged.append([first[0],min(first[1],second[1]),max(first[2],second[2]),first[3]+second[3]])
+            if len(self.buckets)%2: merged.append(self.buckets[-1])
+            self.buckets=merged
+            self.step*=2
+
+    def clear(self):
+        self.step=1
+        self.buckets=[]
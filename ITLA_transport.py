@@ -0,0 +1,493 @@
+#transports the ITLA protocol runs over: serial ports, VISA serial (ASRL) resources, the simulator and capture files
+#every transport offers the subset of the serial.Serial API that ITLA_reference uses (write, read, in_waiting,
+#inWaiting, reset_input_buffer, flushInput, timeout, baudrate, close), so the protocol stack runs unchanged on any
+#usage: sercon=open_transport('/dev/ttyUSB0') | open_transport('COM5') | open_transport('ASRL5::INSTR')
+#       open_transport('pymeasure:ASRL5::INSTR') | open_transport('sim') | open_transport('replay:bench.itlacap?speed=10')
+import collections
+import json
+import os
+import struct
+import sys
+import threading
+import time
+
+import serial
+
+#capture files: MAGIC, uint32 header length, JSON header, then events of EVENT + payload
+CAPTURE_MAGIC=b'ITLACAP1'
+EVENT=struct.Struct('<cQH')  #kind, nanoseconds since the capture started, payload length
+EVENT_OPEN=b'O'      #payload: uint32 baud rate
+EVENT_WRITE=b'W'     #bytes written by the host
+EVENT_READ=b'R'      #bytes received by the host
+EVENT_DISCARD=b'D'   #bytes received but discarded by an input flush
+EVENT_BAUD=b'B'      #payload: uint32 baud rate
+EVENT_CLOSE=b'C'
+EVENT_TRANSACTION=b'T'  #payload: TRANSACTION, written by the ITLA layer when a transaction completes
+BAUD=struct.Struct('<I')
+TRANSACTION=struct.Struct('<BBBH')  #register, kind, status, data
+TRANSACTION_AEA=2  #kind of an ITLAReadAEA read; READ and WRITE as in ITLA_reference
+
+Transaction=collections.namedtuple('Transaction','time register kind status data')
+
+class TransportError(serial.SerialException):
+    """A transport could not be opened; a SerialException so ITLAConnect moves on to the next port."""
+
+def port_name(port):
+    #device path for a serial port name: \\.\COMn on Windows (required from COM10 up), /dev/<name> for bare
+    #POSIX names such as ttyUSB0; anything else is passed through
+    port=str(port)
+    if sys.platform.startswith('win'):
+        return port if port.startswith('\\\\.\\') else '\\\\.\\'+port
+    if '/' not in port and os.path.exists('/dev/'+port): return '/dev/'+port
+    return port
+
+def is_visa_resource(port):
+    return str(port).upper().startswith('ASRL')
+
+def open_serial(port,baudrate=9600,timeout=1):
+    #pyserial port; on Linux the tty is put in low latency mode so received bytes are pushed to the host at once
+    try:
+        sercon=serial.Serial(port_name(port),baudrate,timeout=timeout)
+    except ValueError as error:
+        raise TransportError('%s: %s' %(port,error)) from None
+    if hasattr(sercon,'set_low_latency_mode'):
+        try:
+            sercon.set_low_latency_mode(True)
+        except (OSError,ValueError,NotImplementedError):
+            pass  #not supported by the driver (e.g. pseudo terminals)
+    return sercon
+
+class VisaTransport:
+    """A VISA serial resource (pyvisa SerialInstrument) as an ITLA transport.
+
+    Frames go through write_raw and read_bytes with termination characters disabled, so binary
+    responses are never cut at a 0x0A; in_waiting is the resource's bytes_in_buffer. A read that times
+    out returns b'' as pyserial does, which the protocol reports as a missing response.
+    """
+
+    def __init__(self,resource,baudrate=None,timeout=1):
+        from pyvisa import constants
+        self._constants=constants
+        self.resource=resource
+        resource.read_termination=None
+        resource.end_input=constants.SerialTermination.none
+        if baudrate: resource.baud_rate=baudrate
+        self.timeout=timeout
+        self.is_open=True
+
+    def __repr__(self):
+        return '%s(%r, baudrate=%d)' %(type(self).__name__,self.port,self.baudrate)
+
+    @property
+    def port(self):
+        return self.resource.resource_name
+
+    @property
+    def baudrate(self):
+        return self.resource.baud_rate
+
+    @baudrate.setter
+    def baudrate(self,value):
+        self.resource.baud_rate=value
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self,value):
+        self._timeout=value
+        self.resource.timeout=None if value is None else value*1000  #VISA timeouts are in ms
+
+    @property
+    def in_waiting(self):
+        return self.resource.bytes_in_buffer
+
+    def inWaiting(self):
+        return self.in_waiting
+
+    def write(self,data):
+        return self.resource.write_raw(bytes(data))
+
+    def read(self,size=1):
+        from pyvisa.errors import VisaIOError
+        try:
+            return bytes(self.resource.read_bytes(size))
+        except VisaIOError as error:
+            if error.error_code!=self._constants.StatusCode.error_timeout: raise serial.SerialException(str(error)) from None
+            return b''
+
+    def reset_input_buffer(self):
+        self.resource.flush(self._constants.BufferOperation.discard_read_buffer)
+
+    def reset_output_buffer(self):
+        self.resource.flush(self._constants.BufferOperation.discard_write_buffer)
+
+    flushInput=reset_input_buffer
+    flushOutput=reset_output_buffer
+
+    def close(self):
+        if self.is_open:
+            self.is_open=False
+            self.resource.close()
+
+def open_visa(resource_name,baudrate=9600,timeout=1,resource_manager=None):
+    #VISA ASRL resource, e.g. 'ASRL5::INSTR' or 'ASRL/dev/ttyUSB0::INSTR'; resource_manager defaults to pyvisa's default backend
+    import pyvisa
+    try:
+        manager=resource_manager if resource_manager is not None else pyvisa.ResourceManager()
+        resource=manager.open_resource(resource_name)
+    except (pyvisa.Error,OSError,ValueError) as error:
+        raise TransportError('%s: %s' %(resource_name,error)) from None
+    return VisaTransport(resource,baudrate,timeout)
+
+class PymeasureTransport(VisaTransport):
+    """A pymeasure VISAAdapter as an ITLA transport.
+
+    The frames bypass the adapter's text layer and use its pyvisa resource directly (see VisaTransport);
+    the adapter stays available as ``adapter`` for instrument classes sharing the port.
+    """
+
+    def __init__(self,adapter,baudrate=None,timeout=1):
+        self.adapter=adapter
+        VisaTransport.__init__(self,adapter.connection,baudrate,timeout)
+
+    def close(self):
+        if self.is_open:
+            self.is_open=False
+            self.adapter.close()
+
+def open_pymeasure(resource_name,baudrate=9600,timeout=1):
+    from pymeasure.adapters import VISAAdapter
+    try:
+        adapter=VISAAdapter(resource_name)
+    except Exception as error:  #pymeasure passes on whatever the VISA backend raises
+        raise TransportError('%s: %s' %(resource_name,error)) from None
+    return PymeasureTransport(adapter,baudrate,timeout)
+
+class CaptureWriter:
+    """Appends transport events to a new capture file; shared by every transport opened with it.
+
+    transaction() is an ITLA_reference hook (ITLAOpen registers it) recording each transaction's
+    request and status, so a benchmark can replay the session transaction by transaction. Writes are
+    recorded with the value the module echoed. Raises FileExistsError rather than overwrite a file,
+    e.g. an earlier capture or the one being replayed.
+    """
+
+    def __init__(self,path,**header):
+        self.path=path
+        self._file=open(path,'xb')
+        self._lock=threading.Lock()
+        self._start=time.perf_counter_ns()
+        header.setdefault('created',time.time())
+        encoded=json.dumps(header).encode()
+        self._file.write(CAPTURE_MAGIC+struct.pack('<I',len(encoded))+encoded)
+
+    def event(self,kind,payload=b''):
+        timestamp=time.perf_counter_ns()-self._start
+        with self._lock:
+            if self._file is None: return
+            for offset in range(0,max(len(payload),1),0xFFFF):
+                chunk=payload[offset:offset+0xFFFF]
+                self._file.write(EVENT.pack(kind,timestamp,len(chunk)))
+                self._file.write(chunk)
+
+    def transaction(self,result):
+        value=result.value
+        if isinstance(value,(bytes,bytearray)): kind,value=TRANSACTION_AEA,0
+        else: kind,value=result.rw,value if isinstance(value,int) and result.rw else 0
+        self.event(EVENT_TRANSACTION,TRANSACTION.pack(result.register,kind,result.status,value&0xFFFF))
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file=None
+
+def read_capture(path):
+    #(header dict, list of (kind, ns, payload)) of a capture file; a truncated last event is dropped
+    with open(path,'rb') as handle:
+        data=handle.read()
+    if data[:8]!=CAPTURE_MAGIC: raise ValueError('%s is not an ITLA capture' %path)
+    length,=struct.unpack_from('<I',data,8)
+    header=json.loads(data[12:12+length])
+    events=[]
+    offset=12+length
+    while offset+EVENT.size<=len(data):
+        kind,timestamp,size=EVENT.unpack_from(data,offset)
+        offset+=EVENT.size
+        if offset+size>len(data): break
+        events.append((kind,timestamp,data[offset:offset+size]))
+        offset+=size
+    return header,events
+
+def transactions(events):
+    #the Transaction records of a capture, in order; time is in seconds since the capture started
+    return [Transaction(timestamp/1e9,*TRANSACTION.unpack(payload)) for kind,timestamp,payload in events if kind==EVENT_TRANSACTION]
+
+class RecordingTransport:
+    """Passes everything through to another transport and records it to a CaptureWriter.
+
+    Input flushes first read the pending bytes so everything the module sent ends up in the capture.
+    With ``owns_capture`` set, close() closes the CaptureWriter too.
+    """
+
+    def __init__(self,inner,capture,owns_capture=False):
+        self.inner=inner
+        self.capture=capture
+        self.owns_capture=owns_capture
+        capture.event(EVENT_OPEN,BAUD.pack(inner.baudrate))
+
+    def __repr__(self):
+        return 'RecordingTransport(%r)' %(self.inner,)
+
+    @property
+    def port(self):
+        return self.inner.port
+
+    @property
+    def is_open(self):
+        return self.inner.is_open
+
+    @property
+    def baudrate(self):
+        return self.inner.baudrate
+
+    @baudrate.setter
+    def baudrate(self,value):
+        self.inner.baudrate=value
+        self.capture.event(EVENT_BAUD,BAUD.pack(value))
+
+    @property
+    def timeout(self):
+        return self.inner.timeout
+
+    @timeout.setter
+    def timeout(self,value):
+        self.inner.timeout=value
+
+    @property
+    def in_waiting(self):
+        return self.inner.in_waiting
+
+    def inWaiting(self):
+        return self.inner.in_waiting
+
+    def write(self,data):
+        self.capture.event(EVENT_WRITE,bytes(data))
+        return self.inner.write(data)
+
+    def read(self,size=1):
+        data=self.inner.read(size)
+        if data: self.capture.event(EVENT_READ,data)
+        return data
+
+    def reset_input_buffer(self):
+        pending=self.inner.in_waiting
+        if pending: self.capture.event(EVENT_DISCARD,self.inner.read(pending))
+        self.inner.reset_input_buffer()
+
+    flushInput=reset_input_buffer
+
+    def close(self):
+        self.capture.event(EVENT_CLOSE)
+        self.inner.close()
+        if self.owns_capture: self.capture.close()
+
+class ReplayTransport:
+    """Plays the module side of a capture back to the host.
+
+    Every byte the module sent is tied to the number of bytes the host had written when it was
+    received and to the delay since that write. During replay the byte becomes readable once the host
+    has written as many bytes, after the same delay divided by ``speed`` (None: no delay), so the
+    replay does not depend on how the host splits its writes and reads. Written bytes that differ from
+    the capture are counted in ``mismatches``.
+
+    The capture is cut into one segment per recorded transaction; seek(index) moves to the start of
+    a transaction's segment, so a benchmark can replay transactions with a changed protocol stack
+    without one transaction's differences shifting the rest.
+    """
+
+    def __init__(self,path,speed=1.0,timeout=1,baudrate=None):
+        self.path=str(path)
+        self.port='replay:'+self.path
+        self.header,events=read_capture(path)
+        self.timeout=timeout
+        self.speed=speed
+        self._baudrate=baudrate
+        self.is_open=True
+        self.mismatches=0
+        self._lock=threading.Lock()
+        self._expected=bytearray()   #bytes the host wrote during the capture
+        self._responses=[]           #(host bytes written, delay ns, data, segment)
+        self._segments=[0]           #host bytes written at the start of each segment
+        self.starts=[None]           #seconds from the capture start to the first write of each segment
+        written=0
+        last_write=0
+        for kind,timestamp,payload in events:
+            if kind==EVENT_OPEN and self._baudrate is None: self._baudrate=BAUD.unpack(payload)[0]
+            elif kind==EVENT_WRITE:
+                if self.starts[-1] is None: self.starts[-1]=timestamp/1e9
+                self._expected+=payload
+                written+=len(payload)
+                last_write=timestamp
+            elif kind in (EVENT_READ,EVENT_DISCARD):
+                self._responses.append((written,timestamp-last_write,payload,len(self._segments)-1))
+            elif kind==EVENT_TRANSACTION:
+                if self.starts[-1] is None: self.starts[-1]=timestamp/1e9
+                self._segments.append(written)
+                self.starts.append(None)
+        self.transactions=transactions(events)
+        self._written=0
+        self._next=0                 #index of the first response not yet scheduled
+        self._out=bytearray()
+        self._out_ready=[]
+        self._schedule(time.perf_counter())
+
+    def __repr__(self):
+        return 'ReplayTransport(%r, speed=%r)' %(self.path,self.speed)
+
+    @property
+    def baudrate(self):
+        return self._baudrate
+
+    @baudrate.setter
+    def baudrate(self,value):
+        self._baudrate=value
+
+    @property
+    def remaining(self):
+        #capture bytes the host has not read yet
+        with self._lock:
+            return sum(len(response[2]) for response in self._responses[self._next:])+len(self._out)
+
+    @property
+    def finished(self):
+        #True once the host has written everything in the capture and all responses are scheduled
+        return self._written>=len(self._expected) and self._next>=len(self._responses)
+
+    def seek(self,index):
+        #continues the replay at the start of transaction index's segment, dropping what is left of the current one
+        with self._lock:
+            self._out.clear()
+            self._out_ready.clear()
+            self._written=self._segments[min(index,len(self._segments)-1)]
+            self._next=0
+            while self._next<len(self._responses) and self._responses[self._next][3]<index: self._next+=1
+            self._schedule(time.perf_counter())
+
+    def _schedule(self,now):
+        while self._next<len(self._responses) and self._responses[self._next][0]<=self._written:
+            _,delay,data,_=self._responses[self._next]
+            ready=now if not self.speed else now+delay/1e9/self.speed
+            self._out+=data
+            self._out_ready.extend([ready]*len(data))
+            self._next+=1
+
+    def _ready(self,now):
+        count=0
+        for ready in self._out_ready:
+            if ready>now: break
+            count+=1
+        return count
+
+    @property
+    def in_waiting(self):
+        with self._lock:
+            return self._ready(time.perf_counter())
+
+    def inWaiting(self):
+        return self.in_waiting
+
+    def write(self,data):
+        data=bytes(data)
+        with self._lock:
+            expected=self._expected[self._written:self._written+len(data)]
+            self.mismatches+=sum(1 for sent,recorded in zip(data,expected) if sent!=recorded)+len(data)-len(expected)
+            self._written+=len(data)
+            self._schedule(time.perf_counter())
+        return len(data)
+
+    def read(self,size=1):
+        deadline=None if self.timeout is None else time.perf_counter()+self.timeout
+        while True:
+            now=time.perf_counter()
+            with self._lock:
+                ready=self._ready(now)
+                if ready>=size or (deadline is not None and now>=deadline):
+                    count=min(ready,size)
+                    data=bytes(self._out[:count])
+                    del self._out[:count]
+                    del self._out_ready[:count]
+                    return data
+                wake=self._out_ready[size-1] if len(self._out_ready)>=size else None
+            if deadline is not None and (wake is None or wake>deadline): wake=deadline
+            if wake is None: wake=now+0.001
+            time.sleep(max(wake-now,0))
+
+    def reset_input_buffer(self):
+        with self._lock:
+            count=self._ready(time.perf_counter())
+            del self._out[:count]
+            del self._out_ready[:count]
+
+    def reset_output_buffer(self):
+        pass
+
+    flushInput=reset_input_buffer
+    flushOutput=reset_output_buffer
+
+    def open(self):
+        self.is_open=True
+
+    def close(self):
+        self.is_open=False
+        if self.finished and _replays.get(self.path) is self: del _replays[self.path]
+
+_replays={}  #path -> unfinished ReplayTransport, so reopening a port (as ITLAConnect does) continues the capture
+
+def open_replay(spec,timeout=1,baudrate=None):
+    #ReplayTransport for '<path>' or '<path>?speed=<factor>' (0: no delays); an unfinished replay of the same path is reopened
+    path,_,options=spec.partition('?')
+    speed=1.0
+    for option in filter(None,options.split('&')):
+        key,_,value=option.partition('=')
+        if key!='speed': raise TransportError('replay:%s: unknown option %r' %(spec,key))
+        speed=float(value) or None
+    for key in [key for key,replay in _replays.items() if replay.finished]: del _replays[key]
+    replay=_replays.get(path)
+    if replay is not None and not replay.finished and replay.speed==speed:
+        replay.open()
+        replay.timeout=timeout
+        return replay
+    try:
+        replay=ReplayTransport(path,speed,timeout,baudrate)
+    except (OSError,ValueError) as error:
+        raise TransportError('replay:%s: %s' %(spec,error)) from None
+    _replays[path]=replay
+    return replay
+
+def open_transport(port,baudrate=9600,timeout=1,capture=None):
+    """
+    Opens the transport named by port:
+      'COM5', '/dev/ttyUSB0', 'ttyUSB0'  serial port through pyserial
+      'ASRL5::INSTR', 'visa:<resource>'  VISA serial resource through pyvisa
+      'pymeasure:<resource>'            VISA resource through a pymeasure VISAAdapter
+      'sim', 'sim:<name>'               SimulatedITLA
+      'replay:<path>[?speed=<factor>]'  ReplayTransport of a capture file, at the original speed by default
+    capture: a CaptureWriter that records everything sent and received on the transport.
+    Raises serial.SerialException (TransportError for the non-serial kinds) if it cannot be opened.
+    """
+    text=str(port)
+    scheme,_,rest=text.partition(':')
+    scheme=scheme.lower()
+    if scheme=='visa': sercon=open_visa(rest,baudrate,timeout)
+    elif is_visa_resource(text): sercon=open_visa(text,baudrate,timeout)
+    elif scheme=='pymeasure': sercon=open_pymeasure(rest,baudrate,timeout)
+    elif scheme=='sim':
+        from ITLA_simulator import SimulatedITLA
+        sercon=SimulatedITLA(text,baudrate,timeout)
+    elif scheme=='replay': sercon=open_replay(rest,timeout,baudrate)
+    else: sercon=open_serial(text,baudrate,timeout)
+    if capture is not None: sercon=RecordingTransport(sercon,capture)
+    return sercon
@@ -1,6 +1,6 @@
 #example on how to use ITLA_reference.py
 import ITLA_reference as itla
-import time
+from ITLA_registers import Laser
 
 sercon = itla.ITLAConnect('com5', 9600) # To try multiple ports enter a list using ['com1','com2',...], or for a single port use 'com#'
 if isinstance(sercon, int):
@@ -8,18 +8,29 @@ if isinstance(sercon, int):
     exit(1)
 print('Serial connection %s' % sercon)
 # Proceed with communication...
+laser = Laser(sercon) # registers by name, values in engineering units (see ITLA_registers.REGISTERS)
 
-
-result = itla.ITLA(sercon, 0x90, 2, 1)  # Write whisper mode
-print("Set low-noise mode (whisper mode) result:", result)
-time.sleep(2)  # Wait 500ms
+result = laser.write('whisper_mode', 2)  # Write whisper mode
+print("Set low-noise mode (whisper mode) result:", result.value)
+settle = itla.ITLAWaitUntilSettled(sercon, deadline=5)  # Wait until the module reports no pending operation
+print("Whisper mode settled: %s after %.3f s" % (settle.settled, settle.elapsed))
 
 print('Serial connection %s' %sercon)
-print('NOP %d; Flags %d' %(itla.ITLA(sercon,0x00,0,0),itla.ITLA(sercon,0x00,0,0)>>8))
-print('Serial %s' %(itla.ITLA(sercon,0x04,0,0)))
-print('Power setpoint %d *0.01dBm' %(itla.ITLA(sercon,0x31,0,0)))
-itla.ITLA(sercon,0x31,itla.ITLA(sercon,0x31,0,0)-75,1)
-print('New power setpoint %d * 0.01dBm' %(itla.ITLA(sercon,0x31,0,0)))
-print('Laser temcperature %d * 0.01C' %(itla.ITLASplitDual(itla.ITLA(sercon,0x58,0,0),0)))
-print('Ambient temcperature %d * 0.01C' %(itla.ITLASplitDual(itla.ITLA(sercon,0x58,0,0),1)))
-sercon.close()
\ No newline at end of file
+nop=laser.read('nop') #reads return None when the transaction fails (see ITLALastError)
+if nop is None: print('NOP read failed, error %d' %itla.ITLALastError())
+else: print('NOP %d; Flags %d' %(nop,nop>>8))
+print('Serial %s' %(laser.read('serial_number')))
+power=laser.read('power_setpoint_dBm')
+if power is None:
+    print('Power setpoint read failed, error %d' %itla.ITLALastError())
+else:
+    print('Power setpoint %.2f dBm' %(power))
+    result=laser.write('power_setpoint_dBm',power-0.75)
+    new_power=laser.read('power_setpoint_dBm')
+    if result.ok and new_power is not None: print('New power setpoint %.2f dBm' %(new_power))
+    else: print('Power setpoint write failed, status %d' %result.status)
+temps=laser.read_many('laser_temp_C','ambient_temp_C') #both temperatures from one AEA fetch
+for name,label in (('laser_temp_C','Laser'),('ambient_temp_C','Ambient')):
+    if temps[name] is None: print('%s temperature read failed' %label)
+    else: print('%s temperature %.2f C' %(label,temps[name]))
+sercon.close()
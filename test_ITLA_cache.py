@@ -0,0 +1,62 @@
+#RegisterCache invalidation on ResEna (0x32) writes, through the public read/write API against the simulator
+import time
+
+import ITLA_reference as itla
+from ITLA_cache import RESET_REGISTER,RegisterCache,ttl
+from ITLA_registers import RESENA_MR,RESENA_SENA,RESENA_SR
+from ITLA_simulator import SimulatedITLA
+
+def filled_cache():
+    cache=RegisterCache(SimulatedITLA(baudrate=115200))
+    cache.write(0x31,1000)  #power setpoint, write-through
+    cache.read(0x04)        #serial number, static
+    assert served_from_cache(cache)=={0x31,0x04}
+    return cache
+
+def served_from_cache(cache):
+    #registers of 0x31/0x04 that a read answers without going to the module
+    hits=dict(cache.register_hits)
+    cache.read(0x31)
+    cache.read(0x04)
+    return {register for register in (0x31,0x04) if cache.register_hits[register]>hits.get(register,0)}
+
+def test_module_reset_clears_cache():
+    for bits in (RESENA_MR,RESENA_SR):
+        cache=filled_cache()
+        cache.write(RESET_REGISTER,bits)
+        assert served_from_cache(cache)==set()
+        assert cache.read(0x31)==1000 and cache.read(0x04).rstrip('\x00')=='SIM0001'
+
+def test_laser_enable_keeps_cache():
+    cache=filled_cache()
+    cache.write(RESET_REGISTER,RESENA_SENA)
+    assert served_from_cache(cache)=={0x31,0x04}
+    cache.write(RESET_REGISTER,0)  #disable
+    assert served_from_cache(cache)=={0x31,0x04}
+
+def test_policies():
+    sim=SimulatedITLA(baudrate=115200)
+    cache=RegisterCache(sim,policies={0x43:ttl(0.05)})
+    for _ in range(3):
+        cache.read(0x04)  #static: one module read
+        cache.read(0x42)  #never cached
+        cache.read(0x43)  #ttl
+    assert cache.register_misses[0x04]==1 and cache.register_misses[0x42]==3 and cache.register_misses[0x43]==1
+    time.sleep(0.06)
+    cache.read(0x43)
+    assert cache.register_misses[0x43]==2
+    #write-through: a cached value changes only with our own writes
+    cache.write(0x31,1100)
+    sim.registers[0x31]=900
+    assert cache.read(0x31)==1100
+    cache.invalidate(0x31)
+    assert cache.read(0x31)==900
+
+def test_failed_write_drops_cached_value():
+    sim=SimulatedITLA(baudrate=115200)
+    cache=RegisterCache(sim)
+    cache.write(0x31,1100)
+    sim.inject('corrupt',2,register=0x31)  #the write and its resend
+    assert not cache.transact(0x31,1200,itla.WRITE).ok
+    #the module may have applied the write, so the old value is not served any more
+    assert cache.read(0x31)==1200 and cache.register_misses[0x31]==1
@@ -0,0 +1,73 @@
+#job parsing and validation of the command line runner, and a short job against the simulator
+import io
+
+import pytest
+
+import ITLA_reference as itla
+from ITLA_cli import JobError,JobRunner,main,parse_job,parse_script,step_operations
+from ITLA_registers import RESENA_SENA
+from ITLA_simulator import SimulatedITLA
+
+def test_parse_script():
+    steps=parse_script('''
+        connect sim 115200   # comment
+        frequency 193.43
+        enable
+        write power_setpoint_dBm 13.5 ftf_MHz -20
+        settle 5
+        log laser_temp_C count=3 interval=0.1
+        disable
+    ''')
+    assert steps==[('connect',{'port':'sim','baud':115200}),('frequency',193.43),('enable',True),
+                   ('write',{'power_setpoint_dBm':13.5,'ftf_MHz':-20.0}),('settle',{'deadline':5.0,'tolerance_mhz':None}),
+                   ('log',{'registers':['laser_temp_C'],'count':3,'interval':0.1,'file':None}),('enable',False)]
+
+@pytest.mark.parametrize('text',['frequency','frequency abc','write power_setpoint_dBm','enable now','jump 3',
+                                 'log count=3','log laser_temp_C every=2','connect'])
+def test_script_errors(text):
+    with pytest.raises(JobError): parse_script(text)
+
+@pytest.mark.parametrize('job',[
+    [],
+    {'steps':{'read':'nop'}},
+    {'steps':[{'read':'nop','write':{}}]},
+    {'steps':[{'jump':3}]},
+    {'steps':[{'write':[1,2]}]},
+    {'steps':[{'write':{'power_setpoint_dBm':'high'}}]},
+    {'steps':[{'frequency':'193.4'}]},
+    {'steps':[{'enable':'yes'}]},
+    {'steps':[{'settle':{'timeout':3}}]},
+    {'steps':[{'log':{'registers':[],'count':2}}]},
+    {'steps':[{'log':'laser_temp_C'}]},
+    {'steps':[{'connect':{'baud':9600}}]},
+])
+def test_job_errors(job):
+    with pytest.raises(JobError): parse_job(job)
+
+def test_parse_job():
+    options,steps=parse_job({'port':'sim','baud':115200,'steps':[{'read':'nop'},{'disable':None},{'log':['case_temp_C']}]})
+    assert options=={'port':'sim','baud':115200}
+    assert steps==[('read',['nop']),('enable',False),('log',{'registers':['case_temp_C'],'count':1,'interval':1.0,'file':None})]
+
+def test_step_operations():
+    assert step_operations('enable',True)==[(0x32,RESENA_SENA,itla.WRITE)]
+    assert step_operations('enable',False)==[(0x32,0,itla.WRITE)]
+    assert step_operations('frequency',193.43)==[(0x35,193,itla.WRITE),(0x36,4300,itla.WRITE),(0x67,0,itla.WRITE)]
+    with pytest.raises(JobError): step_operations('frequency',500)
+    with pytest.raises(ValueError): step_operations('write',{'power_setpoint_dBm':1000})
+    with pytest.raises(KeyError): step_operations('read',['no_such_register'])
+
+def test_runner_batches_steps():
+    sim=SimulatedITLA(baudrate=115200)
+    out=io.StringIO()
+    runner=JobRunner(sim,out)
+    assert runner.run(parse_script('frequency 194.1\nenable\nread laser_temp_C power_setpoint_dBm'))
+    assert [sim.registers[register] for register in (0x35,0x36,0x67,0x32)]==[194,1000,0,RESENA_SENA]
+    assert runner.values=={'laser_temp_C':pytest.approx(35.0),'power_setpoint_dBm':pytest.approx(10.0)}
+    assert [transactions for _,_,transactions in runner.timings]==[6]
+    assert 'laser_temp_C = 35 C' in out.getvalue()
+
+def test_invalid_job_exits_before_connecting(capsys):
+    with pytest.raises(SystemExit) as exit:
+        main(['--port','sim','-c','frequency 500'])
+    assert exit.value.code==2 and 'outside' in capsys.readouterr().err
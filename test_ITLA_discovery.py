@@ -0,0 +1,35 @@
+#discovery over simulated ports, and the profile that orders the next probe
+import json
+
+from ITLA_discovery import ITLADiscover,baud_candidates,load_profile
+from ITLA_simulator import SimulatedITLA
+
+MODULES={'portA':19200,'portC':57600}  #port -> baud rate the simulated module listens at
+
+def opener(port,baudrate):
+    if port not in MODULES: raise OSError('no such port %r' %port)
+    return SimulatedITLA(port,baudrate,device_baudrate=MODULES[port])
+
+def test_discovery_finds_modules_and_saves_profile(tmp_path):
+    path=str(tmp_path/'profile.json')
+    devices=ITLADiscover(['portA','portB','portC'],profile_path=path,opener=opener)
+    assert [(device.port,device.baudrate,device.serial) for device in devices]==[('portA',19200,'SIM0001'),('portC',57600,'SIM0001')]
+    for device in devices: device.sercon.close()
+    with open(path) as handle:
+        profile=json.load(handle)
+    assert profile['ports']=={'portA':19200,'portC':57600}
+    assert profile['devices']['SIM0001']['port']=='portC'  #last one found with that serial number
+    #the next discovery tries the remembered rate first
+    assert baud_candidates('portA',load_profile(path))[0]==19200
+    assert baud_candidates('portB',load_profile(path))[0]==9600
+
+def test_discovery_with_upgrade(tmp_path):
+    devices=ITLADiscover(['portA'],profile_path=str(tmp_path/'profile.json'),opener=opener,upgrade_baud=True)
+    assert [device.baudrate for device in devices]==[115200]
+    assert devices[0].sercon.device_baudrate==115200
+
+def test_unreadable_profile_is_ignored(tmp_path):
+    path=tmp_path/'profile.json'
+    path.write_text('{not json')
+    assert load_profile(str(path))=={'devices':{},'ports':{}}
+    assert len(ITLADiscover(['portA'],profile_path=str(path),opener=opener))==1
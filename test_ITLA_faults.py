@@ -0,0 +1,70 @@
+#fault-injection checks of the AEA path against the simulator: payload bytes must never come back shifted
+import ITLA_reference as itla
+from ITLA_simulator import SimulatedITLA
+
+SERIAL=b'SIM0001'
+
+def corrupt_continuation(sim,index):
+    #corrupts the response to the index-th (0-based) AEA continuation read (0x0B) from now on
+    sim.inject('corrupt',register=0x0B,skip=index)
+
+def connection(framed):
+    sim=SimulatedITLA(baudrate=115200)
+    if framed: itla.ITLASetFramed(sim)
+    return sim
+
+def test_clean_aea_payload():
+    for framed in (False,True):
+        sim=connection(framed)
+        assert bytes(itla.ITLAReadAEA(sim,0x04))==SERIAL
+        assert itla.ITLALastError()==itla.ITLA_NOERROR
+
+def test_corrupted_continuation_fails_instead_of_shifting():
+    for framed in (False,True):
+        for index in range(4):
+            sim=connection(framed)
+            corrupt_continuation(sim,index)
+            data=itla.ITLAReadAEA(sim,0x04)
+            assert sim.faults_injected['corrupt']==1
+            assert itla.ITLALastError()==itla.ITLA_CSERROR
+            assert data==bytearray()
+            #the link is usable again and a fresh read returns the whole payload
+            assert bytes(itla.ITLAReadAEA(sim,0x04))==SERIAL
+
+def test_corrupted_continuation_through_itla():
+    sim=connection(True)
+    corrupt_continuation(sim,1)
+    result=itla.ITLATransact(sim,0x04,0,itla.READ)
+    assert not result.ok and result.status==itla.ITLA_CSERROR
+    assert result.value==''
+    assert itla.ITLA(sim,0x04,0,itla.READ).rstrip('\x00')==SERIAL.decode()
+
+def test_corrupted_continuation_stops_stream():
+    sim=connection(True)
+    corrupt_continuation(sim,2)
+    chunks=[bytes(chunk) for chunk in itla.ITLAStreamAEA(sim,0x04,chunk=2)]
+    assert itla.ITLALastError()==itla.ITLA_CSERROR
+    assert b''.join(chunks)==SERIAL[:4]
+
+def test_corrupted_plain_read_is_retried():
+    #frames without side effects are still resent after a resync
+    sim=connection(True)
+    sim.inject('corrupt')
+    result=itla.ITLATransact(sim,0x31,0,itla.READ)
+    assert result.ok and result.retries==1 and result.value==sim.registers[0x31]
+
+def test_async_corrupted_continuation_fails_instead_of_shifting():
+    import asyncio
+    from ITLA_async import AsyncITLA
+    async def run(sim):
+        client=AsyncITLA(sim)
+        failed=await client.transact(0x04,0,itla.READ)
+        clean=await client.transact(0x04,0,itla.READ)
+        return failed,clean
+    for index in range(4):
+        sim=SimulatedITLA(baudrate=115200)
+        corrupt_continuation(sim,index)
+        failed,clean=asyncio.run(run(sim))
+        assert sim.faults_injected['corrupt']==1
+        assert failed.status==itla.ITLA_CSERROR and failed.value=='' and failed.retries==1
+        assert clean.ok and clean.value.rstrip('\x00')==SERIAL.decode()
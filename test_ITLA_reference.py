@@ -0,0 +1,95 @@
+#scheduler ordering, batches, resync outcomes, baud upgrade and settle detection against the simulator
+import threading
+import time
+
+import ITLA_reference as itla
+from ITLA_simulator import SimulatedITLA
+
+def queue_in_order(scheduler,priorities):
+    #holds the scheduler, queues one waiter per priority in the given order and returns the grant order
+    assert scheduler.acquire()
+    order=[]
+    def waiter(index,priority):
+        assert scheduler.acquire(priority)
+        order.append(index)
+        scheduler.release()
+    threads=[]
+    for index,priority in enumerate(priorities):
+        threads.append(threading.Thread(target=waiter,args=(index,priority)))
+        threads[-1].start()
+        while scheduler.pending()<index+1: time.sleep(0.001)
+    scheduler.release()
+    for thread in threads: thread.join()
+    return order
+
+def test_scheduler_serves_priority_then_arrival(monkeypatch):
+    monkeypatch.setattr(itla,'PRIORITY_AGING',60.0)
+    priorities=(itla.PRIORITY_POLL,itla.PRIORITY_NORMAL,itla.PRIORITY_CONTROL,itla.PRIORITY_NORMAL)
+    assert queue_in_order(itla.TransactionScheduler(),priorities)==[2,1,3,0]
+
+def test_scheduler_ages_waiting_polls(monkeypatch):
+    monkeypatch.setattr(itla,'PRIORITY_AGING',0.02)
+    scheduler=itla.TransactionScheduler()
+    assert scheduler.acquire()
+    order=[]
+    def waiter(name,priority):
+        assert scheduler.acquire(priority)
+        order.append(name)
+        scheduler.release()
+    poll=threading.Thread(target=waiter,args=('poll',itla.PRIORITY_POLL))
+    poll.start()
+    while scheduler.pending()<1: time.sleep(0.001)
+    time.sleep(0.1)  #five aging steps: now ahead of a fresh control write
+    control=threading.Thread(target=waiter,args=('control',itla.PRIORITY_CONTROL))
+    control.start()
+    while scheduler.pending()<2: time.sleep(0.001)
+    scheduler.release()
+    poll.join()
+    control.join()
+    assert order==['poll','control']
+
+def test_scheduler_timeout():
+    scheduler=itla.TransactionScheduler()
+    assert scheduler.acquire()
+    assert not scheduler.acquire(itla.PRIORITY_CONTROL,timeout=0.01)
+    assert scheduler.timeouts==1 and scheduler.pending()==0
+    scheduler.release()
+    assert scheduler.acquire(timeout=0.01)
+
+def test_batch_results_in_order():
+    sim=SimulatedITLA(baudrate=115200)
+    results=itla.ITLABatch(sim,[(0x31,1200,itla.WRITE),(0x31,0,itla.READ),(0x99,0,itla.READ),(0x04,0,itla.READ)])
+    assert [result.register for result in results]==[0x31,0x31,0x99,0x04]
+    assert results[0].ok and results[1].value==1200 and sim.registers[0x31]==1200
+    assert results[2].status==itla.ITLA_EXERROR
+    assert results[3].ok and results[3].value.rstrip('\x00')=='SIM0001'
+
+def test_resync_outcomes():
+    sim=SimulatedITLA(baudrate=115200)
+    assert itla.ITLAResync(sim).outcome==itla.RESYNC_OK
+    #the module listens at another baud rate: nothing answers the padding
+    silent=itla.ITLAResync(SimulatedITLA(baudrate=9600,device_baudrate=115200))
+    assert silent.outcome==itla.RESYNC_SILENT and silent.bytes_sent==itla.RESYNC_MAX_BYTES
+    #every NOP answer is corrupted: the module answers but never verifies
+    sim=SimulatedITLA(baudrate=115200)
+    sim.inject('corrupt',1000,register=0x00)
+    unverified=itla.ITLAResync(sim)
+    assert unverified.outcome==itla.RESYNC_UNVERIFIED and unverified.elapsed<=itla.RESYNC_DEADLINE+0.05
+
+def test_upgrade_baud():
+    sim=SimulatedITLA(baudrate=9600)
+    assert itla.ITLAUpgradeBaud(sim,rates=(19200,115200))==115200
+    assert sim.baudrate==sim.device_baudrate==115200
+    assert itla.ITLA(sim,0x65,0,itla.READ)==1152
+    #rates the module rejects are skipped
+    sim=SimulatedITLA(baudrate=9600)
+    assert itla.ITLAUpgradeBaud(sim,rates=(230400,19200))==19200
+    assert sim.device_baudrate==19200
+
+def test_settle_detection():
+    sim=SimulatedITLA(baudrate=115200,tuning_time=0.1)
+    itla.ITLA(sim,0x35,194,itla.WRITE)
+    pending=itla.ITLAWaitUntilSettled(sim,deadline=0.02)
+    assert not pending.settled and pending.nop&itla.NOP_PENDING
+    settled=itla.ITLAWaitUntilSettled(sim,deadline=1.0,freq_tolerance_mhz=1)
+    assert settled.settled and abs(settled.frequency_thz-194.4)<1e-9
@@ -0,0 +1,39 @@
+#register table: addresses, scaling, range checks and named access against the simulator
+import pytest
+
+import ITLA_reference as itla
+from ITLA_registers import (REGISTERS,RESENA_MR,RESENA_SENA,RESENA_SR,Laser,address,channel_frequency,
+                            operation,register)
+from ITLA_simulator import SimulatedITLA
+
+def test_table_is_consistent():
+    assert len({entry.name for entry in REGISTERS})==len(REGISTERS)
+    for entry in REGISTERS:
+        assert 0<=entry.address<=0xFF
+        assert (entry.word is not None)<=entry.aea  #only AEA registers have words
+    assert address('reset_enable')==0x32 and RESENA_MR|RESENA_SR|RESENA_SENA==0x0B
+    with pytest.raises(KeyError): register('no_such_register')
+
+def test_scaling_and_ranges():
+    power=register('power_setpoint_dBm')
+    assert power.to_raw(13.5)==1350 and power.from_raw(1350)==pytest.approx(13.5)
+    assert power.to_raw(-1)==0xFFFF-99 and power.from_raw(0xFFFF-99)==pytest.approx(-1)
+    with pytest.raises(ValueError): power.to_raw(400)
+    with pytest.raises(ValueError): register('case_temp_C').to_raw(20)  #read-only
+    assert operation('ftf_MHz',-5)==(0x62,0xFFFB,itla.WRITE)
+    assert operation('ftf_MHz')==(0x62,0,itla.READ)
+
+def test_channel_frequency():
+    assert channel_frequency(193.4321)==(193,4321,0)
+    assert channel_frequency(193.432123)==(193,4321,23)
+    for outside in (191.0,197.0,float('nan')):
+        with pytest.raises(ValueError): channel_frequency(outside)
+
+def test_laser_named_access():
+    sim=SimulatedITLA(baudrate=115200)
+    laser=Laser(sim)
+    values=laser.read_many('laser_temp_C','ambient_temp_C','power_setpoint_dBm','serial_number')
+    assert values=={'laser_temp_C':pytest.approx(35.0),'ambient_temp_C':pytest.approx(27.5),
+                    'power_setpoint_dBm':pytest.approx(10.0),'serial_number':'SIM0001'}
+    assert laser.write('power_setpoint_dBm',12.25).ok and sim.registers[0x31]==1225
+    assert laser.frequency()==pytest.approx(193.4)
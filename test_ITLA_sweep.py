@@ -0,0 +1,34 @@
+#sweep planning: register values, skipped writes and range checks; execution against the simulator
+import numpy as np
+import pytest
+
+from ITLA_simulator import SimulatedITLA
+from ITLA_sweep import C,FCF_REGISTERS,execute_sweep,plan_sweep,read_current,read_frequency
+
+def test_plan_registers_and_changes():
+    plan=plan_sweep(freqs_thz=[193.4,193.4001,193.5,193.500001])
+    assert plan.registers.tolist()==[[193,4000,0],[193,4001,0],[193,5000,0],[193,5000,1]]
+    assert np.abs(plan.error_mhz).max()<1e-6
+    #the first point writes everything, later ones only what changes
+    assert [len(point) for point in plan.operations()]==[3,1,1,1]
+    assert plan.transactions(current=[193,4000,0])==3
+    assert plan.operations(current=[193,4000,0])[0]==[]
+
+def test_plan_from_wavelengths():
+    plan=plan_sweep(wavelengths_nm=[1550.0])
+    assert plan.freq_thz[0]==pytest.approx(C/1550e-9/1e12)
+
+def test_plan_rejects_bad_grids():
+    with pytest.raises(ValueError): plan_sweep(freqs_thz=[193.4,200.0])
+    with pytest.raises(ValueError): plan_sweep(freqs_thz=[])
+    with pytest.raises(ValueError): plan_sweep(freqs_thz=[193.4],wavelengths_nm=[1550.0])
+    with pytest.raises(ValueError): plan_sweep(freqs_thz=[193.4000004],max_error_mhz=0.1)
+
+def test_execute_sweep():
+    sim=SimulatedITLA(baudrate=115200)
+    plan=plan_sweep(freqs_thz=[193.4,193.45,194.0])
+    points=list(execute_sweep(sim,plan,snapshot=read_frequency,current=read_current(sim)))
+    assert [point.writes for point in points]==[0,1,2]
+    assert all(point.status==0 for point in points)
+    assert [point.snapshot for point in points]==pytest.approx([193.4,193.45,194.0])
+    assert [sim.registers[register] for register in FCF_REGISTERS]==[194,0,0]
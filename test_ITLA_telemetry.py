@@ -0,0 +1,45 @@
+#telemetry records: ring buffer, binary log round trip and appending to an existing log
+import time
+
+import pytest
+
+from ITLA_simulator import SimulatedITLA
+from ITLA_telemetry import DEFAULT_COLUMNS,DecimatingHistory,TelemetryRecorder,load_telemetry,read_header
+
+def test_log_round_trip(tmp_path):
+    path=str(tmp_path/'run.tlm')
+    sim=SimulatedITLA(baudrate=115200)
+    recorder=TelemetryRecorder(sim,path=path,capacity=8,flush_every=2)
+    recorder.start()
+    while recorder.samples<10: time.sleep(0.005)
+    recorder.stop()  #flushes the rest
+    columns,_=read_header(path)
+    assert columns==DEFAULT_COLUMNS
+    data=load_telemetry(path)
+    assert len(data)==recorder.samples and not data['status'].any()
+    assert (data['laser_temp']==3500).all() and (data['ambient_temp']==2750).all() and (data['freq_thz']==193).all()
+    assert [tuple(record) for record in data[-len(recorder.history()):].tolist()]==recorder.history()
+    assert recorder.latest()['power']==1000
+
+def test_append_checks_columns(tmp_path):
+    path=str(tmp_path/'run.tlm')
+    sim=SimulatedITLA(baudrate=115200)
+    for _ in range(2):  #the same columns append to the file
+        recorder=TelemetryRecorder(sim,path=path,interval=0.01)
+        recorder.start()
+        recorder.stop()
+    with pytest.raises(ValueError): TelemetryRecorder(sim,DEFAULT_COLUMNS[:2],path=path).start()
+
+def test_failed_columns_are_flagged():
+    sim=SimulatedITLA(baudrate=115200)
+    recorder=TelemetryRecorder(sim)
+    sim.inject('corrupt',1000,register=0x31)
+    sample=recorder.poll()
+    power=[column.name for column in DEFAULT_COLUMNS].index('power')
+    assert sample[-1]==1<<power and sample[1+power]==0 and recorder.errors==1
+
+def test_decimating_history_is_bounded():
+    history=DecimatingHistory(size=10)
+    for index in range(1000): history.add(index,index%7)
+    assert len(history.buckets)<=20 and sum(bucket[3] for bucket in history.buckets)==1000
+    assert min(bucket[1] for bucket in history.buckets)==0 and max(bucket[2] for bucket in history.buckets)==6
@@ -0,0 +1,42 @@
+#captures: a recorded session replays through the ITLA layer with the same values and statuses
+import pytest
+
+import ITLA_reference as itla
+from ITLA_simulator import SimulatedITLA
+from ITLA_transport import CaptureWriter,RecordingTransport,read_capture,transactions
+
+OPERATIONS=[(0x31,0,itla.READ),(0x31,1150,itla.WRITE),(0x04,0,itla.READ),(0x58,0,itla.READ),(0x99,0,itla.READ)]
+
+def session(sercon):
+    #(register, value, status) of a fixed sequence of operations
+    results=itla.ITLABatch(sercon,OPERATIONS)+[itla.ITLATransact(sercon,0x04,0,itla.READ)]
+    return [(result.register,result.value,result.status) for result in results]
+
+def test_capture_replays_deterministically(tmp_path):
+    path=str(tmp_path/'session.itlacap')
+    sim=SimulatedITLA(baudrate=115200)
+    sim.inject('corrupt',register=0x0B,skip=7)  #4+2 continuation reads, then the last serial number read fails mid-payload
+    capture=CaptureWriter(path,ports=['sim'])
+    recorded=RecordingTransport(sim,capture,owns_capture=True)
+    itla.ITLASetFramed(recorded)
+    itla.ITLAAddHook(recorded,capture.transaction)
+    live=session(recorded)
+    recorded.close()
+    assert sim.faults_injected['corrupt']==1 and live[-1][2]==itla.ITLA_CSERROR
+
+    header,events=read_capture(path)
+    assert header['ports']==['sim']
+    assert [(transaction.register,transaction.status) for transaction in transactions(events)]==[
+        (register,status) for register,_,status in live]
+
+    replay=itla.ITLAOpen('replay:%s?speed=0' %path)
+    itla.ITLASetFramed(replay)
+    assert session(replay)==live
+    assert replay.mismatches==0 and replay.finished
+    replay.close()
+
+def test_capture_never_overwrites(tmp_path):
+    path=tmp_path/'session.itlacap'
+    CaptureWriter(str(path)).close()
+    with pytest.raises(FileExistsError): CaptureWriter(str(path))
+    with pytest.raises(FileExistsError): itla.ITLAConnect('sim',capture=str(path))
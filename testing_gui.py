@@ -1,23 +1,51 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 import ITLA_reference as itla
+from ITLA_cache import RegisterCache
+from ITLA_registers import RESENA_SENA, Laser, address, register
+from ITLA_telemetry import Column, TelemetryRecorder, DecimatingHistory
+from ITLA_sweep import plan_sweep
+import queue
 import time
 import threading
 
-# Speed of light constant
-C = 299792458  # m/s
+FRAME_MS = 100             # UI refresh period; all widget updates are coalesced into one frame
+MAX_FEED_LINES = 500       # message feed keeps only the most recent lines
+MAX_MESSAGES_PER_FRAME = 50
+PLOT_BUCKETS = 300         # decimated plot points per trace, independent of history length
+POLL_INTERVAL = 0.1        # acquisition period (s)
+
+# Registers polled by the acquisition worker
+GUI_COLUMNS = (
+    Column('freq_thz', address('lf1_THz'), None),
+    Column('freq_frac', address('lf2_THz'), None),
+    Column('freq_mhz', address('lf3_THz'), None),
+    Column('laser_temp', address('laser_temp_C'), 0),
+)
+LF1, LF2, LF3, LASER_TEMP = (register(name) for name in ('lf1_THz', 'lf2_THz', 'lf3_THz', 'laser_temp_C'))
 
 class LaserControlApp:
     def __init__(self, master):
         self.master = master
         self.master.title("Pure Photonics Laser Control")
-        self.master.geometry("600x550")
+        self.master.geometry("600x750")
 
         # Connection and mode state
         self.sercon = None
+        self.registers = None  # RegisterCache for the current connection
+        self.laser = None      # named register access through the cache
+        self.recorder = None   # TelemetryRecorder feeding the frequency display and plot
+        self.failed_recorder = None  # recorder whose polling thread stopped, already reported
         self.laser_enabled = False
         self.whisper_mode = False
-        self.frequency_thread_running = False
+
+        # Work queues: device commands run on a worker thread, results and messages come back to the Tk thread
+        self.commands = queue.Queue()
+        self.ui_calls = queue.Queue()
+        self.messages = queue.Queue()
+        self.seen_samples = 0
+        self.freq_history = DecimatingHistory(PLOT_BUCKETS)
+        self.temp_history = DecimatingHistory(PLOT_BUCKETS)
 
         # -------------------------------
         # COM Port Selection Frame
@@ -68,6 +96,16 @@ class LaserControlApp:
         self.current_freq_label = ttk.Label(master, text="Current Frequency: ---")
         self.current_freq_label.pack(pady=5)
 
+        # -------------------------------
+        # Live Frequency / Temperature Plot
+        # -------------------------------
+        plot_frame = ttk.LabelFrame(master, text="History (frequency blue, laser temperature red)")
+        plot_frame.pack(side=tk.TOP, fill=tk.X, padx=10, pady=5)
+        self.plot = tk.Canvas(plot_frame, height=180, background="white")
+        self.plot.pack(side=tk.TOP, fill=tk.X, expand=True)
+        self.plot_range_label = ttk.Label(plot_frame, text="")
+        self.plot_range_label.pack(side=tk.TOP, anchor="w")
+
         # -------------------------------
         # Message Feed (Scrolling Terminal)
         # -------------------------------
@@ -79,23 +117,55 @@ class LaserControlApp:
         scrollbar.pack(side=tk.RIGHT, fill="y")
         self.message_feed.configure(yscrollcommand=scrollbar.set)
 
-        # Start the frequency update thread
-        self.start_frequency_thread()
+        # Start the device worker and the UI frame loop
+        threading.Thread(target=self.command_worker, daemon=True).start()
+        self.master.after(FRAME_MS, self.refresh_ui)
+
+    # ----------------------------------------
+    # Device Command Dispatch
+    # ----------------------------------------
+    def dispatch(self, action, done=None):
+        """Runs action() on the device worker thread; done(result) is then called on the Tk thread."""
+        self.commands.put((action, done))
+
+    def command_worker(self):
+        while True:
+            action, done = self.commands.get()
+            try:
+                result = action()
+            except Exception as e:
+                self.update_message(f"Command failed: {e}")
+                continue
+            if done is not None:
+                self.ui_calls.put((done, result))
 
     # ----------------------------------------
     # Connection Functions
     # ----------------------------------------
     def connect_laser_threaded(self):
-        threading.Thread(target=self.connect_laser, daemon=True).start()
+        port = self.com_port_var.get().strip()  # Tk variables are only read on the Tk thread
+        self.dispatch(lambda: self.connect_laser(port))
 
-    def connect_laser(self):
+    def connect_laser(self, port):
         self.update_message("Attempting to connect to laser...")
-        port = self.com_port_var.get().strip()
-        self.sercon = itla.ITLAConnect(port, 9600)
-        if isinstance(self.sercon, int):
-            self.update_message(f"Failed to connect to laser on {port}. Error code: {self.sercon}")
+        if self.recorder is not None:
+            self.recorder.stop()
+            self.recorder = None
+        sercon = itla.ITLAConnect(port, 9600)
+        if isinstance(sercon, int):
+            self.sercon = None
+            self.update_message(f"Failed to connect to laser on {port}. Error code: {sercon}")
+            return
+        self.sercon = sercon
+        if self.registers is None:
+            self.registers = RegisterCache(self.sercon)
         else:
-            self.update_message(f"Laser connected on {port}: {self.sercon}")
+            self.registers.reconnect(self.sercon)
+        self.laser = Laser(self.sercon, cache=self.registers)
+        self.recorder = TelemetryRecorder(self.sercon, GUI_COLUMNS, capacity=4096, interval=POLL_INTERVAL)
+        self.seen_samples = 0
+        self.recorder.start()
+        self.update_message(f"Laser connected on {port}: {self.sercon}")
 
     # ----------------------------------------
     # Laser Enable and Whisper Mode
@@ -106,15 +176,29 @@ class LaserControlApp:
             return
 
         if self.laser_enabled:
-            itla.ITLA(self.sercon, 0x32, 0, 1)  # Write 0 to disable
-            self.laser_enabled = False
-            self.enable_button.config(text="Enable Laser")
-            self.update_message("Laser disabled. You may now adjust frequency settings.")
+            self.dispatch(lambda: self.laser.write('reset_enable', 0), self.on_laser_disabled)  # Clear SENA to disable
         else:
-            itla.ITLA(self.sercon, 0x32, 1, 1)  # Write 1 to enable
-            self.laser_enabled = True
-            self.enable_button.config(text="Disable Laser")
-            self.update_message("Laser enabled. Frequency settings are locked; disable the laser to change them.")
+            self.dispatch(lambda: self.laser.write('reset_enable', RESENA_SENA), self.on_laser_enabled)  # Set SENA to enable
+
+    def report_failure(self, action, result):
+        # shows why a register write failed; the UI state is left as it was
+        self.update_message(f"{action} failed: status {result.status} (register 0x{result.register:02X}).")
+
+    def on_laser_disabled(self, result):
+        if not result.ok:
+            self.report_failure("Disabling the laser", result)
+            return
+        self.laser_enabled = False
+        self.enable_button.config(text="Enable Laser")
+        self.update_message("Laser disabled. You may now adjust frequency settings.")
+
+    def on_laser_enabled(self, result):
+        if not result.ok:
+            self.report_failure("Enabling the laser", result)
+            return
+        self.laser_enabled = True
+        self.enable_button.config(text="Disable Laser")
+        self.update_message("Laser enabled. Frequency settings are locked; disable the laser to change them.")
 
     def toggle_whisper(self):
         if not self.sercon:
@@ -125,94 +209,179 @@ class LaserControlApp:
             return
 
         if self.whisper_mode:
-            itla.ITLA(self.sercon, 0x90, 0, 1)  # Write 0 for dither mode
-            self.whisper_mode = False
-            self.whisper_button.config(text="Enable Whisper Mode")
-            self.update_message("Switched to dither mode.")
+            self.dispatch(lambda: self.laser.write('whisper_mode', 0), self.on_whisper_disabled)  # Write 0 for dither mode
         else:
-            itla.ITLA(self.sercon, 0x90, 2, 1)  # Write 2 for whisper mode
-            self.whisper_mode = True
-            self.whisper_button.config(text="Disable Whisper Mode")
-            self.update_message("Whisper mode enabled.")
+            self.dispatch(lambda: self.laser.write('whisper_mode', 2), self.on_whisper_enabled)  # Write 2 for whisper mode
+
+    def on_whisper_disabled(self, result):
+        if not result.ok:
+            self.report_failure("Switching to dither mode", result)
+            return
+        self.whisper_mode = False
+        self.whisper_button.config(text="Enable Whisper Mode")
+        self.update_message("Switched to dither mode.")
+
+    def on_whisper_enabled(self, result):
+        if not result.ok:
+            self.report_failure("Enabling whisper mode", result)
+            return
+        self.whisper_mode = True
+        self.whisper_button.config(text="Disable Whisper Mode")
+        self.update_message("Whisper mode enabled.")
 
     # ----------------------------------------
     # Frequency Setting Functions
     # ----------------------------------------
     def set_initial_frequency(self):
+        if not self.sercon:
+            messagebox.showerror("Error", "Laser not connected!")
+            return
         if self.laser_enabled:
             messagebox.showwarning("Warning", "Please disable the laser before adjusting frequency!")
             return
 
-        # Convert wavelength (nm) to frequency (Hz)
+        # Convert wavelength (nm) to the Device Settings registers:
+        # 0x35: integer part (THz), 0x36: 0.1 GHz units, 0x67: MHz units
         wavelength = self.wavelength_var.get()  # in nm
-        freq_hz = C / (wavelength * 1e-9)
-        freq_thz = freq_hz / 1e12  # in THz
-
-        # Split frequency into three parts for Device Settings:
-        # 0x35: integer part (THz)
-        int_thz = int(freq_thz)
-        # 0x36: fractional part in 0.1 GHz units (each count = 0.0001 THz)
-        frac_thz = freq_thz - int_thz
-        GHz_frac_value = int(round(frac_thz*1e-4)) # convert to .1GHz units
-        # 0x67: fine offset in MHz (each count = 1e-6 THz)
-        base_set_thz = int_thz + (GHz_frac_value * 1e4)
-        MHz_offset_thz = freq_thz - base_set_thz
-        MHz_frac_value = int(round(MHz_offset_thz / 1e-6))
-
-        # Write to registers (Device Settings)
-        itla.ITLA(self.sercon, 0x35, int_thz, 1)
-        itla.ITLA(self.sercon, 0x36, GHz_frac_value, 1)
-        itla.ITLA(self.sercon, 0x67, MHz_frac_value, 1)
+        try:
+            plan = plan_sweep(wavelengths_nm=[wavelength])
+        except ValueError as e:
+            messagebox.showerror("Error", f"Invalid wavelength: {e}")
+            return
+        int_thz, GHz_frac_value, MHz_frac_value = plan.registers[0].tolist()
+        freq_thz = plan.freq_thz[0]
+
+        # Write to registers (Device Settings) as one atomic batch, then wait for the module to settle
+        def set_and_settle():
+            for result in self.registers.batch(plan.operations()[0]):
+                if not result.ok:
+                    return result  # no settling on a frequency the module did not accept
+            return itla.ITLAWaitUntilSettled(self.sercon)
+        self.dispatch(set_and_settle, self.on_frequency_settled)
         self.update_message(
-            f"Initial frequency set: {int_thz} THz + {GHz_frac_value} (0.1GHz units) + {MHz_frac_value} (MHz fine offset) → {freq_thz:.6f} THz"
+            f"Setting initial frequency: {int_thz} THz + {GHz_frac_value} (0.1GHz units) + {MHz_frac_value} (MHz fine offset) → {freq_thz:.6f} THz"
         )
 
+    def on_frequency_settled(self, settle):
+        # settle is the failed write's ITLAResult, or the SettleResult once all writes succeeded
+        if isinstance(settle, itla.ITLAResult):
+            self.report_failure("Setting the frequency", settle)
+        elif settle.settled:
+            self.update_message(f"Frequency change settled after {settle.elapsed:.3f} s.")
+        else:
+            self.update_message(f"Frequency change not settled after {settle.elapsed:.1f} s (NOP {settle.nop}).")
+
     def apply_ftf_offset(self):
+        if not self.sercon:
+            messagebox.showerror("Error", "Laser not connected!")
+            return
         if self.laser_enabled:
             messagebox.showwarning("Warning", "Disable the laser before adjusting frequency!")
             return
 
         offset_mhz = self.ftf_offset_var.get()
-        itla.ITLA(self.sercon, 0x62, int(offset_mhz), 1)
+        try:
+            register('ftf_MHz').to_raw(offset_mhz)  # range check before queueing the write
+        except ValueError as e:
+            messagebox.showerror("Error", f"Invalid FTF offset: {e}")
+            return
+        self.dispatch(lambda: self.laser.write('ftf_MHz', offset_mhz), lambda result: self.on_ftf_applied(result, offset_mhz))
+
+    def on_ftf_applied(self, result, offset_mhz):
+        if not result.ok:
+            self.report_failure("Setting the FTF offset", result)
+            return
         self.update_message(f"FTF offset set to {offset_mhz} MHz. This offset is applied to the laser output frequency in real time.")
 
     # ----------------------------------------
-    # Frequency Readback Loop
+    # UI Frame Loop
     # ----------------------------------------
-    def frequency_update_loop(self):
-            """
-            Reads registers from Device Operating Information:
-            0x40: Laser frequency (THz)
-            0x41: Laser Frequency (0.1 MHz) [each count = 1e-7 THz]
-            0x68: Laser Frequency (MHz) [each count = 1e-6 THz]
-            The total frequency (in THz) is computed as:
-            total = (0x40) + (0x41)*1e-7 + (0x68)*1e-6
-            """
-            while self.frequency_thread_running:
-                if self.sercon:
-                    try:
-                        thz_int = itla.ITLA(self.sercon, 0x40, 0, 0)       # integer THz
-                        frac_0_1mhz = itla.ITLA(self.sercon, 0x41, 0, 0)  # fractional part in 0.1 MHz increments
-                        fine_mhz = itla.ITLA(self.sercon, 0x68, 0, 0)     # offset in MHz
-
-                        total_freq_thz = thz_int + (frac_0_1mhz * 1e-7) + (fine_mhz * 1e-6)
-
-                    except Exception as e:
-                        total_freq_thz = 0
-                        self.update_message(f"Error reading frequency: {e}")
-                    self.master.after(0, lambda: self.current_freq_label.config(text=f"Current Frequency: {total_freq_thz:.6f} THz"))
-                time.sleep(0.5)
-
-    def start_frequency_thread(self):
-        self.frequency_thread_running = True
-        threading.Thread(target=self.frequency_update_loop, daemon=True).start()
+    def refresh_ui(self):
+        """
+        Runs on the Tk thread every FRAME_MS: applies finished command results, appends queued
+        messages in one batch, and redraws the frequency display and plot from the telemetry
+        recorder. Registers read by the recorder (Device Operating Information):
+        0x40: Laser frequency (THz)
+        0x41: Laser Frequency (0.1 GHz) [each count = 1e-4 THz]
+        0x68: Laser Frequency (MHz) [each count = 1e-6 THz]
+        The total frequency (in THz) is computed as:
+        total = (0x40) + (0x41)*1e-4 + (0x68)*1e-6
+        """
+        try:
+            while True:
+                done, result = self.ui_calls.get_nowait()
+                done(result)
+        except queue.Empty:
+            pass
+        self.flush_messages()
+        recorder = self.recorder
+        if recorder is not None and recorder.failure is not None and recorder is not self.failed_recorder:
+            self.failed_recorder = recorder  # report a stopped recorder once
+            self.update_message(f"Telemetry stopped: {recorder.failure!r}")
+        samples = recorder.samples if recorder is not None else 0
+        if samples > self.seen_samples:
+            new = samples - self.seen_samples
+            latest_freq_thz = None
+            self.seen_samples = samples
+            for sample in recorder.history(new):
+                t, thz_int, frac_0_1ghz, fine_mhz, laser_temp, status = sample
+                if status & 0x7:  # frequency registers failed
+                    continue
+                total_freq_thz = LF1.from_raw(thz_int) + LF2.from_raw(frac_0_1ghz) + LF3.from_raw(fine_mhz)
+                self.freq_history.add(t, total_freq_thz)
+                latest_freq_thz = total_freq_thz
+                if not status & 0x8:
+                    self.temp_history.add(t, LASER_TEMP.from_raw(laser_temp))
+            if latest_freq_thz is not None:
+                self.current_freq_label.config(text=f"Current Frequency: {latest_freq_thz:.6f} THz")
+            self.draw_plot()
+        self.master.after(FRAME_MS, self.refresh_ui)
+
+    def draw_plot(self):
+        self.plot.delete("all")
+        width = self.plot.winfo_width() or 580
+        height = int(self.plot["height"])
+        ranges = []
+        for history, colour in ((self.freq_history, "blue"), (self.temp_history, "red")):
+            buckets = history.buckets
+            if len(buckets) < 2:
+                continue
+            t0, t1 = buckets[0][0], buckets[-1][0]
+            low = min(bucket[1] for bucket in buckets)
+            high = max(bucket[2] for bucket in buckets)
+            span = (high - low) or 1.0
+            points = []
+            for t, vmin, vmax, count in buckets:
+                x = 5 + (width - 10) * (t - t0) / ((t1 - t0) or 1.0)
+                points += [x, height - 5 - (height - 10) * (vmin - low) / span,
+                           x, height - 5 - (height - 10) * (vmax - low) / span]
+            self.plot.create_line(*points, fill=colour)
+            ranges.append((low, high, t1 - t0))
+        if len(ranges) == 2:
+            (flow, fhigh, duration), (tlow, thigh, _) = ranges
+            self.plot_range_label.config(
+                text=f"{duration:.0f} s: {(fhigh - flow) * 1e6:.1f} MHz span from {flow:.6f} THz, {tlow:.2f}-{thigh:.2f} C")
 
     # ----------------------------------------
     # Message Logging
     # ----------------------------------------
     def update_message(self, msg):
-        timestamp = time.strftime("[%H:%M:%S] ")
-        self.message_feed.insert(tk.END, timestamp + msg + "\n")
+        """Thread-safe: queues a message for the next UI frame."""
+        self.messages.put(time.strftime("[%H:%M:%S] ") + msg + "\n")
+
+    def flush_messages(self):
+        lines = []
+        try:
+            while len(lines) < MAX_MESSAGES_PER_FRAME:
+                lines.append(self.messages.get_nowait())
+        except queue.Empty:
+            pass
+        if not lines:
+            return
+        self.message_feed.insert(tk.END, "".join(lines))
+        excess = int(self.message_feed.index("end-1c").split(".")[0]) - MAX_FEED_LINES
+        if excess > 0:
+            self.message_feed.delete("1.0", f"{excess + 1}.0")
         self.message_feed.see(tk.END)
 
 # ------------------------------------------------------------------------------